@@ -1,49 +1,189 @@
-import pdfplumber
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import pdfplumber
+
+PAGES_PER_TASK = 16  # Pages extracted by one worker task; large codes are split across several cores.
+MANIFEST_NAME = "manifest.json"  # Lists, for each PDF, its size, mtime, hash and cache file.
+
+
+def extract_pages(input_pdf_path, first_page, last_page):
+    """
+    Extract the text of pages [first_page, last_page) of a PDF.
+    Runs in a worker process; returns one string per page ("" for pages without text).
+    """
+    with pdfplumber.open(input_pdf_path) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages[first_page:last_page]]
+
+
+def count_pages(input_pdf_path):
+    """
+    Return the number of pages of a PDF
+    """
+    with pdfplumber.open(input_pdf_path) as pdf:
+        return len(pdf.pages)
+
+
 def pdf_to_text(input_pdf_path):
     """
     Extract text from a PDF and return as string
     """
     try:
-        with pdfplumber.open(input_pdf_path) as pdf:
-            text = ""
-            for page in pdf.pages:
-                # Extract text from page
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n\n"  # Add spacing between pages
-            return text
-    
+        pages = extract_pages(input_pdf_path, 0, None)
+        # Add spacing between pages; joined once instead of growing a string page by page
+        return "".join(page_text + "\n\n" for page_text in pages if page_text)
+
     except Exception as e:
         print(f"Error processing {input_pdf_path}: {str(e)}")
         return None
 
-def batch_pdf_to_single_txt(input_dir, output_file_path):
+
+def file_sha256(path):
     """
-    Convert all PDFs in a directory to a single TXT file
+    Return the SHA-256 of a file, read in blocks
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(cache_dir):
+    """
+    Return the manifest of the previous run ({} if there is none or it is unreadable)
+    """
+    try:
+        with open(cache_dir / MANIFEST_NAME, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(cache_dir, manifest):
+    """
+    Write the manifest atomically, so an interrupted run never leaves it half written
+    """
+    tmp_path = cache_dir / (MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, cache_dir / MANIFEST_NAME)
+
+
+def find_changed_pdfs(pdf_files, manifest, cache_dir):
+    """
+    Split the PDFs into up-to-date ones (reused from the cache) and changed ones.
+    A PDF whose size and mtime match the manifest is not even hashed; one whose mtime
+    changed but whose content hash did not (e.g. after a copy) is also reused.
+    Returns (manifest entries of the unchanged PDFs, {name: (path, stat, sha256)} of the others).
+    """
+    unchanged, changed = {}, {}
+    for pdf_file in pdf_files:
+        stat = pdf_file.stat()
+        entry = manifest.get(pdf_file.name)
+        cached = entry is not None and (cache_dir / entry["cache"]).exists()
+        if cached and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            unchanged[pdf_file.name] = entry
+            continue
+        sha256 = file_sha256(pdf_file)
+        if cached and entry["sha256"] == sha256:
+            unchanged[pdf_file.name] = dict(entry, size=stat.st_size, mtime=stat.st_mtime)
+        else:
+            changed[pdf_file.name] = (pdf_file, stat, sha256)
+    return unchanged, changed
+
+
+def extract_changed_pdfs(changed, cache_dir, workers=None):
+    """
+    Extract the changed PDFs in a process pool, page ranges in parallel across cores,
+    and write one cache file per document. Returns the manifest entries of the PDFs
+    that were extracted; PDFs that fail are reported and left out.
+    """
+    entries = {}
+    if not changed:
+        return entries
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Page counts first (cheap), so every document can be cut into page ranges.
+        page_counts = {name: pool.submit(count_pages, path) for name, (path, _, _) in changed.items()}
+        tasks = {}
+        for name, future in page_counts.items():
+            try:
+                pages = future.result()
+            except Exception as e:
+                print(f"Error processing {changed[name][0]}: {str(e)}")
+                continue
+            tasks[name] = [pool.submit(extract_pages, changed[name][0], first, min(first + PAGES_PER_TASK, pages))
+                           for first in range(0, pages, PAGES_PER_TASK)]
+
+        for name in sorted(tasks):
+            pdf_file, stat, sha256 = changed[name]
+            print(f"Processing: {name}")
+            try:
+                pages = [page_text for future in tasks[name] for page_text in future.result()]
+            except Exception as e:
+                print(f"Error processing {pdf_file}: {str(e)}")
+                continue
+            cache_name = f"{sha256}.txt"
+            with open(cache_dir / cache_name, "w", encoding="utf-8") as f:
+                f.writelines(page_text + "\n\n" for page_text in pages if page_text)
+            entries[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256, "cache": cache_name}
+    return entries
+
+
+def batch_pdf_to_single_txt(input_dir, output_file_path, cache_dir=None, workers=None):
+    """
+    Convert all PDFs in a directory to a single TXT file.
+    Each PDF's text is kept in a cache file next to a manifest of hashes and mtimes, so
+    only new or modified PDFs are extracted again; documents are written in name order.
     """
     input_dir = Path(input_dir)
     output_file_path = Path(output_file_path)
-    
-    # Create parent directory if it doesn't exist
+    cache_dir = Path(cache_dir) if cache_dir else output_file_path.parent / ".extract_cache"
+
+    # Create parent and cache directories if they don't exist
     output_file_path.parent.mkdir(parents=True, exist_ok=True)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    pdf_files = sorted(input_dir.glob("*.pdf"), key=lambda path: path.name)  # Deterministic output order
+    manifest, changed = find_changed_pdfs(pdf_files, load_manifest(cache_dir), cache_dir)
+    print(f"{len(manifest)} PDF(s) up to date, {len(changed)} to extract")
+    manifest.update(extract_changed_pdfs(changed, cache_dir, workers))
+
+    # Remove cache files of PDFs that were deleted or changed since the last run
+    used = {entry["cache"] for entry in manifest.values()}
+    for cache_file in cache_dir.glob("*.txt"):
+        if cache_file.name not in used:
+            cache_file.unlink()
+    save_manifest(cache_dir, manifest)
+
+    # Stream the cached documents into the output; written to a temporary file first so
+    # readers never see a half-built corpus
+    tmp_path = output_file_path.with_name(output_file_path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as output_file:
+        for pdf_file in pdf_files:
+            entry = manifest.get(pdf_file.name)
+            if entry is None:
+                continue  # Extraction failed
+            # Add separator with PDF filename
+            output_file.write(f"\n\n=== {pdf_file.name} ===\n\n")
+            with open(cache_dir / entry["cache"], encoding="utf-8") as cached:
+                for block in iter(lambda: cached.read(1 << 20), ""):
+                    output_file.write(block)
+    os.replace(tmp_path, output_file_path)
 
-    with open(output_file_path, "w", encoding="utf-8") as output_file:
-        for pdf_file in input_dir.glob("*.pdf"):
-            print(f"Processing: {pdf_file.name}")
-            pdf_text = pdf_to_text(pdf_file)
-            if pdf_text:
-                # Add separator with PDF filename
-                output_file.write(f"\n\n=== {pdf_file.name} ===\n\n")
-                output_file.write(pdf_text)
-    
     print(f"All PDFs combined and saved to: {output_file_path}")
 
+
 if __name__ == "__main__":
-    # Set your input/output paths
+    # Set your input/output paths (or pass them on the command line: PDF_DIR OUTPUT_TXT)
     PDF_DIR = r"C:\Users\JUAN MIKE\Desktop\Bob-the-lawyer\Bob-the-lawyer\LOIS_LAWS"
     OUTPUT_TXT = "C:/Users/JUAN MIKE/Desktop/Bob-the-lawyer/Bob-the-lawyer/Create_dataset/CameroonLaw.txt"
-    
+    if len(sys.argv) == 3:
+        PDF_DIR, OUTPUT_TXT = sys.argv[1:]
+
     # Convert all PDFs to a single TXT file
-    batch_pdf_to_single_txt(PDF_DIR, OUTPUT_TXT)
\ No newline at end of file
+    batch_pdf_to_single_txt(PDF_DIR, OUTPUT_TXT)
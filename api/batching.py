@@ -0,0 +1,145 @@
+import asyncio  # Standard Python library for asynchronous programming, used here for the request queue and futures.
+import logging  # Standard Python library for logging events.
+import time  # Standard Python library, used to time the wait in the queue.
+from dataclasses import dataclass, field  # Used to declare simple data containers for queued requests.
+from fastapi.concurrency import run_in_threadpool  # Used to run the blocking model call in a separate thread.
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingRequest:
+    """
+    A single generation request waiting in the batch queue.
+    The future is resolved with the reply text once its batch has been generated.
+    """
+    prompt: str  # The fully formatted chat prompt.
+    max_new_tokens: int  # Maximum number of new tokens for this request only.
+    temperature: float  # Sampling temperature requested by the caller.
+    top_p: float  # Nucleus sampling probability requested by the caller.
+    future: asyncio.Future  # Resolved with the reply (or an exception) by the scheduler.
+    prefix: str = ""  # Leading part of the prompt shared with other requests (e.g. the system prompt).
+    timings: dict = field(default_factory=dict)  # Filled by `run_batch` with the stage timings of this request (metrics).
+    enqueued_at: float = field(default_factory=time.perf_counter)  # When it entered the queue.
+
+    @property
+    def group_key(self):
+        """Requests can only share one `generate` call if they use the same sampling settings and prefix."""
+        return (self.temperature, self.top_p, self.prefix)
+
+
+class BatchScheduler:
+    """
+    Collects concurrent generation requests and runs them through the model together.
+    Requests are gathered for up to `window_ms` milliseconds or until `max_batch_size`
+    requests are waiting, then each group of compatible requests is generated in one call.
+    """
+    def __init__(self, run_batch, max_batch_size: int = 8, window_ms: float = 25.0):
+        self.run_batch = run_batch  # Blocking callable taking a list of PendingRequest and returning a list of replies.
+        self.max_batch_size = max(1, max_batch_size)  # At least one request per batch.
+        self.window = max(0.0, window_ms) / 1000.0  # Collection window in seconds.
+        self.queue = None  # Created lazily so it belongs to the running event loop.
+        self.worker = None  # Background task that drains the queue.
+
+    def start(self):
+        """Starts the background batching task if it is not already running."""
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.create_task(self._run())
+            logger.info(f"Batch scheduler started (max_batch_size={self.max_batch_size}, window={self.window * 1000:.0f} ms).")
+
+    async def stop(self):
+        """Cancels the background task. Requests still waiting in the queue are cancelled too."""
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        while self.queue is not None and not self.queue.empty():
+            self.queue.get_nowait().future.cancel()
+
+    async def submit(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, prefix: str = "",
+                     timings: dict = None) -> str:
+        """
+        Queues a prompt and waits until the scheduler has generated its reply.
+        `timings`, if given, is the dict that `run_batch` fills with the stage timings of this request.
+        """
+        self.start()  # Makes sure the worker is running before queueing.
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(PendingRequest(prompt, max_new_tokens, temperature, top_p, future, prefix,
+                                            timings if timings is not None else {}))
+        return await future
+
+    async def _collect(self):
+        """Waits for one request, then keeps collecting until the window closes or the batch is full."""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]  # Block until there is at least one request.
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():  # Take whatever is already waiting without sleeping.
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        """Main loop of the scheduler: collect a batch, split it into compatible groups, generate."""
+        while True:
+            batch = await self._collect()
+            groups = {}
+            for pending in batch:
+                groups.setdefault(pending.group_key, []).append(pending)
+            for group in groups.values():
+                await self._dispatch(group)
+
+    async def _dispatch(self, group):
+        """Runs one group through the model in a worker thread and resolves each caller's future."""
+        group = [pending for pending in group if not pending.future.done()]  # Skip callers that went away.
+        if not group:
+            return
+        logger.info(f"Running batch of {len(group)} request(s).")
+        try:
+            replies = await run_in_threadpool(self.run_batch, group)
+        except Exception as e:
+            # Every caller in the batch gets the error so the endpoint can report it.
+            for pending in group:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+        for pending, reply in zip(group, replies):
+            if not pending.future.done():
+                pending.future.set_result(reply)
+
+
+@dataclass
+class PendingSearch:
+    """A retrieval query waiting to be embedded and scored together with other queries."""
+    query: str  # The user's question.
+    top_k: int  # Number of chunks wanted for this query.
+    future: asyncio.Future  # Resolved with the list of (score, chunk) pairs.
+
+    @property
+    def group_key(self):
+        """All queries share one encoder pass and one matrix multiply, whatever their top_k."""
+        return None
+
+
+class SearchScheduler(BatchScheduler):
+    """
+    Batches concurrent retrieval queries the same way BatchScheduler batches generations.
+    `run_batch` receives a list of PendingSearch and returns one result list per query.
+    """
+    async def submit(self, query: str, top_k: int):
+        """Queues a query and waits until its batch has been searched."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(PendingSearch(query, top_k, future))
+        return await future
@@ -0,0 +1,30 @@
+"""
+Builds the merged model snapshot loaded by contact_model.py at startup.
+
+Downloads the base model and the LoRA adapter, merges them, and writes the result
+as safetensors files to MODEL_SNAPSHOT_DIR. Run once at image build time:
+
+    python build_snapshot.py
+"""
+import logging  # Standard Python library for logging events.
+from transformers import AutoTokenizer, AutoModelForCausalLM  # Used to download the base model and tokenizer.
+from peft import PeftModel  # Used to apply the LoRA adapter before merging it.
+from contact_model import BASE_MODEL_ID, ADAPTER_ID, MODEL_SNAPSHOT_DIR  # Same model and location as the server.
+from snapshot import write_snapshot  # Writes the memory-mappable files.
+
+logger = logging.getLogger(__name__)
+
+
+def build_snapshot(snapshot_dir=MODEL_SNAPSHOT_DIR):
+    """Merges ADAPTER_ID into BASE_MODEL_ID and saves the merged model and tokenizer to `snapshot_dir`."""
+    logger.info(f"Loading base model {BASE_MODEL_ID} and adapter {ADAPTER_ID}")
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_ID)
+    base_model = AutoModelForCausalLM.from_pretrained(BASE_MODEL_ID)
+    model = PeftModel.from_pretrained(base_model, ADAPTER_ID)
+    logger.info("Merging adapter into the base weights")
+    merged_model = model.merge_and_unload()  # A plain model with the LoRA update folded into its Linear layers.
+    write_snapshot(merged_model, tokenizer, snapshot_dir)
+
+
+if __name__ == "__main__":
+    build_snapshot()
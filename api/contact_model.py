@@ -1,11 +1,21 @@
-from fastapi import FastAPI, HTTPException  # Used to create the API and handle HTTP errors.
-from fastapi.concurrency import run_in_threadpool  # Used to run synchronous tasks in a separate thread, optimizing performance.
+from fastapi import FastAPI, HTTPException, Response  # Used to create the API, handle HTTP errors and set response headers.
+from fastapi.responses import PlainTextResponse, StreamingResponse  # Used for the metrics text and to send generated tokens as server-sent events.
 from pydantic import BaseModel  # Used for data validation and settings management using Python type annotations.
 import torch  # PyTorch library, used here for tensor operations and GPU support if available.
-from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM, StoppingCriteriaList, StoppingCriteria  # Hugging Face Transformers library for NLP tasks, model loading, and tokenization.
+from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM, StoppingCriteriaList, StoppingCriteria, TextIteratorStreamer  # Hugging Face Transformers library for NLP tasks, model loading, and tokenization.
 from peft import PeftModel  # Performance Efficient Fine-tuning (PEFT) library for applying adapters like LoRA to models.
 import logging  # Standard Python library for logging events.
 import os  # Standard Python library for interacting with the operating system, e.g., environment variables.
+import json  # Standard Python library for encoding the streamed events as JSON.
+import threading  # Standard Python library, used to run streamed generation in its own thread.
+import time  # Standard Python library, used to time the stages of a request.
+from batching import BatchScheduler, SearchScheduler  # Collects concurrent requests so they can share one generate call (or one search).
+from snapshot import snapshot_exists, load_snapshot  # Fast, memory-mapped loading of a prebuilt merged model.
+from prefix_cache import PrefixCache  # Reuses the keys/values of the system prompt across requests.
+from response_cache import ResponseCache  # Serves repeated questions without running the model.
+from retrieval import BM25Index, format_context  # Finds the law articles relevant to a question.
+from dense_retrieval import DenseIndex, TextEncoder, dense_index_exists  # Embedding search over the same articles.
+from metrics import Registry, Counter, Gauge, Histogram, RATE_BUCKETS, TOKEN_BUCKETS, process_rss_bytes, server_timing_header  # Prometheus metrics.
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,60 +29,374 @@ SYSTEM_PROMPT = "Respond conversationally and concisely. Do not make any convers
 BASE_MODEL_ID = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
 ADAPTER_ID = "juanvic/tinyllama-cameroon-law-lora"
 
+# --- Inference Mode ---: Selects how the fine-tuned model is prepared for inference at startup.
+# "adapter": base model in fp32 with the LoRA adapter applied on the fly (original behaviour).
+# "merged": the adapter is merged into the base weights, so each forward pass skips the adapter layers.
+# "int8": merged, then the Linear layers are dynamically quantized to int8 (CPU only).
+# "bf16": merged, then cast to bfloat16 where the hardware supports it.
+INFERENCE_MODES = ("adapter", "merged", "int8", "bf16")
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "adapter").lower()
+
+# --- Model Snapshot ---: Directory of the merged model written at build time by build_snapshot.py.
+# When it exists, load_model maps it from disk instead of downloading and merging the model.
+MODEL_SNAPSHOT_DIR = os.getenv("MODEL_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshot"))
+
+# --- Prefix Cache ---: Number of distinct system prompt prefixes whose keys/values are kept in memory.
+# Set to 0 to prefill the whole prompt on every request.
+PREFIX_CACHE_SIZE = int(os.getenv("PREFIX_CACHE_SIZE", 4))
+
+# --- Response Cache ---: Replies to repeated questions are served from memory (and optionally SQLite).
+# Only deterministic requests (temperature <= 0, i.e. greedy decoding) are cached, unless
+# RESPONSE_CACHE_SAMPLED=1, in which case a stored sample is reused for sampled requests too.
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256))  # 0 disables the cache.
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 24 * 3600))  # Seconds before an entry expires.
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB")  # Path of an SQLite file that keeps the cache across restarts.
+RESPONSE_CACHE_SAMPLED = os.getenv("RESPONSE_CACHE_SAMPLED", "0") == "1"
+
+# --- Retrieval ---: Relevant law articles are looked up in a BM25 index and added to the prompt.
+# The index is built from data/CameroonLaw.txt (a copy of DATA_USED/LawsTXT/CameroonLaw.txt) with
+# `python retrieval.py CORPUS INDEX`, by the Dockerfile. The server does not start without it.
+LAW_INDEX_PATH = os.getenv("LAW_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "law_index.json.gz"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 3))  # Number of articles added to the prompt. 0 disables retrieval.
+RETRIEVAL_MAX_CHARS = int(os.getenv("RETRIEVAL_MAX_CHARS", 600))  # Characters kept from each article.
+# RETRIEVAL_BACKEND=dense searches the embedding index in DENSE_INDEX_DIR instead, built with
+# `python dense_retrieval.py CORPUS INDEX_DIR`. Falls back to BM25 if that index is missing.
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "bm25").lower()
+DENSE_INDEX_DIR = os.getenv("DENSE_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dense_index"))
+SEARCH_BATCH_MAX_SIZE = int(os.getenv("SEARCH_BATCH_MAX_SIZE", 32))  # Questions embedded and scored together.
+SEARCH_BATCH_WINDOW_MS = float(os.getenv("SEARCH_BATCH_WINDOW_MS", 5))  # Wait for more questions after the first.
+
+# --- Batching Configuration ---: Controls how concurrent requests are grouped into one generate call.
+# BATCH_MAX_SIZE is the largest number of requests generated together.
+# BATCH_WINDOW_MS is how long the scheduler waits for more requests after the first one arrives.
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 8))
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", 25))
+
 # --- Global variables for model and tokenizer ---: Declares global variables to hold the loaded model and tokenizer for reuse.
 chat_pipeline_global = None
 tokenizer_global = None
+stop_token_ids_global = None  # Tensor of token ids that end a reply, computed once in load_model.
+prefix_cache = PrefixCache(max_entries=PREFIX_CACHE_SIZE)  # Precomputed keys/values of the system prompt(s).
+law_index_global = None  # BM25 index of the law corpus, loaded by load_law_index.
+dense_index_global = None  # Memory-mapped embedding index, loaded by load_law_index when RETRIEVAL_BACKEND=dense.
+text_encoder_global = None  # Embedding model for the questions, the one the dense index was built with.
+response_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE, ttl_seconds=RESPONSE_CACHE_TTL, db_path=RESPONSE_CACHE_DB)
+
+# --- Metrics ---: Served in the Prometheus text format at /metrics. Latencies are in seconds;
+# "prefill" runs from the start of `generate` to the first new token, "decode" from there to the last one.
+metrics_registry = Registry()
+requests_total = metrics_registry.register(Counter(
+    "lawbot_requests_total", "Generation requests by endpoint and outcome (ok, cached, error, cancelled, unavailable).", ("endpoint", "outcome")))
+requests_in_flight = metrics_registry.register(Gauge("lawbot_requests_in_flight", "Generation requests being answered."))
+request_duration = metrics_registry.register(Histogram(
+    "lawbot_request_duration_seconds", "Time to answer a generation request (the whole stream for /stream).", ("endpoint",)))
+retrieval_seconds = metrics_registry.register(Histogram("lawbot_retrieval_seconds", "Time to find the law articles of a question."))
+queue_wait_seconds = metrics_registry.register(Histogram("lawbot_queue_wait_seconds", "Time a request waited in the batch queue."))
+tokenization_seconds = metrics_registry.register(Histogram("lawbot_tokenization_seconds", "Time to tokenize the prompt(s) of a generate call."))
+prefill_seconds = metrics_registry.register(Histogram("lawbot_prefill_seconds", "Time from the start of generate to the first new token."))
+decode_seconds = metrics_registry.register(Histogram("lawbot_decode_seconds", "Time from the first to the last new token of a reply."))
+time_to_first_token = metrics_registry.register(Histogram(
+    "lawbot_time_to_first_token_seconds", "Time from the arrival of a request to its first generated token.", ("endpoint",)))
+decode_rate = metrics_registry.register(Histogram(
+    "lawbot_decode_tokens_per_second", "Tokens per second decoded after the first one.", buckets=RATE_BUCKETS))
+generated_tokens = metrics_registry.register(Histogram(
+    "lawbot_generated_tokens", "Tokens generated per reply.", buckets=TOKEN_BUCKETS))
+metrics_registry.register(Gauge("process_resident_memory_bytes", "Resident memory of the server process.", function=process_rss_bytes))
+TIMING_STAGES = ("retrieval", "queue", "tokenize", "prefill", "decode")  # Stages reported in the Server-Timing header.
+
+def get_stop_token_ids(tokenizer_ref) -> torch.LongTensor:
+    """
+    Returns the ids of the tokens that end a reply (sentence terminators, newline and EOS).
+    Called once at load time so the stopping criterion does no tokenizer lookups per step.
+    """
+    stop_tokens_ids = [
+        tokenizer_ref.convert_tokens_to_ids("."),
+        tokenizer_ref.convert_tokens_to_ids("?"),
+        tokenizer_ref.convert_tokens_to_ids("!"),
+        tokenizer_ref.eos_token_id,
+    ]
+    # A newline is not a token of the Llama (SentencePiece) vocabulary: it is encoded as the byte
+    # token "<0x0A>", after a "▁" prefix. The last id of the encoded newline is that token.
+    newline_ids = tokenizer_ref.encode("\n", add_special_tokens=False)
+    if newline_ids:
+        stop_tokens_ids.append(newline_ids[-1])
+    # convert_tokens_to_ids returns the <unk> id for a token the vocabulary does not know; <unk>
+    # must not end a reply. A missing eos_token_id is None.
+    unknown_ids = {None, tokenizer_ref.unk_token_id}
+    return torch.tensor(sorted({token_id for token_id in stop_tokens_ids if token_id not in unknown_ids}), dtype=torch.long)
 
 class StopOnTokens(StoppingCriteria):
     """
     Defines a custom stopping criterion for text generation.  The generation will stop
     when certain tokens (like sentence terminators) are encountered.
+    The check is done per row, so in a batch each sequence stops on its own.
     """
-    def __init__(self, tokenizer_ref):
-        # Stores a reference to the tokenizer to access its properties like eos_token_id.
-        self.tokenizer_ref = tokenizer_ref
+    def __init__(self, stop_token_ids: torch.LongTensor):
+        # Precomputed stop ids (see get_stop_token_ids), already on the model's device.
+        self.stop_token_ids = stop_token_ids
 
-    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
         """
         Evaluates whether the generation should stop based on the last generated token.
-        This method is called at each generation step.
+        This method is called at each generation step and returns one flag per row,
+        using a single vectorized lookup with no Python loop and no device sync.
         """
-        # Ensure eos_token_id is not None before trying to use it
-        eos_token_id = self.tokenizer_ref.eos_token_id if self.tokenizer_ref.eos_token_id is not None else -1 # Use a dummy if None
-        stop_tokens_ids = [
-            self.tokenizer_ref.convert_tokens_to_ids("."),
-            self.tokenizer_ref.convert_tokens_to_ids("?"),
-            self.tokenizer_ref.convert_tokens_to_ids("!"),
-            self.tokenizer_ref.convert_tokens_to_ids("\n"),
-            eos_token_id,
-        ]
-        # Returns True if the last generated token is one of the stop tokens, signaling the generation to halt.
-        return input_ids[0][-1].item() in stop_tokens_ids
+        return torch.isin(input_ids[:, -1], self.stop_token_ids)
+
+class StopAtRowLength(StoppingCriteria):
+    """
+    Stops each row of a batch once it reaches its own length limit, so a request asking
+    for few tokens is not kept running by a neighbour that asked for more.
+    """
+    def __init__(self, max_lengths: torch.LongTensor):
+        # Total length (prompt + new tokens) allowed for each row of the batch, on the model's device.
+        self.max_lengths = max_lengths
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return input_ids.shape[-1] >= self.max_lengths
+
+class GenerationTimer(StoppingCriteria):
+    """
+    Never stops the generation: records when each step produced its tokens, since stopping
+    criteria run once per step. Used to split a generate call into prefill and decode time.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()  # Start of the generate call.
+        self.steps = []  # time.perf_counter() at the end of each step.
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.steps.append(time.perf_counter())
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+    def timings(self, tokens: int) -> dict:
+        """Prefill and decode time of a row that generated `tokens` tokens, and when its first token came out."""
+        if not self.steps:
+            return {}
+        last_step = self.steps[min(max(tokens, 1), len(self.steps)) - 1]
+        return {
+            "prefill": self.steps[0] - self.started,
+            "decode": last_step - self.steps[0],
+            "first_token_at": self.steps[0],
+            "tokens": tokens,
+        }
+
+class StopOnCancel(StoppingCriteria):
+    """
+    Stops the generation as soon as the given event is set. Used by the streaming endpoint
+    so that generation ends when the client disconnects instead of running to completion.
+    """
+    def __init__(self, cancel_event: threading.Event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.cancel_event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+def cpu_supports_bf16() -> bool:
+    """Returns True if the CPU has native bfloat16 instructions (AVX512-BF16 or AMX), which makes bf16 worthwhile."""
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:  # Only available on Linux, which is what the Spaces run.
+            flags = cpuinfo.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+def prepare_model_for_inference(model, mode: str, on_cuda: bool):
+    """
+    Applies the requested inference mode (see INFERENCE_MODES) to a PeftModel, or to an
+    already merged model loaded from a snapshot, and returns the model to serve.
+    Modes that the hardware cannot run fall back to the merged model.
+    """
+    if mode not in INFERENCE_MODES:
+        logger.warning(f"Unknown INFERENCE_MODE '{mode}', expected one of {INFERENCE_MODES}. Using 'adapter'.")
+        mode = "adapter"
+    is_peft_model = hasattr(model, "merge_and_unload")  # Snapshots are merged already.
+    if mode == "adapter":
+        if not is_peft_model:
+            logger.info("The model snapshot is already merged; serving it as in 'merged' mode.")
+        return model
+
+    if is_peft_model:
+        # Fold the LoRA weights into the base Linear layers and drop the adapter wrappers.
+        logger.info("Merging LoRA adapter into the base model.")
+        model = model.merge_and_unload()
+    model.eval()
+
+    if mode == "int8":
+        if on_cuda:
+            logger.warning("int8 dynamic quantization only runs on CPU. Serving the merged fp32 model instead.")
+            return model
+        if "fbgemm" not in torch.backends.quantized.supported_engines:
+            torch.backends.quantized.engine = "qnnpack"  # ARM CPUs (e.g. Apple silicon) only have qnnpack.
+        logger.info("Applying dynamic int8 quantization to Linear layers.")
+        # Weights are stored as int8; activations are quantized on the fly at each matmul.
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if mode == "bf16":
+        supported = torch.cuda.is_bf16_supported() if on_cuda else cpu_supports_bf16()
+        if not supported:
+            logger.warning("bfloat16 is not supported natively on this hardware. Serving the merged fp32 model instead.")
+            return model
+        logger.info("Casting merged model to bfloat16.")
+        return model.to(torch.bfloat16)
+
+    return model
+
+def build_prompt_prefix(system_prompt: str = SYSTEM_PROMPT) -> str:
+    """Constructs the system part of the prompt, which is the same for every request."""
+    return f"<|system|> {system_prompt}\n"
+
+def build_prompt(user_input: str, system_prompt: str = SYSTEM_PROMPT, context: str = "", history: str = "",
+                 documents: str = "") -> str:
+    """
+    Constructs the prompt in the format expected by the chat model. The earlier turns of the
+    discussion, the user's attached documents and the retrieved law articles, when given,
+    each get their own section before the question.
+    """
+    sections = [(heading, text) for heading, text in (("Conversation so far", history), ("Attached documents", documents),
+                                                       ("Relevant law", context)) if text]
+    user_turn = "".join(f"{heading}:\n{text}\n\n" for heading, text in sections)
+    user_turn = f"{user_turn}Question: {user_input}" if sections else user_input
+    return (
+        build_prompt_prefix(system_prompt) +
+        f"<|user|> {user_turn}\n"
+        f"<|assistant|>"
+    )
+
+def search_dense_batch(batch):
+    """
+    Answers a group of queued retrieval queries with one encoder pass and one matrix multiply.
+    This function is blocking and is run in a worker thread by the search scheduler.
+    """
+    results = dense_index_global.search_batch(text_encoder_global, [pending.query for pending in batch],
+                                              max(pending.top_k for pending in batch))
+    return [rows[:pending.top_k] for rows, pending in zip(results, batch)]
+
+# Concurrent questions are embedded and scored against the dense index together.
+search_scheduler = SearchScheduler(search_dense_batch, max_batch_size=SEARCH_BATCH_MAX_SIZE, window_ms=SEARCH_BATCH_WINDOW_MS)
+
+def retrieval_version():
+    """Identifies the index that retrieval currently uses (None if retrieval is off), for the response cache key."""
+    if RETRIEVAL_TOP_K <= 0:
+        return None
+    if dense_index_global is not None:
+        return f"dense:{dense_index_global.model_id}:{dense_index_global.corpus_digest}"
+    return law_index_global.corpus_digest if law_index_global is not None else None
+
+async def retrieve_context(user_input: str) -> str:
+    """Returns the law articles most relevant to the question, formatted for the prompt ("" if retrieval is off)."""
+    if RETRIEVAL_TOP_K <= 0:
+        return ""
+    if dense_index_global is not None:
+        results = await search_scheduler.submit(user_input, RETRIEVAL_TOP_K)
+    elif law_index_global is not None:
+        results = law_index_global.search(user_input, RETRIEVAL_TOP_K)
+    else:
+        return ""
+    return format_context(results, max_chars=RETRIEVAL_MAX_CHARS)
+
+def sampling_kwargs(temperature: float, top_p: float) -> dict:
+    """Returns the sampling arguments for `generate`. A temperature of 0 or less selects greedy (deterministic) decoding."""
+    if temperature <= 0:
+        return {"do_sample": False}
+    return {
+        "do_sample": True,  # Enable sampling for diverse outputs
+        "temperature": temperature,  # Controls randomness (higher = more random)
+        "top_p": top_p,  # Nucleus sampling (limits the pool of tokens to sample from)
+    }
+
+def build_generation_inputs(model, prompts, prefix: str) -> dict:
+    """
+    Tokenizes a batch of prompts that all start with `prefix` and returns the keyword
+    arguments for `generate`. When the prefix cache has the prefix, its keys/values are
+    passed as past_key_values so that only the tokens after the prefix are prefilled.
+    """
+    prefix_entry = prefix_cache.get(model, tokenizer_global, prefix) if prefix else None
+    if prefix_entry is not None:
+        prefix_ids = prefix_entry.token_ids
+        rows = tokenizer_global(prompts)["input_ids"]
+        # The cache can only be used if every prompt tokenizes to the cached prefix followed by its own tokens.
+        if all(row[:len(prefix_ids)] == prefix_ids for row in rows):
+            suffixes = [row[len(prefix_ids):] for row in rows]
+            width = max(len(suffix) for suffix in suffixes)
+            pad_id = tokenizer_global.pad_token_id
+            # Layout of each row: cached prefix, then padding, then the row's own tokens, so that
+            # all rows end where generation starts. The attention mask hides the padding.
+            input_ids = [prefix_ids + [pad_id] * (width - len(suffix)) + suffix for suffix in suffixes]
+            attention_mask = [[1] * len(prefix_ids) + [0] * (width - len(suffix)) + [1] * len(suffix) for suffix in suffixes]
+            return {
+                "input_ids": torch.tensor(input_ids, device=model.device),
+                "attention_mask": torch.tensor(attention_mask, device=model.device),
+                "past_key_values": PrefixCache.copy_for_batch(prefix_entry, len(prompts)),
+            }
+        logger.warning("Prompt does not start with the cached prefix tokens; prefilling the whole prompt.")
+    # No usable cache: left-pad the full prompts into one tensor.
+    return dict(tokenizer_global(prompts, return_tensors="pt", padding=True).to(model.device))
+
+def load_law_index():
+    """
+    Loads the law index at startup: the dense index and its embedding model when
+    RETRIEVAL_BACKEND=dense, otherwise (or if it was not built) the BM25 index.
+    A missing BM25 index stops the startup: answers would silently lose their law articles.
+    Set RETRIEVAL_TOP_K=0 to serve without retrieval.
+    """
+    global law_index_global, dense_index_global, text_encoder_global
+    if RETRIEVAL_TOP_K <= 0:
+        logger.info("RETRIEVAL_TOP_K=0; answering without retrieval.")
+        return
+    if RETRIEVAL_BACKEND == "dense":
+        if dense_index_exists(DENSE_INDEX_DIR):
+            dense_index_global = DenseIndex.load(DENSE_INDEX_DIR)
+            text_encoder_global = TextEncoder(dense_index_global.model_id)
+            logger.info(f"Mapped dense law index with {len(dense_index_global)} articles from {DENSE_INDEX_DIR}")
+            return
+        logger.warning(f"No dense law index in {DENSE_INDEX_DIR}; falling back to BM25.")
+    if not os.path.exists(LAW_INDEX_PATH):
+        raise RuntimeError(f"No law index at {LAW_INDEX_PATH}. Build it with `python retrieval.py data/CameroonLaw.txt "
+                           f"{LAW_INDEX_PATH}`, or set RETRIEVAL_TOP_K=0 to answer without retrieval.")
+    law_index_global = BM25Index.load(LAW_INDEX_PATH)
+    logger.info(f"Loaded law index with {len(law_index_global.chunks)} articles from {LAW_INDEX_PATH}")
 
 def load_model():
     """
-    Loads the tokenizer, base model, and applies the adapter. Initializes the text
-    generation pipeline. Handles potential errors during loading.
+    Loads the tokenizer, base model, and applies the adapter (or maps the prebuilt merged
+    snapshot when there is one). Initializes the text generation pipeline.
+    Handles potential errors during loading.
     """
-    global chat_pipeline_global, tokenizer_global
+    global chat_pipeline_global, tokenizer_global, stop_token_ids_global
     # This function is designed to be called once at startup to initialize the model and tokenizer.
     try:
-        logger.info(f"Loading tokenizer for base model: {BASE_MODEL_ID}")
-        tokenizer_global = AutoTokenizer.from_pretrained(BASE_MODEL_ID)
+        if snapshot_exists(MODEL_SNAPSHOT_DIR):
+            # Fast path: the merged model was written at build time. Its weights are memory-mapped,
+            # so startup does not read the whole file and uvicorn workers share the page cache.
+            logger.info(f"Loading tokenizer and merged model snapshot from: {MODEL_SNAPSHOT_DIR}")
+            tokenizer_global = AutoTokenizer.from_pretrained(MODEL_SNAPSHOT_DIR)
+            model = load_snapshot(MODEL_SNAPSHOT_DIR)
+        else:
+            logger.info(f"Loading tokenizer for base model: {BASE_MODEL_ID}")
+            tokenizer_global = AutoTokenizer.from_pretrained(BASE_MODEL_ID)
 
-        logger.info(f"Loading base model: {BASE_MODEL_ID}")
-        base_model = AutoModelForCausalLM.from_pretrained(BASE_MODEL_ID)
-        logger.info(f"Base model '{BASE_MODEL_ID}' loaded successfully.")
+            logger.info(f"Loading base model: {BASE_MODEL_ID}")
+            base_model = AutoModelForCausalLM.from_pretrained(BASE_MODEL_ID)
+            logger.info(f"Base model '{BASE_MODEL_ID}' loaded successfully.")
 
-        logger.info(f"Loading and applying adapter: {ADAPTER_ID}")
-        model = PeftModel.from_pretrained(base_model, ADAPTER_ID)
-        logger.info(f"Adapter '{ADAPTER_ID}' loaded and applied to the base model.")
+            logger.info(f"Loading and applying adapter: {ADAPTER_ID}")
+            model = PeftModel.from_pretrained(base_model, ADAPTER_ID)
+            logger.info(f"Adapter '{ADAPTER_ID}' loaded and applied to the base model.")
+
+        # Batched prompts are left-padded so that every row ends right where generation starts.
+        tokenizer_global.padding_side = "left"
+        if tokenizer_global.pad_token is None:
+            tokenizer_global.pad_token = tokenizer_global.eos_token
 
         # Determine if CUDA (GPU) is available and set the device accordingly.
         device_num = 0 if torch.cuda.is_available() else -1
         device_name = "CUDA" if device_num == 0 else "CPU"
         logger.info(f"Using {device_name} for inference.")
 
+        # Merge and/or quantize the model according to the INFERENCE_MODE environment variable.
+        logger.info(f"Inference mode: {INFERENCE_MODE}")
+        model = prepare_model_for_inference(model, INFERENCE_MODE, on_cuda=device_num == 0)
+
         # Initialize the text generation pipeline with the loaded model, tokenizer, and device.
         chat_pipeline_global = pipeline(
             "text-generation",
@@ -82,17 +406,68 @@ def load_model():
         )
         logger.info("Text generation pipeline initialized successfully.")
 
+        # Precompute the stop token ids once, on the same device as the model.
+        stop_token_ids_global = get_stop_token_ids(tokenizer_global).to(chat_pipeline_global.device)
+        logger.info(f"Stop token ids: {stop_token_ids_global.tolist()}")
+
+        # Compute the keys/values of the system prompt now, so the first request does not pay for it.
+        prefix_cache.get(chat_pipeline_global.model, tokenizer_global, build_prompt_prefix())
+
     except Exception as e:
         logger.error(f"Error loading model or pipeline: {e}", exc_info=True)
         # If model loading fails, the app shouldn't start or should indicate a critical error.
         # Raising RuntimeError will typically stop the application from starting if this occurs during startup.
         raise RuntimeError(f"Failed to load model components: {e}")
 
+def generate_batch(batch):
+    """
+    Generates replies for a group of queued requests with a single `generate` call.
+    All requests in the group share the same temperature, top_p and prefix (see BatchScheduler).
+    This function is blocking and is run in a worker thread by the scheduler.
+    """
+    model = chat_pipeline_global.model
+    started = time.perf_counter()
+    # Left-pad all prompts into one tensor so the whole group is prefilled and decoded together,
+    # reusing the cached keys/values of their shared system prompt prefix.
+    inputs = build_generation_inputs(model, [pending.prompt for pending in batch], batch[0].prefix)
+    tokenized = time.perf_counter()
+    prompt_length = inputs["input_ids"].shape[1]
+    row_budgets = [pending.max_new_tokens for pending in batch]
+    timer = GenerationTimer()  # Prefill and decode time, for the metrics.
+    stopping_criteria = StoppingCriteriaList([
+        StopOnTokens(stop_token_ids_global),  # Stop each row at the end of its sentence.
+        StopAtRowLength(torch.tensor(row_budgets, device=model.device) + prompt_length),  # Stop each row at its own token budget.
+        timer,
+    ])
+    with torch.no_grad():
+        output_ids = model.generate(
+            **inputs,
+            max_new_tokens=max(row_budgets),  # The longest request in the group bounds the call.
+            **sampling_kwargs(batch[0].temperature, batch[0].top_p),  # Sampling, or greedy if temperature <= 0
+            pad_token_id=tokenizer_global.pad_token_id,  # Finished rows are filled with padding.
+            eos_token_id=tokenizer_global.eos_token_id,  # Specify end-of-sequence token
+            stopping_criteria=stopping_criteria,  # Apply per-row stopping criteria
+            repetition_penalty=1.2,  # Penalize repeated tokens to encourage diverse outputs
+        )
+    replies = []
+    for pending, row, budget in zip(batch, output_ids, row_budgets):
+        # Only decode the tokens generated for this row, within its own budget.
+        new_tokens = row[prompt_length:prompt_length + budget]
+        replies.append(tokenizer_global.decode(new_tokens, skip_special_tokens=True).strip())
+        # Rows that finished early are filled with padding; the rest are this row's own tokens.
+        pending.timings.update(queue=started - pending.enqueued_at, tokenize=tokenized - started,
+                               **timer.timings(int((new_tokens != tokenizer_global.pad_token_id).sum())))
+    return replies
+
+# The scheduler sits in front of the model and groups concurrent requests into batches.
+batch_scheduler = BatchScheduler(generate_batch, max_batch_size=BATCH_MAX_SIZE, window_ms=BATCH_WINDOW_MS)
+
 app = FastAPI( # Creates the FastAPI application instance. The on_startup event is used to load the model when the application starts.
     title="Lawyer Bot API",
     description="API for generating legal chat responses.",
     version="1.0.0",
-    on_startup=[load_model] # Load model on startup
+    on_startup=[load_model, load_law_index, batch_scheduler.start, search_scheduler.start], # Load model and law index, start the schedulers on startup
+    on_shutdown=[batch_scheduler.stop, search_scheduler.stop], # Stop the schedulers on shutdown
 )
 
 class GenerationRequest(BaseModel):
@@ -100,10 +475,14 @@ class GenerationRequest(BaseModel):
     Pydantic model defining the expected structure of an incoming text generation request.
     Includes user input and optional parameters for generation.
     """
-    user_input: str  # The input text from the user.
+    user_input: str  # The user's question alone: the law articles are retrieved for it.
+    history: str = ""  # Earlier turns of the discussion (summary and recent messages), given to the model only.
+    documents: str = ""  # Excerpts of the files attached by the user, given to the model only.
     max_new_tokens: int = 100  # Maximum number of new tokens to generate.
-    temperature: float = 0.7  # Sampling temperature for generation (controls randomness).
+    temperature: float = 0.7  # Sampling temperature for generation (controls randomness). 0 means greedy decoding.
     top_p: float = 0.9  # Nucleus sampling probability (controls diversity).
+    use_retrieval: bool = True  # Add the most relevant law articles to the prompt.
+    server_timing: bool = False  # Report the server-side time of each stage (Server-Timing header, and in the "done" event of /stream).
 
 class GenerationResponse(BaseModel):
     """
@@ -113,10 +492,58 @@ class GenerationResponse(BaseModel):
     reply: str
 
 
+def response_cache_key(request: GenerationRequest):
+    """Returns the response cache key of a request, or None if its reply must not be cached."""
+    if not response_cache.enabled:
+        return None
+    if request.temperature > 0 and not RESPONSE_CACHE_SAMPLED:
+        return None  # A sampled reply is only reused when explicitly configured.
+    return ResponseCache.key(
+        request.user_input,
+        system_prompt=SYSTEM_PROMPT,  # A new system prompt must not serve old replies.
+        max_new_tokens=request.max_new_tokens,
+        temperature=request.temperature,
+        top_p=request.top_p,
+        # Retrieved articles change the prompt, so the index version is part of the key.
+        law_index=retrieval_version() if request.use_retrieval else None,
+        # The same question asked after other turns or about other files needs its own reply.
+        history=request.history,
+        documents=request.documents,
+    )
+
+async def build_request_prompt(request: GenerationRequest, timings: dict = None) -> str:
+    """Builds the full prompt of a request, including retrieved law articles when enabled (timed into `timings`)."""
+    started = time.perf_counter()
+    context = await retrieve_context(request.user_input) if request.use_retrieval else ""
+    if timings is not None and request.use_retrieval:
+        timings["retrieval"] = time.perf_counter() - started
+        retrieval_seconds.observe(timings["retrieval"])
+    return build_prompt(request.user_input, context=context, history=request.history, documents=request.documents)
+
+def record_generation(endpoint: str, timings: dict, received_at: float):
+    """Adds the stage timings of one generated reply (see GenerationTimer) to the metrics."""
+    for histogram, stage in ((queue_wait_seconds, "queue"), (tokenization_seconds, "tokenize"),
+                             (prefill_seconds, "prefill"), (decode_seconds, "decode")):
+        if stage in timings:
+            histogram.observe(timings[stage])
+    if "first_token_at" in timings:
+        time_to_first_token.observe(timings["first_token_at"] - received_at, endpoint)
+        generated_tokens.observe(timings["tokens"])
+        if timings["tokens"] > 1 and timings["decode"] > 0:
+            decode_rate.observe((timings["tokens"] - 1) / timings["decode"])
+
+def server_timing(timings: dict, received_at: float) -> str:
+    """The Server-Timing header value of a request: the stages it went through and its total time."""
+    stages = {stage: timings[stage] for stage in TIMING_STAGES if stage in timings}
+    stages["total"] = time.perf_counter() - received_at
+    return server_timing_header(stages)
+
 @app.post("/", response_model=GenerationResponse)
 # Defines a POST endpoint at the root path ("/") that expects a GenerationRequest and returns a GenerationResponse.
-async def generate_chat_reply(request: GenerationRequest):
+async def generate_chat_reply(request: GenerationRequest, response: Response):
+    received_at = time.perf_counter()  # Start of the request, for the metrics.
     if chat_pipeline_global is None or tokenizer_global is None:
+        requests_total.inc("/", "unavailable")
         # Check if the model and tokenizer have been initialized.
         logger.error("Pipeline or tokenizer not initialized.")
         # Raises an HTTPException if the model pipeline or tokenizer isn't initialized,
@@ -126,40 +553,45 @@ async def generate_chat_reply(request: GenerationRequest):
         # Clients might retry after a delay.
 
         raise HTTPException(status_code=503, detail="Model service is not ready. Please try again later.")
+    requests_in_flight.inc()
+    timings = {}  # Time spent in each stage, filled along the way.
     try:
-        # Construct the prompt in the format expected by the chat model.
-        prompt = (
-            f"<|system|> {SYSTEM_PROMPT}\n"
-            f"<|user|> {request.user_input}\n"
-            f"<|assistant|>"
-        )
+        # Repeated questions are answered from the response cache without touching the model.
+        cache_key = response_cache_key(request)
+        if cache_key is not None:
+            cached_reply = response_cache.get(cache_key)
+            if cached_reply is not None:
+                requests_total.inc("/", "cached")
+                if request.server_timing:
+                    response.headers["Server-Timing"] = server_timing(timings, received_at)
+                return GenerationResponse(reply=cached_reply)
 
-        # Run the synchronous pipeline in a thread pool to avoid blocking the event loop
-        # Uses `run_in_threadpool` to execute the potentially long-running text generation
-        # without blocking the main event loop of the FastAPI application. This ensures
-        # the server remains responsive to other requests.
-        outputs = await run_in_threadpool(
-            chat_pipeline_global,
-            # The first argument to run_in_threadpool should be the callable (the pipeline object itself can be called).
-            prompt,  # Input prompt for text generation
+        # Construct the prompt in the format expected by the chat model, with the relevant law articles.
+        prompt = await build_request_prompt(request, timings)
+
+        # Queue the prompt in the batch scheduler. Concurrent requests that arrive within the
+        # batching window are generated together in one call running in a worker thread, so
+        # the event loop stays free and the server remains responsive to other requests.
+        reply_text = await batch_scheduler.submit(
+            prompt,
+            prefix=build_prompt_prefix(),  # Shared system prompt, whose keys/values are cached.
             max_new_tokens=request.max_new_tokens,  # Maximum number of tokens to generate
-            do_sample=True,  # Enable sampling for diverse outputs
             temperature=request.temperature,  # Controls randomness (higher = more random)
             top_p=request.top_p,  # Nucleus sampling (limits the pool of tokens to sample from)
-            pad_token_id=tokenizer_global.eos_token_id,  # Use EOS token for padding (important for batching)
-            eos_token_id=tokenizer_global.eos_token_id,  # Specify end-of-sequence token
-            stopping_criteria=StoppingCriteriaList([StopOnTokens(tokenizer_global)]),  # Apply custom stopping criteria
-            repetition_penalty=1.2,  # Penalize repeated tokens to encourage diverse outputs
+            timings=timings,  # Filled by generate_batch: queue wait, tokenization, prefill, decode.
         )
-        # The pipeline returns a list of dictionaries; we take the first result.
-        # The generated text includes the prompt, so we split by the assistant tag and take the last part.
-        reply_text = outputs[0]['generated_text'].split("<|assistant|>")[-1].strip()
+        record_generation("/", timings, received_at)
+        requests_total.inc("/", "ok")
+        if request.server_timing:
+            response.headers["Server-Timing"] = server_timing(timings, received_at)
 
-        # Extracts the generated reply from the pipeline output, removing the assistant tag.
-        # The `strip()` method is used to remove any leading or trailing whitespace characters.
-        # This ensures a clean, user-friendly response.
+        # The scheduler returns only the newly generated text for this request, already stripped
+        # of leading or trailing whitespace. This ensures a clean, user-friendly response.
+        if cache_key is not None:
+            response_cache.put(cache_key, reply_text)
         return GenerationResponse(reply=reply_text)
     except Exception as e:
+        requests_total.inc("/", "error")
         logger.error(f"Error during text generation: {e}", exc_info=True)
         # Handles any exceptions that occur during the text generation process.
         # Logs the error with a traceback for detailed debugging information.
@@ -167,6 +599,132 @@ async def generate_chat_reply(request: GenerationRequest):
         # that an unexpected error occurred on the server side.
 
         raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
+    finally:
+        requests_in_flight.dec()
+        request_duration.observe(time.perf_counter() - received_at, "/")
+
+def done_event(request: GenerationRequest, timings: dict, received_at: float) -> str:
+    """The final server-sent event; it carries the Server-Timing value of the whole stream when the request asked for it."""
+    data = {"server_timing": server_timing(timings, received_at)} if request.server_timing else {}
+    return f"event: done\ndata: {json.dumps(data)}\n\n"
+
+def stream_cached_events(request: GenerationRequest, reply: str, received_at: float):
+    """Yields a cached reply as a single server-sent event, in the same format as stream_chat_events."""
+    yield f"data: {json.dumps({'token': reply})}\n\n"
+    yield done_event(request, {}, received_at)
+
+def stream_chat_events(request: GenerationRequest, prompt: str, cache_key=None, timings=None, received_at=None):
+    """
+    Runs one generation of `prompt` in a background thread and yields its text as server-sent events.
+    Each event carries a JSON object: {"token": "..."} for every new chunk of text,
+    {"error": "..."} if generation fails, and a final "done" event.
+    A complete reply is stored in the response cache under `cache_key`, if given.
+    The stage timings are added to `timings` and to the metrics.
+    This generator is blocking; StreamingResponse iterates it in a thread pool.
+    """
+    timings = timings if timings is not None else {}
+    received_at = received_at if received_at is not None else time.perf_counter()
+    model = chat_pipeline_global.model
+    started = time.perf_counter()
+    inputs = build_generation_inputs(model, [prompt], build_prompt_prefix())
+    timings["tokenize"] = time.perf_counter() - started
+    timer = GenerationTimer()  # Prefill and decode time, for the metrics.
+    # The streamer receives tokens from generate() and hands back decoded text as soon as it is printable.
+    streamer = TextIteratorStreamer(tokenizer_global, skip_prompt=True, skip_special_tokens=True, timeout=300)
+    cancel_event = threading.Event()  # Set when the client goes away, so the model stops early.
+    errors = []  # Filled by the worker thread if generate() raises.
+
+    def run_generation():
+        try:
+            with torch.no_grad():
+                model.generate(
+                    **inputs,
+                    streamer=streamer,  # Push every new token to the streamer.
+                    max_new_tokens=request.max_new_tokens,  # Maximum number of tokens to generate
+                    **sampling_kwargs(request.temperature, request.top_p),  # Sampling, or greedy if temperature <= 0
+                    pad_token_id=tokenizer_global.pad_token_id,  # Use the padding token set at load time
+                    eos_token_id=tokenizer_global.eos_token_id,  # Specify end-of-sequence token
+                    stopping_criteria=StoppingCriteriaList([StopOnTokens(stop_token_ids_global), StopOnCancel(cancel_event), timer]),
+                    repetition_penalty=1.2,  # Penalize repeated tokens to encourage diverse outputs
+                )
+        except Exception as e:
+            logger.error(f"Error during streamed text generation: {e}", exc_info=True)
+            errors.append(str(e))
+            streamer.end()  # Unblock the consumer so it can report the error.
+
+    worker = threading.Thread(target=run_generation, daemon=True)
+    worker.start()
+    pieces = []  # The streamed text, kept for the response cache.
+    outcome = "cancelled"  # Unless the stream reaches its end.
+    requests_in_flight.inc()  # Until the finally clause below.
+    try:
+        for text in streamer:
+            if text:
+                pieces.append(text)
+                yield f"data: {json.dumps({'token': text})}\n\n"
+        timings.update(timer.timings(len(timer.steps)))  # One row: every step produced one of its tokens.
+        if errors:
+            outcome = "error"
+            yield f"data: {json.dumps({'error': f'Error generating response: {errors[0]}'})}\n\n"
+        else:
+            outcome = "ok"
+            if cache_key is not None:
+                response_cache.put(cache_key, "".join(pieces).strip())
+        yield done_event(request, timings, received_at)
+    finally:
+        # Reached on normal completion and when the client disconnects (generator is closed).
+        cancel_event.set()
+        if outcome != "error":
+            record_generation("/stream", timings, received_at)
+        requests_total.inc("/stream", outcome)
+        requests_in_flight.dec()
+        request_duration.observe(time.perf_counter() - received_at, "/stream")
+
+
+@app.post("/stream")
+# Defines a POST endpoint that takes the same body as "/" but streams the reply as server-sent events.
+async def stream_chat_reply(request: GenerationRequest):
+    received_at = time.perf_counter()  # Start of the request, for the metrics.
+    if chat_pipeline_global is None or tokenizer_global is None:
+        requests_total.inc("/stream", "unavailable")
+        logger.error("Pipeline or tokenizer not initialized.")
+        raise HTTPException(status_code=503, detail="Model service is not ready. Please try again later.")
+    timings = {}  # Time spent in each stage, filled along the way.
+    cache_key = response_cache_key(request)
+    cached_reply = response_cache.get(cache_key) if cache_key is not None else None
+    if cached_reply is not None:
+        requests_total.inc("/stream", "cached")
+        events = stream_cached_events(request, cached_reply, received_at)
+    else:
+        prompt = await build_request_prompt(request, timings)
+        events = stream_chat_events(request, prompt, cache_key, timings, received_at)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # Stop proxies from buffering the stream.
+    if request.server_timing:
+        # Only the stages before the first byte are known here; the "done" event has the full breakdown.
+        headers["Server-Timing"] = server_timing(timings, received_at)
+    return StreamingResponse(events, media_type="text/event-stream", headers=headers)
+
+@app.get("/cache")
+# Defines a GET endpoint that reports the response cache counters (hits, misses, size).
+async def response_cache_stats():
+    return response_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+# Defines a GET endpoint that exposes the request counters, stage latencies and memory in the Prometheus text format.
+async def prometheus_metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/health")
+# Defines a GET endpoint polled by the desktop app to pick a live server; 503 until the model is loaded.
+async def health():
+    if chat_pipeline_global is None or tokenizer_global is None:
+        raise HTTPException(status_code=503, detail="Model service is not ready.")
+    if RETRIEVAL_TOP_K <= 0:
+        retrieval = "off"
+    else:
+        retrieval = "dense" if dense_index_global is not None else "bm25" if law_index_global is not None else "off"
+    return {"status": "ok", "retrieval": retrieval}  # Which index the answers are grounded in.
+
 if __name__ == "__main__":
     # This block executes if the script is run directly (e.g., `python contact_model.py`).
     import uvicorn
@@ -0,0 +1,177 @@
+"""
+Dense (embedding) retrieval over the Cameroon law corpus.
+
+The corpus is chunked like the BM25 index (one chunk per article, see retrieval.py) and
+every chunk is embedded offline. The vectors are written as one float16 NumPy file and
+the chunk metadata as an SQLite table, so the server can memory-map the vectors with
+np.load(mmap_mode="r") and read only the rows it returns: memory stays flat as more
+codes are added. Build the index with:
+
+    python dense_retrieval.py ../DATA_USED/LawsTXT/CameroonLaw.txt dense_index
+
+The optional third argument selects the embedding model (EMBEDDING_MODEL_ID by default).
+"""
+import hashlib  # Standard Python library, used to fingerprint the corpus.
+import logging  # Standard Python library for logging events.
+import os  # Standard Python library, used for file paths.
+import sqlite3  # Standard Python library, stores the chunk metadata table.
+import sys  # Standard Python library, used for the command line.
+import threading  # Standard Python library, the metadata connection is shared by worker threads.
+import numpy as np  # Vector storage and the top-k matrix multiply.
+import torch  # PyTorch library, runs the embedding model.
+from transformers import AutoModel, AutoTokenizer  # Loads the embedding model.
+from retrieval import chunk_corpus  # Same article chunks as the BM25 index.
+
+logger = logging.getLogger(__name__)
+
+# Small multilingual sentence encoder: the corpus and the questions are in English and French.
+EMBEDDING_MODEL_ID = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+VECTORS_FILE = "vectors.npy"  # float16 matrix, one L2-normalized row per chunk.
+METADATA_FILE = "chunks.db"  # SQLite file with the chunk table and the index settings.
+SEARCH_BLOCK_ROWS = 65536  # Vectors scored per matrix multiply, bounds the float32 working memory.
+
+
+def dense_index_exists(index_dir: str) -> bool:
+    """Returns True if `index_dir` holds an index written by build_dense_index."""
+    return all(os.path.exists(os.path.join(index_dir, name)) for name in (VECTORS_FILE, METADATA_FILE))
+
+
+class TextEncoder:
+    """Mean-pooled, L2-normalized sentence embeddings from a Hugging Face encoder model."""
+    def __init__(self, model_id: str = EMBEDDING_MODEL_ID, max_length: int = 256):
+        self.model_id = model_id
+        self.max_length = max_length  # Longer chunks are truncated; articles rarely exceed it.
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self.model = AutoModel.from_pretrained(model_id).eval()
+        self.lock = threading.Lock()  # One forward pass at a time; batching happens before the call.
+
+    @property
+    def dimension(self) -> int:
+        return self.model.config.hidden_size
+
+    def encode(self, texts, batch_size: int = 32) -> np.ndarray:
+        """Returns a float32 array with one unit-length embedding per text."""
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            batch = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                   max_length=self.max_length, return_tensors="pt")
+            with self.lock, torch.no_grad():
+                hidden = self.model(**batch).last_hidden_state
+            # Mean over the real tokens only; padding is masked out.
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            vectors.append(torch.nn.functional.normalize(pooled, dim=-1).float().numpy())
+        return np.concatenate(vectors) if vectors else np.zeros((0, self.dimension), dtype=np.float32)
+
+
+def build_dense_index(text: str, index_dir: str, encoder: TextEncoder, batch_size: int = 32):
+    """Chunks the corpus `text`, embeds every chunk and writes the vectors and metadata to `index_dir`."""
+    chunks = chunk_corpus(text)
+    vectors = encoder.encode([f"{chunk['title']} {chunk['text']}" for chunk in chunks], batch_size=batch_size)
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, VECTORS_FILE), vectors.astype(np.float16))
+
+    metadata_path = os.path.join(index_dir, METADATA_FILE)
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)  # Row ids must match the new vector file.
+    conn = sqlite3.connect(metadata_path)
+    with conn:
+        conn.execute("CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("""
+            CREATE TABLE chunks (
+                id INTEGER PRIMARY KEY,  -- Row of the chunk in vectors.npy.
+                source TEXT NOT NULL,
+                title TEXT NOT NULL,
+                article TEXT,
+                text TEXT NOT NULL
+            )
+        """)
+        conn.executemany("INSERT INTO settings (key, value) VALUES (?, ?)", [
+            ("model_id", encoder.model_id),
+            ("corpus_digest", hashlib.sha256(text.encode("utf-8")).hexdigest()),
+        ])
+        conn.executemany(
+            "INSERT INTO chunks (id, source, title, article, text) VALUES (?, ?, ?, ?, ?)",
+            ((row, chunk["source"], chunk["title"], chunk["article"], chunk["text"]) for row, chunk in enumerate(chunks)),
+        )
+    conn.close()
+    return len(chunks)
+
+
+class DenseIndex:
+    """
+    Memory-mapped embedding index. The vectors stay on disk and are paged in by the OS;
+    only the metadata rows of the returned chunks are read from SQLite.
+    """
+    def __init__(self, vectors: np.ndarray, conn: sqlite3.Connection, model_id: str, corpus_digest: str):
+        self.vectors = vectors  # (chunks, dimension) float16, memory-mapped read-only.
+        self.conn = conn  # Chunk metadata, opened read-only.
+        self.model_id = model_id  # Embedding model the vectors were built with; queries must use it too.
+        self.corpus_digest = corpus_digest  # SHA-256 of the corpus, used to version cached answers.
+        self.lock = threading.Lock()  # sqlite3 connections must not be used by two threads at once.
+
+    @classmethod
+    def load(cls, index_dir: str):
+        """Maps the vectors and opens the metadata written by build_dense_index."""
+        vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode="r")
+        metadata_uri = "file:" + os.path.abspath(os.path.join(index_dir, METADATA_FILE)) + "?mode=ro"
+        conn = sqlite3.connect(metadata_uri, uri=True, check_same_thread=False)
+        settings = dict(conn.execute("SELECT key, value FROM settings"))
+        return cls(vectors, conn, settings["model_id"], settings["corpus_digest"])
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def search_vectors(self, queries: np.ndarray, top_k: int = 3):
+        """
+        Returns, for each row of `queries` (unit-length embeddings), up to `top_k`
+        (score, chunk id) pairs by cosine similarity, best first. All queries are scored
+        together, one matrix multiply per block of SEARCH_BLOCK_ROWS vectors.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        top_k = min(top_k, len(self))
+        if top_k <= 0:
+            return [[] for _ in queries]
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores = queries @ block.T  # (queries, block rows); vectors are normalized, so this is the cosine.
+            k = min(top_k, scores.shape[1])
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]  # Unordered top-k of the block.
+            # Merge with the best rows of the previous blocks and keep the overall top-k.
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, candidates, axis=1)], axis=1)
+            best_ids = np.concatenate([best_ids, candidates + start], axis=1)
+            keep = np.argsort(-best_scores, axis=1)[:, :top_k]
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+            best_ids = np.take_along_axis(best_ids, keep, axis=1)
+        return [list(zip(row_scores.tolist(), row_ids.tolist())) for row_scores, row_ids in zip(best_scores, best_ids)]
+
+    def chunks(self, chunk_ids) -> dict:
+        """Reads the metadata of the given chunk ids; returns chunk id -> chunk dict (as in chunk_corpus)."""
+        chunk_ids = list(set(chunk_ids))
+        if not chunk_ids:
+            return {}
+        placeholders = ",".join("?" * len(chunk_ids))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id, source, title, article, text FROM chunks WHERE id IN ({placeholders})", chunk_ids,
+            ).fetchall()
+        return {row[0]: {"source": row[1], "title": row[2], "article": row[3], "text": row[4]} for row in rows}
+
+    def search_batch(self, encoder: TextEncoder, questions, top_k: int = 3) -> list:
+        """Embeds all questions in one forward pass and returns a list of (score, chunk) pairs per question."""
+        hits = self.search_vectors(encoder.encode(list(questions)), top_k)
+        chunks = self.chunks(chunk_id for row in hits for _, chunk_id in row)
+        return [[(score, chunks[chunk_id]) for score, chunk_id in row] for row in hits]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) not in (3, 4):
+        sys.exit("usage: python dense_retrieval.py CORPUS.txt INDEX_DIR [EMBEDDING_MODEL_ID]")
+    corpus_path, index_dir = sys.argv[1:3]
+    model_id = sys.argv[3] if len(sys.argv) == 4 else EMBEDDING_MODEL_ID
+    with open(corpus_path, encoding="utf-8") as corpus_file:
+        count = build_dense_index(corpus_file.read(), index_dir, TextEncoder(model_id))
+    logger.info(f"Embedded {count} chunks with {model_id} into {index_dir}")
@@ -0,0 +1,148 @@
+import bisect  # Standard Python library, finds the histogram bucket of an observation.
+import os  # Standard Python library, used to read the resident memory of the process.
+import threading  # Standard Python library, metrics are updated from the event loop and worker threads.
+
+# Upper bounds (seconds) of the latency histograms: from a cached reply to a long CPU generation.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)  # Generated tokens per request.
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)  # Decoded tokens per second.
+
+
+def escape_label(value) -> str:
+    """Escapes a label value: backslash, double quote and newline."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values) -> str:
+    """Renders a label set as {name="value",...} (empty without labels)."""
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def format_value(value) -> str:
+    """Prometheus sample values: integers without a decimal point, +Inf for infinity."""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    Base of the metric types: a name, a help text and one value per combination of label values.
+    Methods take the label values positionally, in the order of `labels`.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}  # tuple of label values -> value (or histogram state).
+        self.lock = threading.Lock()
+
+    def samples(self):
+        """Yields (name suffix, label names, label values, value) for the exposition."""
+        with self.lock:
+            items = list(self.values.items())
+        for label_values, value in items:
+            yield "", self.labels, label_values, value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(names, values)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A value that only goes up, such as a number of requests."""
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down, such as the requests in flight. `function`, if given, is read at each scrape."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels=(), function=None):
+        super().__init__(name, help_text, labels)
+        self.function = function
+        if not self.labels and function is None:
+            self.values[()] = 0
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def samples(self):
+        if self.function is not None:
+            value = self.function()
+            if value is not None:  # e.g. no memory figure on this platform.
+                yield "", (), (), value
+            return
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    """Counts observations per bucket (cumulative in the exposition), with their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values):
+        with self.lock:
+            state = self.values.get(label_values)
+            if state is None:  # Per-bucket counts (the last one is +Inf), sum, count.
+                state = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = [(label_values, (list(state[0]), state[1], state[2])) for label_values, state in self.values.items()]
+        names = self.labels + ("le",)
+        for label_values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield "_bucket", names, label_values + (format_value(bound),), cumulative
+            yield "_sum", self.labels, label_values, total
+            yield "_count", self.labels, label_values, count
+
+
+class Registry:
+    """The metrics served by the /metrics endpoint, in registration order."""
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """The Prometheus text exposition format (version 0.0.4)."""
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+def process_rss_bytes():
+    """Resident memory of this process in bytes, from /proc (Linux, as on the Spaces); None elsewhere."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def server_timing_header(timings: dict) -> str:
+    """Formats {stage: seconds} as a Server-Timing header value, durations in milliseconds."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
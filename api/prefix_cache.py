@@ -0,0 +1,71 @@
+import copy  # Standard Python library, used to give each generation its own copy of a cached prefix.
+import hashlib  # Standard Python library, used to key the cache by a hash of the prefix text.
+import logging  # Standard Python library for logging events.
+import threading  # Standard Python library, the cache is used from several worker threads.
+from collections import OrderedDict  # Keeps entries in least-recently-used order.
+from dataclasses import dataclass  # Used to declare the cache entries.
+import torch  # PyTorch library, used to run the prefix through the model.
+from transformers import DynamicCache  # Key/value cache object accepted by `generate`.
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PrefixEntry:
+    """The token ids of a prompt prefix and the attention keys/values the model computed for them."""
+    token_ids: list  # Token ids of the prefix, including the BOS token.
+    past_key_values: DynamicCache  # Keys/values for those tokens, batch size 1. Never mutated.
+
+
+class PrefixCache:
+    """
+    Least-recently-used cache of precomputed past_key_values for prompt prefixes such as
+    the system prompt. Entries are keyed by a hash of the prefix text, so several system
+    prompts can be cached side by side; the oldest is evicted beyond `max_entries`.
+    """
+    def __init__(self, max_entries: int = 4):
+        self.max_entries = max_entries  # 0 disables the cache.
+        self.entries = OrderedDict()  # hash -> PrefixEntry, most recently used last.
+        self.lock = threading.Lock()  # Generations run in several threads at once.
+
+    @staticmethod
+    def key(prefix_text: str) -> str:
+        """Returns the cache key of a prefix."""
+        return hashlib.sha256(prefix_text.encode("utf-8")).hexdigest()
+
+    def get(self, model, tokenizer, prefix_text: str):
+        """Returns the PrefixEntry for `prefix_text`, computing it on a miss. Returns None if the cache is disabled."""
+        if self.max_entries <= 0:
+            return None
+        key = self.key(prefix_text)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)  # Mark as most recently used.
+                return entry
+
+        # Computed outside the lock so that lookups of other prefixes are not blocked meanwhile.
+        entry = self._build(model, tokenizer, prefix_text)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)  # Evict the least recently used prefix.
+        return entry
+
+    @staticmethod
+    def _build(model, tokenizer, prefix_text: str) -> PrefixEntry:
+        """Runs the prefix through the model once and keeps its keys/values."""
+        input_ids = tokenizer(prefix_text, return_tensors="pt")["input_ids"].to(model.device)
+        with torch.no_grad():
+            outputs = model(input_ids=input_ids, past_key_values=DynamicCache(), use_cache=True)
+        logger.info(f"Cached keys/values for a {input_ids.shape[1]}-token prompt prefix.")
+        return PrefixEntry(token_ids=input_ids[0].tolist(), past_key_values=outputs.past_key_values)
+
+    @staticmethod
+    def copy_for_batch(entry: PrefixEntry, batch_size: int) -> DynamicCache:
+        """Returns a private copy of the cached keys/values, repeated for every row of a batch."""
+        past_key_values = copy.deepcopy(entry.past_key_values)  # generate() appends to the cache it is given.
+        if batch_size > 1:
+            past_key_values.batch_repeat_interleave(batch_size)
+        return past_key_values
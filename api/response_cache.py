@@ -0,0 +1,122 @@
+import hashlib  # Standard Python library, used to build compact cache keys.
+import json  # Standard Python library, used to serialize the key parts deterministically.
+import logging  # Standard Python library for logging events.
+import re  # Standard Python library, used to normalize questions.
+import sqlite3  # Standard Python library, optional on-disk backing of the cache.
+import threading  # Standard Python library, the cache is shared by the event loop and worker threads.
+import time  # Standard Python library, used for expiry times.
+from collections import OrderedDict  # Keeps entries in least-recently-used order.
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(text: str) -> str:
+    """Lowercases a question, collapses whitespace and drops trailing punctuation, so trivial variants share an entry."""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?!.")
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of generated replies with a time-to-live, keyed on the normalized
+    question plus the generation parameters. When `db_path` is given, entries are also
+    written to an SQLite file so that they survive restarts.
+    """
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 86400, db_path: str = None):
+        self.max_entries = max_entries  # 0 disables the cache.
+        self.ttl_seconds = ttl_seconds  # Entries older than this are ignored and dropped.
+        self.entries = OrderedDict()  # key -> (reply, created_at), most recently used last.
+        self.lock = threading.Lock()  # Used from the event loop and from streaming worker threads.
+        self.hits = 0  # Number of lookups answered from the cache.
+        self.misses = 0  # Number of lookups that had to go to the model.
+        self.conn = None  # SQLite connection when the cache is backed by a file.
+        if db_path and max_entries > 0:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    reply TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache (created_at)")
+            self.conn.commit()
+            logger.info(f"Response cache backed by {db_path}")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(user_input: str, **params) -> str:
+        """Builds the cache key from the normalized question and every parameter that affects the reply."""
+        parts = json.dumps({"q": normalize_question(user_input), **params}, sort_keys=True)
+        return hashlib.sha256(parts.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Returns the cached reply for `key`, or None. Updates the hit/miss counters."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None and self.conn is not None:
+                # Not in memory (e.g. after a restart): look in the SQLite file.
+                row = self.conn.execute("SELECT reply, created_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], row[1])
+                    self._remember(key, entry)
+            if entry is not None and now - entry[1] > self.ttl_seconds:
+                self._forget(key)  # Expired.
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)  # Mark as most recently used.
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, reply: str):
+        """Stores a reply, evicting the least recently used entries beyond `max_entries`."""
+        if not self.enabled or not reply:
+            return
+        entry = (reply, time.time())
+        with self.lock:
+            self._remember(key, entry)
+            if self.conn is not None:
+                self.conn.execute("INSERT OR REPLACE INTO response_cache (key, reply, created_at) VALUES (?, ?, ?)", (key, *entry))
+                # Keep the file bounded too: drop expired rows and everything beyond the newest max_entries.
+                self.conn.execute("DELETE FROM response_cache WHERE created_at < ?", (entry[1] - self.ttl_seconds,))
+                self.conn.execute("""
+                    DELETE FROM response_cache WHERE key NOT IN (
+                        SELECT key FROM response_cache ORDER BY created_at DESC LIMIT ?
+                    )
+                """, (self.max_entries,))
+                self.conn.commit()
+
+    def stats(self) -> dict:
+        """Returns the counters exposed by the API."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remember(self, key, entry):
+        """Adds an entry to the in-memory LRU. The caller holds the lock."""
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _forget(self, key):
+        """Removes an entry from memory and disk. The caller holds the lock."""
+        self.entries.pop(key, None)
+        if self.conn is not None:
+            self.conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            self.conn.commit()
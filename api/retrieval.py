@@ -0,0 +1,213 @@
+"""
+BM25 retrieval over the Cameroon law corpus (DATA_USED/LawsTXT/CameroonLaw.txt).
+
+The corpus is split into one chunk per article, an inverted index with precomputed
+BM25 weights is built once and written to disk, and the server loads it at startup
+to find the articles most relevant to a question. The Docker build runs, on the copy of the
+corpus kept next to the API (the build context of the Space is this folder):
+
+    python retrieval.py data/CameroonLaw.txt law_index.json.gz
+"""
+import gzip  # Standard Python library, the index is stored gzip-compressed.
+import hashlib  # Standard Python library, used to fingerprint the corpus.
+import heapq  # Standard Python library, used to pick the top-k scores.
+import json  # Standard Python library, the index is stored as JSON.
+import logging  # Standard Python library for logging events.
+import math  # Standard Python library, used for the IDF formula.
+import re  # Standard Python library, used for parsing and tokenizing.
+import sys  # Standard Python library, used for the command line.
+from collections import Counter, defaultdict  # Term counting and posting lists.
+
+logger = logging.getLogger(__name__)
+
+# Corpus sections start with "=== file.pdf ===" (written by DATA_USED/text_extractor.py).
+SECTION_HEADER = re.compile(r"^=== (.+?) ===$", re.MULTILINE)
+# Article headings such as "Article 2 — ...", "Article 3 18 — ..." (PDF extraction adds spaces inside numbers) or "Article 8 bis :".
+ARTICLE_HEADING = re.compile(r"^Art(?:icle|\.)\s+(\d(?:\s?\d){0,3})(?=\s*(?:bis|ter|quater|\(|[—–:.\xad-]|$))", re.IGNORECASE)
+# Fallback for headings whose text follows the number directly, e.g. "Article 14 When Parliament ...".
+ARTICLE_HEADING_LOOSE = re.compile(r"^Article\s+(\d+)\s+[A-Z]")
+# Questions like "what does article 2 of the constitution say".
+ARTICLE_REFERENCE = re.compile(r"\barticles?\s+(\d+)\b", re.IGNORECASE)
+TOKEN = re.compile(r"\w+")
+# PDF extraction often splits a word after its first letter ("l aw a pplies"); see index_terms.
+SPLIT_WORD = re.compile(r"\b(\w) (\w{2,})")
+
+# Readable titles for the files of the corpus; other files fall back to their name.
+SOURCE_TITLES = {
+    "CM_Code_Penal_CamerounEN.pdf": "Penal Code of Cameroon",
+    "FR_CM_Code_Penal_CamerounEN.pdf": "Code pénal du Cameroun",
+    "Const.ofCameroon2008.pdf": "Constitution of Cameroon",
+    "FR_Const.ofCameroon2008.pdf": "Constitution du Cameroun",
+    "Loi_2010-012_cybersecurite_cybercriminalite-en.pdf": "Law on cybersecurity and cybercrime in Cameroon",
+    "Loi_2010-012_cybersecurite_cybercriminalite.pdf": "Loi relative à la cybersécurité et la cybercriminalité au Cameroun",
+    "25.12.54-Code-de-procedure-civile-du-16-decembre-1954--2022_09_27-06_08_23-UTC-en.pdf": "Code of Civil Procedure",
+}
+
+# Very common English and French words that carry no meaning for retrieval.
+STOPWORDS = set("""
+a an and are as at au aux be by can ce cette dans de des do does du elle en est et for from has have
+how i if il in is it its la le les of on or ou par pour qu que quel quelle qui said say says se shall
+should sont sur that the their there this to un une under was what when where which who will with
+would you your
+""".split())
+
+UNTITLED_CHUNK_CHARS = 1500  # Sections without article headings are cut into pieces of about this size.
+# Suffixes removed by the light stemmer, longest first, with their replacement ("penalties" -> "penalty").
+SUFFIXES = [
+    ("ations", ""), ("ation", ""), ("ements", ""), ("ement", ""), ("ments", ""), ("ment", ""),
+    ("ively", ""), ("ivity", ""), ("ive", ""), ("ity", ""), ("ies", "y"), ("ied", "y"),
+    ("ing", ""), ("ed", ""), ("es", ""), ("s", ""), ("e", ""),
+]
+
+
+def stem(term: str) -> str:
+    """Strips one common English/French suffix so that e.g. "amended" and "amendment" share a term."""
+    for suffix, replacement in SUFFIXES:
+        if term.endswith(suffix) and len(term) - len(suffix) >= 4:
+            return term[:-len(suffix)] + replacement
+    return term
+
+
+def tokenize(text: str) -> list:
+    """Lowercases `text` and splits it into stemmed index terms, skipping stopwords and single characters."""
+    return [stem(term) for term in TOKEN.findall(text.lower()) if len(term) > 1 and term not in STOPWORDS]
+
+
+def index_terms(text: str) -> list:
+    """Terms of a corpus chunk: its tokens plus the words that PDF extraction split after the first letter."""
+    glued = " ".join(first + rest for first, rest in SPLIT_WORD.findall(text))
+    return tokenize(text) + tokenize(glued)
+
+
+def source_title(file_name: str) -> str:
+    """Returns the readable title of a corpus file."""
+    return SOURCE_TITLES.get(file_name) or re.sub(r"[_\-.]+", " ", file_name.rsplit(".", 1)[0]).strip()
+
+
+def article_number(line: str):
+    """Returns the article number if `line` starts an article, else None."""
+    match = ARTICLE_HEADING.match(line) or ARTICLE_HEADING_LOOSE.match(line)
+    return match.group(1).replace(" ", "") if match else None
+
+
+def chunk_corpus(text: str) -> list:
+    """
+    Splits the corpus into chunks at "Article N —" boundaries within each "=== file ===" section.
+    Sections without any article heading are split into paragraphs of about UNTITLED_CHUNK_CHARS.
+    Returns a list of dicts with the keys source, title, article and text.
+    """
+    chunks = []
+    seen = set()  # The corpus contains some files twice; identical chunks are kept once.
+
+    def add(source, article, lines):
+        body = "\n".join(lines).strip()
+        if body and body not in seen:
+            seen.add(body)
+            chunks.append({"source": source, "title": source_title(source), "article": article, "text": body})
+
+    parts = SECTION_HEADER.split(text)  # [preamble, name1, body1, name2, body2, ...]
+    for source, body in zip(parts[1::2], parts[2::2]):
+        lines = body.splitlines()
+        if any(article_number(line) for line in lines):
+            article, current = None, []
+            for line in lines:
+                number = article_number(line)
+                if number is not None:
+                    add(source, article, current)  # Close the previous article (or the preamble).
+                    article, current = number, []
+                current.append(line)
+            add(source, article, current)
+        else:
+            current, size = [], 0
+            for line in lines:
+                current.append(line)
+                size += len(line)
+                if size >= UNTITLED_CHUNK_CHARS and not line.strip():  # Cut at a blank line.
+                    add(source, None, current)
+                    current, size = [], 0
+            add(source, None, current)
+    return chunks
+
+
+class BM25Index:
+    """
+    Inverted index over law chunks. BM25 weights are computed at build time, so a query
+    only has to add up the stored weights of its terms.
+    """
+    def __init__(self, chunks, postings, corpus_digest):
+        self.chunks = chunks  # List of chunk dicts (see chunk_corpus).
+        self.postings = postings  # term -> [list of chunk ids, list of BM25 weights].
+        self.corpus_digest = corpus_digest  # SHA-256 of the corpus, used to version cached answers.
+        self.article_chunks = defaultdict(list)  # article number -> chunk ids, for "article N" questions.
+        for chunk_id, chunk in enumerate(chunks):
+            if chunk["article"]:
+                self.article_chunks[chunk["article"]].append(chunk_id)
+
+    @classmethod
+    def build(cls, text: str, k1: float = 1.5, b: float = 0.75):
+        """Chunks the corpus `text` and computes the BM25 weight of every (term, chunk) pair."""
+        chunks = chunk_corpus(text)
+        term_counts = [Counter(index_terms(f"{chunk['title']} {chunk['text']}")) for chunk in chunks]
+        lengths = [sum(counts.values()) for counts in term_counts]
+        average_length = sum(lengths) / max(1, len(lengths))
+        document_frequency = Counter(term for counts in term_counts for term in counts)
+
+        postings = defaultdict(lambda: [[], []])
+        for chunk_id, counts in enumerate(term_counts):
+            length_norm = k1 * (1 - b + b * lengths[chunk_id] / average_length)
+            for term, tf in counts.items():
+                idf = math.log(1 + (len(chunks) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                postings[term][0].append(chunk_id)
+                postings[term][1].append(round(idf * tf * (k1 + 1) / (tf + length_norm), 4))
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return cls(chunks, dict(postings), digest)
+
+    def save(self, path):
+        """Writes the index as gzip-compressed JSON."""
+        with gzip.open(path, "wt", encoding="utf-8") as index_file:
+            json.dump({"chunks": self.chunks, "postings": self.postings, "corpus_digest": self.corpus_digest}, index_file)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save."""
+        with gzip.open(path, "rt", encoding="utf-8") as index_file:
+            data = json.load(index_file)
+        return cls(data["chunks"], data["postings"], data["corpus_digest"])
+
+    def search(self, query: str, top_k: int = 3) -> list:
+        """Returns up to `top_k` (score, chunk) pairs, best first."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            chunk_ids, weights = self.postings.get(term, ([], []))
+            for chunk_id, weight in zip(chunk_ids, weights):
+                scores[chunk_id] += weight
+        # A question naming an article ("article 2 of the constitution") should get that article:
+        # matching chunks are lifted above all others, and BM25 still orders them (e.g. by code).
+        referenced = [chunk_id for number in ARTICLE_REFERENCE.findall(query) for chunk_id in self.article_chunks.get(number, [])]
+        if referenced:
+            boost = max(scores.values(), default=0.0) + 1.0
+            for chunk_id in referenced:
+                scores[chunk_id] += boost
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(score, self.chunks[chunk_id]) for chunk_id, score in best if score > 0]
+
+
+def format_context(results, max_chars: int = 600) -> str:
+    """Formats retrieved chunks for the prompt, one "[title, Article N] text" block per chunk."""
+    blocks = []
+    for _, chunk in results:
+        label = f"{chunk['title']}, Article {chunk['article']}" if chunk["article"] else chunk["title"]
+        text = re.sub(r"\s+", " ", chunk["text"])  # The PDF line breaks only waste tokens.
+        blocks.append(f"[{label}] {text[:max_chars]}")
+    return "\n".join(blocks)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 3:
+        sys.exit("usage: python retrieval.py CORPUS.txt INDEX.json.gz")
+    corpus_path, index_path = sys.argv[1:]
+    with open(corpus_path, encoding="utf-8") as corpus_file:
+        index = BM25Index.build(corpus_file.read())
+    index.save(index_path)
+    logger.info(f"Indexed {len(index.chunks)} chunks and {len(index.postings)} terms into {index_path}")
@@ -0,0 +1,97 @@
+import json  # Standard Python library, used to read the safetensors header.
+import logging  # Standard Python library for logging events.
+import mmap  # Standard Python library for memory-mapping the weight files.
+import struct  # Standard Python library, used to read the header length.
+from pathlib import Path  # Object-oriented file paths.
+import torch  # PyTorch library, used to wrap the mapped bytes as tensors.
+from accelerate import init_empty_weights  # Builds the model skeleton without allocating its weights.
+from transformers import AutoConfig, AutoModelForCausalLM  # Used to rebuild the model from the saved config.
+
+logger = logging.getLogger(__name__)
+
+# Maps the dtype names used in safetensors headers to torch dtypes.
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+# Keeps the memory maps open for as long as the process lives, since the model weights point into them.
+_open_maps = []
+
+
+def snapshot_exists(snapshot_dir) -> bool:
+    """Returns True if `snapshot_dir` holds a model written by write_snapshot."""
+    snapshot_dir = Path(snapshot_dir)
+    return (snapshot_dir / "config.json").exists() and any(snapshot_dir.glob("*.safetensors"))
+
+
+def write_snapshot(model, tokenizer, snapshot_dir):
+    """
+    Saves a merged model and its tokenizer as safetensors files that load_snapshot can map.
+    The model must already be merged (no PEFT wrappers), e.g. with `merge_and_unload()`.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    model.save_pretrained(snapshot_dir, safe_serialization=True)  # Writes config.json and *.safetensors.
+    tokenizer.save_pretrained(snapshot_dir)
+    logger.info(f"Model snapshot written to {snapshot_dir}")
+
+
+def map_safetensors(file_path) -> dict:
+    """
+    Memory-maps one safetensors file and returns its tensors without copying them.
+    Pages are read from disk only when a tensor is first used, and the mapping is
+    copy-on-write, so several processes mapping the same file share one copy in the page cache.
+    """
+    with open(file_path, "rb") as weights_file:
+        mapped = mmap.mmap(weights_file.fileno(), 0, access=mmap.ACCESS_COPY)
+    _open_maps.append(mapped)
+
+    # File layout: 8-byte little-endian header length, JSON header, then the raw tensor data.
+    header_length = struct.unpack("<Q", mapped[:8])[0]
+    header = json.loads(mapped[8:8 + header_length])
+    data_start = 8 + header_length
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        tensor = torch.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + begin) if count else torch.empty(0, dtype=dtype)
+        tensors[name] = tensor.reshape(info["shape"])
+    return tensors
+
+
+def load_snapshot(snapshot_dir):
+    """
+    Rebuilds a causal LM from a snapshot directory with its weights backed by memory maps.
+    Only the model skeleton is allocated; the parameters are views on the mapped files.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    config = AutoConfig.from_pretrained(snapshot_dir)
+    # Parameters are created on the "meta" device (no memory); buffers such as rotary
+    # frequencies are still created normally because they are not stored in the files.
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config)
+
+    state_dict = {}
+    for file_path in sorted(snapshot_dir.glob("*.safetensors")):
+        state_dict.update(map_safetensors(file_path))
+    # assign=True makes the parameters point at the mapped tensors instead of copying into them.
+    _, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()  # Restores weights that save_pretrained drops because they are shared.
+    still_missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if still_missing or unexpected:
+        raise RuntimeError(f"Snapshot in {snapshot_dir} does not match its config (missing: {still_missing}, unexpected: {unexpected})")
+    logger.info(f"Loaded memory-mapped snapshot from {snapshot_dir} ({len(state_dict)} tensors)")
+    return model.eval()
@@ -0,0 +1,72 @@
+"""
+Latency of the full-text message search of the desktop app (src/database.py).
+
+Fills a temporary database with --messages messages spread over --discussions
+discussions through ChatStore (so the FTS5 index is maintained by its triggers, as
+in the app), then times search box queries, including prefix queries typed so far.
+
+    python benchmarks/bench_chat_search.py --messages 100000
+"""
+import argparse  # Command line options.
+import os  # Temporary file paths.
+import random  # Synthetic message text.
+import statistics  # Percentiles of the latencies.
+import sys  # Exit status and import path.
+import tempfile  # The database is created in a temporary directory.
+import time  # High resolution timer.
+from pathlib import Path  # Paths of the src folder and of the corpus.
+
+# Not taken from tiny_model, which imports torch: the desktop app's environment does not have it.
+REPO_ROOT = Path(__file__).resolve().parents[1]
+CORPUS_PATH = REPO_ROOT / "DATA_USED" / "LawsTXT" / "CameroonLaw.txt"  # Law corpus used as message vocabulary.
+
+sys.path.insert(0, str(REPO_ROOT / "src"))
+from database import ChatStore  # The store used by the app.
+
+QUERIES = ["cybercrime", "cyber", "penalty theft", "article 318", "constitution amend", "peine vol", "infanticide", "tribunal"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000, help="Messages in the database.")
+    parser.add_argument("--discussions", type=int, default=1000, help="Discussions they are spread over.")
+    parser.add_argument("--repeats", type=int, default=20, help="Timed passes over the query set.")
+    parser.add_argument("--max-p95-ms", type=float, default=50.0, help="Fail if the p95 latency is higher.")
+    args = parser.parse_args()
+
+    # Messages are random runs of sentences from the law corpus.
+    with open(CORPUS_PATH, encoding="utf-8") as corpus_file:
+        sentences = [line.strip() for line in corpus_file if len(line.strip()) > 20]
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ChatStore(os.path.join(tmp, "database.db"))
+        start = time.perf_counter()
+        discussions = [store.create_discussion() for _ in range(args.discussions)]
+        with store.batch():
+            for i in range(args.messages):
+                text = " ".join(rng.choice(sentences) for _ in range(rng.randint(1, 4)))
+                store.insert_message(rng.choice(discussions), "user" if i % 2 else "bot", text)
+        store.flush()
+        print(f"inserted {args.messages} messages in {time.perf_counter() - start:.1f} s "
+              f"({Path(tmp, 'database.db').stat().st_size / 1024 ** 2:.0f} MB)")
+
+        latencies = []
+        for _ in range(args.repeats):
+            for query in QUERIES:
+                query_start = time.perf_counter()
+                results = store.search_messages(query, limit=20)
+                latencies.append((time.perf_counter() - query_start) * 1000)
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95)]
+        print(f"search latency: p50 {statistics.median(latencies):.2f} ms, p95 {p95:.2f} ms, max {latencies[-1]:.2f} ms")
+        for query in QUERIES[:3]:
+            results = store.search_messages(query, limit=3)
+            print(f"{query!r}: " + " | ".join(snippet.replace("\x02", "[").replace("\x03", "]") for *_, snippet in results))
+        store.close()
+    if p95 > args.max_p95_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Memory and latency of the memory-mapped dense law index (api/dense_retrieval.py).
+
+Writes a synthetic float16 vector file of --chunks rows (far more than today's corpus,
+to stand in for the codes still to be added), maps it the way the server does, and
+compares answering --queries questions one matrix multiply each against one batched
+multiply. Resident memory is reported after mapping and after the searches.
+
+    python benchmarks/bench_dense_retrieval.py --chunks 200000 --dimension 384 --queries 32
+"""
+import argparse  # Command line options.
+import os  # File paths.
+import time  # High resolution timer.
+
+import numpy as np  # Synthetic vectors.
+import psutil  # Resident memory of this process.
+
+from tiny_model import CACHE_DIR  # Where the synthetic vector file is written; also makes the api modules importable.
+from dense_retrieval import VECTORS_FILE, DenseIndex  # The index served by the API.
+
+
+def rss_mb() -> float:
+    """Resident set size of this process in MB."""
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def unit_rows(rng, rows, dimension):
+    """Random unit-length float32 vectors."""
+    vectors = rng.standard_normal((rows, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200000, help="Number of indexed vectors.")
+    parser.add_argument("--dimension", type=int, default=384, help="Embedding size (384 for MiniLM).")
+    parser.add_argument("--queries", type=int, default=32, help="Concurrent questions answered together.")
+    parser.add_argument("--top-k", type=int, default=3, help="Chunks returned per question.")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed repetitions; the best one is reported.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    index_dir = CACHE_DIR / f"dense-{args.chunks}x{args.dimension}"
+    vectors_path = index_dir / VECTORS_FILE
+    if not vectors_path.exists():
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(vectors_path, unit_rows(rng, args.chunks, args.dimension).astype(np.float16))
+    print(f"vector file: {os.path.getsize(vectors_path) / 1024 ** 2:.1f} MB ({args.chunks} x {args.dimension} float16)")
+
+    before = rss_mb()
+    index = DenseIndex(np.load(vectors_path, mmap_mode="r"), conn=None, model_id="synthetic", corpus_digest="")
+    print(f"RSS after mapping: +{rss_mb() - before:.1f} MB")
+
+    queries = unit_rows(rng, args.queries, args.dimension)
+    timings = {}
+    for name, run in (
+        ("one query per multiply", lambda: [index.search_vectors(query[None, :], args.top_k) for query in queries]),
+        ("batched multiply", lambda: index.search_vectors(queries, args.top_k)),
+    ):
+        best = float("inf")
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+        print(f"{name:>24}: {best * 1000:8.1f} ms for {args.queries} queries ({best * 1000 / args.queries:.2f} ms/query)")
+    print(f"batching speed-up: {timings['one query per multiply'] / timings['batched multiply']:.1f}x")
+    print(f"RSS after searching: +{rss_mb() - before:.1f} MB (page cache of the mapped file included)")
+
+    # The batched and per-query paths must agree.
+    single = [index.search_vectors(query[None, :], args.top_k)[0] for query in queries]
+    batched = index.search_vectors(queries, args.top_k)
+    assert [[i for _, i in row] for row in single] == [[i for _, i in row] for row in batched]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Time and memory of the spreadsheet extraction of the desktop app (src/file_extraction.py).
+
+Generates a ledger-like workbook of --rows rows (cached under benchmarks/.cache) and extracts
+it three ways, each in a fresh process so the peak resident memory can be compared:
+
+  - legacy: the previous extractor, full (non read-only) load, one list element per cell;
+  - streamed: read-only mode, iter_rows(values_only=True), text built row by row, whole file;
+  - streamed + early stop: the same, stopping at MAX_SPREADSHEET_CHARS, as the app does.
+
+    python benchmarks/bench_excel_extraction.py --rows 100000
+"""
+import argparse  # Command line options.
+import os  # File paths.
+import random  # Synthetic ledger values.
+import sys  # Makes the desktop app modules importable.
+import threading  # Samples the memory while an extraction runs.
+import time  # High resolution timer.
+from concurrent.futures import ProcessPoolExecutor  # One fresh process per measurement.
+from datetime import date, timedelta  # Ledger dates.
+from pathlib import Path  # Object-oriented file paths.
+
+import openpyxl  # Writes the workbook, and runs the legacy extractor.
+import psutil  # Resident memory of the measuring process.
+
+REPO_ROOT = Path(__file__).resolve().parent.parent  # Root of the repository.
+CACHE_DIR = Path(os.environ.get("BENCH_CACHE_DIR", REPO_ROOT / "benchmarks" / ".cache"))  # Where the workbook is kept.
+sys.path.insert(0, str(REPO_ROOT / "src"))
+from file_extraction import MAX_SPREADSHEET_CHARS, extract_text_from_excel  # The extractor used by the app.
+
+ACCOUNTS = ["Loyer", "Honoraires", "Frais de greffe", "Timbres fiscaux", "Transport", "Expertise", "Traduction"]
+
+
+def build_workbook(path, rows):
+    """Writes a one-sheet ledger: date, reference, account, description, debit, credit, balance, status."""
+    rng = random.Random(0)
+    workbook = openpyxl.Workbook(write_only=True)  # Streams rows to disk, so generating stays cheap.
+    sheet = workbook.create_sheet("Grand livre")
+    sheet.append(["Date", "Reference", "Compte", "Libelle", "Debit", "Credit", "Solde", "Statut"])
+    balance = 0.0
+    for row in range(rows):
+        debit = round(rng.uniform(0, 500000), 2) if row % 2 else None
+        credit = None if row % 2 else round(rng.uniform(0, 500000), 2)
+        balance += (credit or 0) - (debit or 0)
+        sheet.append([date(2020, 1, 1) + timedelta(days=row % 1500), f"PC-{row:07d}", rng.choice(ACCOUNTS),
+                      f"Dossier {rng.randint(1, 5000)} - audience du tribunal", debit, credit, round(balance, 2),
+                      rng.choice(["Valide", "En attente"])])
+    workbook.save(path)
+
+
+def legacy_extract_text_from_excel(file_path):
+    """The previous extractor: full load, every cell kept as a separate list element."""
+    workbook = openpyxl.load_workbook(file_path, data_only=True)
+    all_text = []
+    for sheet_name in workbook.sheetnames:
+        sheet = workbook[sheet_name]
+        sheet_text = []
+        for row in sheet.iter_rows():
+            for cell in row:
+                if cell.value is not None:
+                    sheet_text.append(str(cell.value))
+        if sheet_text:
+            all_text.append(f"--- Sheet: {sheet_name} ---\n" + "\n".join(sheet_text))
+    return "\n\n".join(all_text)
+
+
+def measure(name, path):
+    """Runs one extractor in this (fresh) process; returns (seconds, characters, peak RSS increase in MB)."""
+    extractors = {
+        "legacy": legacy_extract_text_from_excel,
+        "streamed": lambda file_path: extract_text_from_excel(file_path, max_chars=float("inf")),
+        "streamed + early stop": extract_text_from_excel,
+    }
+    process = psutil.Process()
+    before = process.memory_info().rss
+    peak = [before]
+
+    def sample():  # Polls the RSS while the extraction runs; the peak is what matters on a laptop.
+        while not done:
+            peak[0] = max(peak[0], process.memory_info().rss)
+            time.sleep(0.01)
+
+    done = False
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    text = extractors[name](path)
+    elapsed = time.perf_counter() - start
+    done = True
+    sampler.join()
+    return elapsed, len(text), (max(peak[0], process.memory_info().rss) - before) / 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="Rows of the generated workbook.")
+    args = parser.parse_args()
+
+    path = CACHE_DIR / f"ledger-{args.rows}.xlsx"
+    if not path.exists():
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        build_workbook(path, args.rows)
+    print(f"workbook: {path.stat().st_size / 1024 ** 2:.1f} MB, {args.rows} rows x 8 columns; "
+          f"early stop at {MAX_SPREADSHEET_CHARS} characters")
+
+    results = {}
+    for name in ("legacy", "streamed", "streamed + early stop"):
+        with ProcessPoolExecutor(max_workers=1) as pool:  # Fresh process: peak memory is not shared between runs.
+            results[name] = pool.submit(measure, name, str(path)).result()
+        elapsed, chars, peak_mb = results[name]
+        print(f"{name:>22}: {elapsed:7.2f} s, peak RSS +{peak_mb:7.1f} MB, {chars} characters")
+    assert results["streamed + early stop"][1] <= MAX_SPREADSHEET_CHARS + 100  # Budget plus the sheet header.
+    print(f"early stop speed-up over legacy: {results['legacy'][0] / results['streamed + early stop'][0]:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Compares decode speed and memory of the INFERENCE_MODE settings of contact_model.py:
+fp32 base model + LoRA adapter, merged adapter, merged + dynamic int8, merged + bf16.
+
+Each mode runs in its own subprocess so that resident memory is measured cleanly.
+By default a small random Llama with a random LoRA adapter is used (no download);
+pass --base-model/--adapter to measure the real TinyLlama and fine-tuned adapter.
+
+    python benchmarks/bench_inference_modes.py --new-tokens 64 --repeats 3
+"""
+import argparse  # Command line options.
+import json  # Results are passed from the subprocesses as JSON.
+import subprocess  # Each mode runs in a fresh interpreter.
+import sys  # Path of the current interpreter.
+import time  # High resolution timer.
+
+from tiny_model import build_model, build_tokenizer  # Offline model; also makes the api modules importable.
+
+MODES = ("adapter", "merged", "int8", "bf16")  # Same values as contact_model.INFERENCE_MODES.
+PROMPT = "What is the penalty for theft under the Cameroon penal code?"
+
+
+def rss_mb() -> float:
+    """Resident set size of this process in MB."""
+    import psutil
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def load_models(args):
+    """Returns (tokenizer, PeftModel) for either the tiny offline model or the real hub models."""
+    from peft import LoraConfig, PeftModel, get_peft_model
+    if args.base_model:
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.base_model)
+        base_model = AutoModelForCausalLM.from_pretrained(args.base_model)
+        return tokenizer, PeftModel.from_pretrained(base_model, args.adapter)
+
+    tokenizer = build_tokenizer()
+    base_model = build_model(tokenizer, hidden_size=args.hidden_size, num_layers=args.layers)
+    # A randomly initialised adapter, so merging actually changes the weights.
+    lora_config = LoraConfig(r=8, lora_alpha=16, target_modules=["q_proj", "v_proj"], init_lora_weights=False)
+    return tokenizer, get_peft_model(base_model, lora_config)
+
+
+def run_mode(args):
+    """Measures one mode in the current process and prints a JSON line with the results."""
+    import torch
+    from contact_model import prepare_model_for_inference
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    baseline_mb = rss_mb()
+    tokenizer, model = load_models(args)
+    model = prepare_model_for_inference(model, args.run_mode, on_cuda=False)
+    loaded_mb = rss_mb()
+
+    inputs = tokenizer(PROMPT, return_tensors="pt")
+    generate_kwargs = dict(
+        max_new_tokens=args.new_tokens,
+        min_new_tokens=args.new_tokens,  # Always decode the same number of tokens.
+        do_sample=False,
+        pad_token_id=tokenizer.eos_token_id,
+    )
+    with torch.no_grad():
+        model.generate(**inputs, **generate_kwargs)  # Warm-up.
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            model.generate(**inputs, **generate_kwargs)
+        elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        "mode": args.run_mode,
+        "tokens_per_s": args.new_tokens * args.repeats / elapsed,
+        "model_rss_mb": loaded_mb - baseline_mb,
+        "total_rss_mb": rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES, help="Modes to compare.")
+    parser.add_argument("--new-tokens", type=int, default=64, help="Tokens decoded per generation.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed generations per mode.")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads (0 = torch default).")
+    parser.add_argument("--hidden-size", type=int, default=512, help="Hidden size of the tiny model.")
+    parser.add_argument("--layers", type=int, default=6, help="Layers of the tiny model.")
+    parser.add_argument("--base-model", help="Hub id of a real base model, e.g. TinyLlama/TinyLlama-1.1B-Chat-v1.0.")
+    parser.add_argument("--adapter", help="Hub id of the LoRA adapter to apply to --base-model.")
+    parser.add_argument("--run-mode", help=argparse.SUPPRESS)  # Internal: measure a single mode.
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(args)
+        return
+    if args.base_model and not args.adapter:
+        parser.error("--base-model needs --adapter")
+
+    forwarded = sys.argv[1:]  # Pass the same options to every subprocess.
+    results = []
+    for mode in args.modes:
+        process = subprocess.run(
+            [sys.executable, __file__, *forwarded, "--run-mode", mode],
+            capture_output=True, text=True,
+        )
+        if process.returncode != 0:
+            sys.exit(f"Mode '{mode}' failed:\n{process.stderr}")
+        results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    print(f"{'mode':>8} {'tokens/s':>9} {'model RSS MB':>13} {'total RSS MB':>13}")
+    for result in results:
+        print(f"{result['mode']:>8} {result['tokens_per_s']:>9.1f} {result['model_rss_mb']:>13.0f} {result['total_rss_mb']:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Load test of the model API (api/contact_model.py), for regression numbers on serving changes.
+
+Starts `contact_model:app` under uvicorn in a subprocess, with the tiny randomly initialised
+Llama of tiny_model.py in place of TinyLlama (no download, no network), then sends --requests
+questions from --concurrency client threads and prints the results as JSON:
+
+  - latency (whole reply) and time to first token, p50/p95/p99 in milliseconds, as seen by the client;
+  - throughput: requests/s, and generated tokens/s from the server's /metrics;
+  - the median server-side stage times (queue, tokenize, prefill, decode) from Server-Timing.
+
+Questions are built from the articles of the law corpus: the title of an article, followed by
+the start of its text so that the prompt has a number of words drawn from --prompt-words
+("words:weight,..."). Everything is seeded, and the response cache of the server is turned off
+and greedy decoding is used by default, so two runs of the same revision send the same prompts
+and generate the same tokens. Batching and retrieval follow the usual environment variables
+(BATCH_MAX_SIZE, BATCH_WINDOW_MS, RETRIEVAL_TOP_K...) of the server. Unless LAW_INDEX_PATH is
+set, the BM25 law index is built from the corpus once and kept in benchmarks/.cache.
+
+    python benchmarks/bench_load.py --concurrency 8 --requests 200 --output load.json
+"""
+import argparse  # Command line options.
+import json  # Results, request bodies and server-sent events.
+import os  # Environment of the server process.
+import random  # Seeded choice of the questions and their lengths.
+import re  # Articles of the law corpus.
+import socket  # Finds a free port for the server.
+import subprocess  # The server runs in its own process, like in production.
+import sys  # Path of the current interpreter.
+import threading  # Client threads.
+import time  # High resolution timer.
+from concurrent.futures import ThreadPoolExecutor  # Runs --concurrency clients at a time.
+
+import requests  # HTTP client, one kept-alive session per client thread.
+
+from tiny_model import CACHE_DIR, CORPUS_PATH, build_model, build_tokenizer  # Offline model; also makes the api modules importable.
+
+ARTICLE = re.compile(r"^Article\s+(\d+)\s*[—-]\s*(.+)$", re.MULTILINE)  # "Article 318 — Theft." headings.
+SERVER_TIMING_STAGES = ("queue", "tokenize", "prefill", "decode")  # Medians reported from the Server-Timing values.
+
+
+def serve(args):
+    """Runs the API with the tiny model on --port until killed. Executed in the server subprocess."""
+    import torch
+    import uvicorn
+    from transformers import pipeline
+    import contact_model
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    def load_tiny_model():
+        """Replaces load_model: the same globals, set from the offline tokenizer and random weights."""
+        tokenizer = build_tokenizer()
+        model = build_model(tokenizer, hidden_size=args.hidden_size, num_layers=args.layers)
+        contact_model.tokenizer_global = tokenizer
+        contact_model.chat_pipeline_global = pipeline("text-generation", model=model, tokenizer=tokenizer, device=-1)
+        contact_model.stop_token_ids_global = contact_model.get_stop_token_ids(tokenizer)
+        contact_model.prefix_cache.get(model, tokenizer, contact_model.build_prompt_prefix())
+
+    startup = contact_model.app.router.on_startup
+    startup[startup.index(contact_model.load_model)] = load_tiny_model
+    uvicorn.run(contact_model.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def law_index_path():
+    """The BM25 law index in the cache directory, built from the corpus the first time."""
+    from retrieval import BM25Index
+    path = CACHE_DIR / "law_index.json.gz"
+    if not path.exists():
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        BM25Index.build(CORPUS_PATH.read_text(encoding="utf-8")).save(str(path))
+    return str(path)
+
+
+def start_server(args, port):
+    """Starts the server subprocess and waits until /health answers. Returns (process, base URL)."""
+    env = dict(os.environ, RESPONSE_CACHE_SIZE="0")  # Every request must reach the model.
+    if "LAW_INDEX_PATH" not in env and int(env.get("RETRIEVAL_TOP_K", 3)) > 0:
+        env["LAW_INDEX_PATH"] = law_index_path()  # The server does not start without an index.
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+               "--hidden-size", str(args.hidden_size), "--layers", str(args.layers), "--threads", str(args.threads)]
+    process = subprocess.Popen(command, env=env)
+    url = f"http://127.0.0.1:{port}/"
+    deadline = time.monotonic() + args.startup_timeout  # The first run also trains the tokenizer.
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with status {process.returncode}")
+        try:
+            if requests.get(url + "health", timeout=2).status_code == 200:
+                return process, url
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+    process.kill()
+    raise RuntimeError("The server did not become healthy in time")
+
+
+def parse_weights(text):
+    """Parses "12:0.5,48:0.3,160:0.2" into ([12, 48, 160], [0.5, 0.3, 0.2])."""
+    pairs = [item.split(":") for item in text.split(",") if item.strip()]
+    return [int(words) for words, _ in pairs], [float(weight) for _, weight in pairs]
+
+
+def build_questions(count, prompt_words, seed):
+    """`count` questions about random articles of the corpus, with word counts drawn from `prompt_words`."""
+    text = CORPUS_PATH.read_text(encoding="utf-8")
+    headings = list(ARTICLE.finditer(text))
+    articles = []
+    for heading, following in zip(headings, headings[1:] + [None]):
+        body = text[heading.end():following.start() if following else len(text)].split()
+        articles.append((" ".join(heading.group(2).split()), body))
+    lengths, weights = parse_weights(prompt_words)
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(count):
+        title, body = rng.choice(articles)
+        words = rng.choices(lengths, weights)[0]
+        question = f"What does the law say about {title.rstrip('.').lower()}?"
+        missing = words - len(question.split())
+        if missing > 0 and body:
+            question += " Context: " + " ".join((body * (missing // len(body) + 1))[:missing])
+        questions.append(question)
+    return questions
+
+
+def percentiles(values):
+    """p50/p95/p99 (nearest rank) of a list of seconds, in milliseconds; None without values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = lambda p: ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+    return {f"p{p}": round(rank(p) * 1000, 2) for p in (50, 95, 99)}
+
+
+def parse_server_timing(value):
+    """Parses "queue;dur=1.2, decode;dur=30.0" into {"queue": 0.0012, "decode": 0.03} (seconds)."""
+    stages = {}
+    for item in value.split(","):
+        name, _, duration = item.strip().partition(";dur=")
+        if duration:
+            stages[name] = float(duration) / 1000
+    return stages
+
+
+def scrape_tokens(url):
+    """Returns (sum, count) of lawbot_generated_tokens from /metrics."""
+    values = {}
+    for line in requests.get(url + "metrics", timeout=10).text.splitlines():
+        if line.startswith(("lawbot_generated_tokens_sum", "lawbot_generated_tokens_count")):
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+    return values.get("lawbot_generated_tokens_sum", 0.0), values.get("lawbot_generated_tokens_count", 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at the same time.")
+    parser.add_argument("--requests", type=int, default=100, help="Requests sent in total (after the warm-up).")
+    parser.add_argument("--warmup", type=int, default=4, help="Requests sent first and not measured.")
+    parser.add_argument("--endpoint", choices=("stream", "generate"), default="stream",
+                        help="/stream (server-sent events, gives TTFT) or / (one JSON reply).")
+    parser.add_argument("--prompt-words", default="12:0.5,48:0.3,160:0.2", help="Prompt length distribution, words:weight,...")
+    parser.add_argument("--max-new-tokens", type=int, default=64, help="max_new_tokens of every request.")
+    parser.add_argument("--temperature", type=float, default=0.0, help="0 decodes greedily, so runs are reproducible.")
+    parser.add_argument("--no-retrieval", action="store_true", help="Send use_retrieval=false.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the question choice.")
+    parser.add_argument("--hidden-size", type=int, default=256, help="Hidden size of the tiny model.")
+    parser.add_argument("--layers", type=int, default=4, help="Layers of the tiny model.")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads of the server (0: torch's default).")
+    parser.add_argument("--url", help="Load an already running server instead of starting one.")
+    parser.add_argument("--startup-timeout", type=float, default=600, help="Seconds to wait for the server.")
+    parser.add_argument("--output", help="Also write the JSON results to this file.")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)  # Internal: run the server.
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+
+    process = None
+    if args.url:
+        url = args.url.rstrip("/") + "/"
+    else:
+        process, url = start_server(args, free_port())
+    try:
+        questions = build_questions(args.warmup + args.requests, args.prompt_words, args.seed)
+        local = threading.local()  # One kept-alive session per client thread.
+
+        def send(question):
+            """Sends one question; returns (latency, time to first token or None, server stages, error or None)."""
+            if getattr(local, "session", None) is None:
+                local.session = requests.Session()
+            payload = {"user_input": question, "max_new_tokens": args.max_new_tokens, "temperature": args.temperature,
+                       "use_retrieval": not args.no_retrieval, "server_timing": True}
+            start = time.perf_counter()
+            first_token = None
+            stages = {}
+            try:
+                if args.endpoint == "generate":
+                    with local.session.post(url, json=payload, timeout=600) as response:
+                        response.raise_for_status()
+                        response.json()
+                        stages = parse_server_timing(response.headers.get("Server-Timing", ""))
+                else:
+                    with local.session.post(url + "stream", json=payload, stream=True, timeout=600) as response:
+                        response.raise_for_status()
+                        for line in response.iter_lines(decode_unicode=True):
+                            if not line or not line.startswith("data:"):
+                                continue
+                            event = json.loads(line[len("data:"):])
+                            if "token" in event and first_token is None:
+                                first_token = time.perf_counter() - start
+                            elif "error" in event:
+                                raise RuntimeError(event["error"])
+                            elif "server_timing" in event:
+                                stages = parse_server_timing(event["server_timing"])
+            except (requests.exceptions.RequestException, RuntimeError, ValueError) as e:
+                return time.perf_counter() - start, None, {}, str(e)
+            return time.perf_counter() - start, first_token, stages, None
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(send, questions[:args.warmup]))  # Loads the prefix cache and the allocator.
+            tokens_before = scrape_tokens(url)
+            start = time.perf_counter()
+            results = list(pool.map(send, questions[args.warmup:]))
+            elapsed = time.perf_counter() - start
+        tokens_after = scrape_tokens(url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    succeeded = [result for result in results if result[3] is None]
+    tokens = tokens_after[0] - tokens_before[0]
+    server_stages = {}
+    for stage in SERVER_TIMING_STAGES:
+        durations = sorted(result[2][stage] for result in succeeded if stage in result[2])
+        if durations:
+            server_stages[stage] = round(durations[len(durations) // 2] * 1000, 2)
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("serve", "port", "output")},
+        "requests": len(results),
+        "errors": len(results) - len(succeeded),
+        "first_error": next((result[3] for result in results if result[3] is not None), None),
+        "duration_s": round(elapsed, 3),
+        "latency_ms": percentiles([result[0] for result in succeeded]),
+        "ttft_ms": percentiles([result[1] for result in succeeded if result[1] is not None]),
+        "throughput": {
+            "requests_per_s": round(len(succeeded) / elapsed, 3),
+            "generated_tokens": int(tokens),
+            "tokens_per_s": round(tokens / elapsed, 2),
+        },
+        "server_median_ms": server_stages,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
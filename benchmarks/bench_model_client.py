@@ -0,0 +1,147 @@
+"""
+Connection reuse, failover and hedging of the desktop app's model client (src/model_handler.py).
+
+Starts local stub model servers that speak the API's "/stream" protocol (server-sent events)
+and answer "/health", then measures:
+
+  1. a new connection per message (the previous requests.post) against the pooled session;
+  2. failover when the first endpoint is dead (connection refused) or asleep (HTTP 503);
+  3. a slow endpoint (--slow-ms before the response headers), with and without hedging.
+
+The behaviour itself (failover, hedging, the /stream 404 fallback, health checks) is tested by
+tests/test_model_handler.py; this script only reports the timings.
+
+The stubs count TCP connections, so the reuse of the pooled session is visible too. Over
+loopback a new connection costs little; to the Spaces every one also pays a TLS handshake.
+
+    python benchmarks/bench_model_client.py --messages 200 --slow-ms 1500
+"""
+import argparse  # Command line options.
+import json  # Server-sent events payloads.
+import os  # File paths.
+import socket  # Reserves a port nobody listens on, for the dead endpoint.
+import statistics  # Medians.
+import sys  # Makes the desktop app modules importable.
+import threading  # Runs the stub servers.
+import time  # High resolution timer.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Stub model servers.
+
+import requests  # The previous, unpooled client.
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import model_handler  # The client under test.
+from model_handler import EndpointPool
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """A model server that streams a fixed reply after an optional delay, or fails with a status."""
+    protocol_version = "HTTP/1.1"  # Keep-alive, like uvicorn behind the Space proxy.
+    disable_nagle_algorithm = True  # Like uvicorn; otherwise delayed ACKs add 40 ms to kept-alive requests.
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.send_body(self.server.status, b'{"status": "ok"}', "application/json")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.delay)  # Queueing or retrieval before the headers are sent.
+        events = "".join(f"data: {json.dumps({'token': token})}\n\n" for token in ("The ", "law ", "says."))
+        self.send_body(self.server.status, (events + "event: done\ndata: {}\n\n").encode(), "text/event-stream")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass  # Keep the benchmark output readable.
+
+
+def start_stub(delay=0.0, status=200):
+    """Starts a stub server in a thread and returns its base URL and the server (for its counters)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.handle_error = lambda request, client_address: None  # Clients closing mid-reply are expected.
+    server.delay, server.status, server.connections = delay, status, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/", server
+
+
+def dead_url():
+    """A URL whose port refuses connections."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/"
+
+
+def stream_reply(question="What is the penalty for theft?"):
+    """Reads one full reply with the app's streaming client and returns (seconds, text)."""
+    start = time.perf_counter()
+    text = "".join(model_handler.generate_reply_stream(question))
+    return time.perf_counter() - start, text
+
+
+def use_pool(pool):
+    """Makes the app's functions send their requests through `pool`."""
+    model_handler.endpoint_pool.close()
+    model_handler.endpoint_pool = pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200, help="Messages sent per measurement.")
+    parser.add_argument("--slow-ms", type=float, default=1500, help="Delay of the slow endpoint before answering.")
+    args = parser.parse_args()
+    model_handler.logger.setLevel("WARNING")
+    model_handler.HEDGE_MIN_DELAY = 0.05  # Local stubs answer in about a millisecond.
+
+    # 1. Connection reuse.
+    fast_url, fast = start_stub()
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        with requests.post(fast_url + "stream", data="{}", stream=True, timeout=(10, 210)) as response:
+            for _ in response.iter_lines():
+                pass
+    unpooled = (time.perf_counter() - start) / args.messages
+    unpooled_connections, fast.connections = fast.connections, 0
+    use_pool(EndpointPool([fast_url], health_check_interval=0))
+    stream_reply()  # Opens the connection.
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        stream_reply()
+    pooled = (time.perf_counter() - start) / args.messages
+    print(f"new connection per message: {unpooled * 1000:6.2f} ms/message, {unpooled_connections} connections")
+    print(f"pooled keep-alive session : {pooled * 1000:6.2f} ms/message, {fast.connections} connection(s)")
+
+    # 2. Failover: the first ranked endpoint is dead, then asleep.
+    asleep_url, _ = start_stub(status=503)
+    for name, bad_url in (("dead (connection refused)", dead_url()), ("asleep (HTTP 503)", asleep_url)):
+        pool = EndpointPool([bad_url, fast_url], health_check_interval=0)
+        pool.endpoints[0].tie_breaker, pool.endpoints[1].tie_breaker = 0.0, 1.0  # Try the bad one first.
+        use_pool(pool)
+        timings = [stream_reply() for _ in range(20)]
+        print(f"{name:>26}: first message {timings[0][0] * 1000:6.1f} ms, "
+              f"median afterwards {statistics.median(t for t, _ in timings[1:]) * 1000:5.2f} ms "
+              f"(bad endpoint backed off, {pool.endpoints[0].failures} failure(s))")
+
+    # 3. Hedging a slow endpoint.
+    slow_url, _ = start_stub(delay=args.slow_ms / 1000)
+    for hedge in (False, True):
+        pool = EndpointPool([slow_url, fast_url], health_check_interval=0)
+        pool.endpoints[0].tie_breaker, pool.endpoints[1].tie_breaker = 0.0, 1.0  # The slow one ranks first.
+        if not hedge:
+            model_handler.HEDGE_MIN_DELAY = 3600.0  # Never race it.
+        use_pool(pool)
+        elapsed, _ = stream_reply()
+        model_handler.HEDGE_MIN_DELAY = 0.05
+        print(f"slow first endpoint, {'hedged' if hedge else 'not hedged':>10}: {elapsed * 1000:7.1f} ms")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Query latency of the BM25 law retrieval used by contact_model.py.
+
+Builds the index from the corpus (or loads a prebuilt one with --index) and times a set of
+real questions, those of the known article lookups whose recall tests/test_retrieval.py checks.
+
+    python benchmarks/bench_retrieval.py --top-k 3
+"""
+import argparse  # Command line options.
+import statistics  # Percentiles of the latencies.
+import sys  # Import path.
+import time  # High resolution timer.
+from pathlib import Path  # Paths of the api folder and of the corpus.
+
+# Not taken from tiny_model, which imports torch: this benchmark needs nothing beyond the standard library.
+REPO_ROOT = Path(__file__).resolve().parents[1]
+CORPUS_PATH = REPO_ROOT / "DATA_USED" / "LawsTXT" / "CameroonLaw.txt"
+sys.path.insert(0, str(REPO_ROOT / "api"))
+from retrieval import BM25Index  # The index served by the API.
+
+QUESTIONS = [
+    "What is the penalty for theft?",
+    "What does article 318 of the penal code say?",
+    "What is the punishment for murder?",
+    "Does criminal law apply to everyone?",
+    "Can criminal law be applied retroactively?",
+    "What is infanticide?",
+    "How can the Constitution be amended?",
+    "Quelle est la peine pour le vol ?",
+    "Que dit l'article 2 du code pénal ?",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="Prebuilt index (law_index.json.gz). Built from the corpus if omitted.")
+    parser.add_argument("--top-k", type=int, default=3, help="Number of articles retrieved per question.")
+    parser.add_argument("--repeats", type=int, default=200, help="Timed passes over the question set.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.index:
+        index = BM25Index.load(args.index)
+    else:
+        with open(CORPUS_PATH, encoding="utf-8") as corpus_file:
+            index = BM25Index.build(corpus_file.read())
+    print(f"index: {len(index.chunks)} chunks, {len(index.postings)} terms, ready in {time.perf_counter() - start:.2f} s")
+
+    latencies = []
+    for _ in range(args.repeats):
+        for question in QUESTIONS:
+            query_start = time.perf_counter()
+            index.search(question, args.top_k)
+            latencies.append((time.perf_counter() - query_start) * 1000)
+    latencies.sort()
+    print(f"query latency: p50 {statistics.median(latencies):.3f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)]:.3f} ms, max {latencies[-1]:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Cost of selecting, creating and deleting discussions in the sidebar of the desktop app (src/sidebar.py).
+
+Creates --discussions discussions in a temporary app data directory, builds the sidebar on a
+headless page (Flet controls are real; the page only counts updates), and times --clicks
+selection changes and a create/delete round trip:
+
+  - legacy: the previous handlers, which reloaded the discussions from SQLite and rebuilt every
+    list item (legacy_refresh) after each change;
+  - targeted: the in-memory model, which inserts, removes or restyles the affected items only.
+
+Only the sidebar work is timed; loading the messages of the selected discussion is the same
+both ways and left out. SELECT statements are counted with an SQLite trace callback. Requires flet.
+
+    python benchmarks/bench_sidebar.py --discussions 5000
+"""
+import argparse  # Command line options.
+import os  # Environment of the app data directory.
+import sqlite3  # Creates the discussions in bulk.
+import sys  # Makes the desktop app modules importable.
+import tempfile  # The app data directory is temporary.
+import time  # High resolution timer.
+from pathlib import Path  # Path of the src folder.
+
+REPO_ROOT = Path(__file__).resolve().parent.parent  # Root of the repository.
+sys.path.insert(0, str(REPO_ROOT / "src"))
+from bench_theme_switch import HeadlessPage  # The same headless page.
+
+
+def measure(operation, repeats, statements):
+    """Returns (mean ms per operation, SELECT statements per operation)."""
+    statements.clear()
+    start = time.perf_counter()
+    for index in range(repeats):
+        operation(index)
+    elapsed = (time.perf_counter() - start) / repeats
+    return elapsed * 1000, sum(statement.lstrip().upper().startswith("SELECT") for statement in statements) / repeats
+
+
+def legacy_refresh(sidebar, page, new_discussion_id=None):
+    """The previous ModernNavBar.refresh_sidebar: reloads every discussion and rebuilds every list item."""
+    sidebar.discussions = list(sidebar.get_discussions())
+    if new_discussion_id:
+        sidebar.current_selected = new_discussion_id
+    sidebar.items = {}
+    sidebar.discussion_list.controls[sidebar.first_item_index:] = sidebar.create_discussion_list_items(sidebar.discussions)
+    page.update()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--discussions", type=int, default=5000, help="Discussions listed in the sidebar.")
+    parser.add_argument("--clicks", type=int, default=50, help="Selection changes per measurement.")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="bench-sidebar-")
+    os.environ["HOME"] = os.environ["LOCALAPPDATA"] = data_dir  # get_database_path() then points inside it.
+    import flet as ft
+    import main as app_module  # The desktop app; imported after HOME is set.
+    from database import discussion_title
+
+    app = app_module.LawyerChatBotApp(HeadlessPage(ft.ThemeMode.LIGHT))
+    with sqlite3.connect(app.get_database_path()) as conn:  # Bulk insert; the app's connection runs in WAL mode.
+        first_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM discussions").fetchone()[0]
+        conn.executemany("INSERT INTO discussions (id, title, created_at) VALUES (?, ?, '2024-01-01 00:00:00')",
+                         [(discussion_id, discussion_title(discussion_id)) for discussion_id in range(first_id, first_id + args.discussions)])
+    sidebar = app.sidebar.__class__(app)  # Built after the discussions exist.
+    ids = [discussion_id for discussion_id, _ in sidebar.discussions]
+
+    def legacy_select(index):
+        sidebar.current_selected = ids[index % len(ids)]
+        legacy_refresh(sidebar, app.page)
+
+    def targeted_select(index):
+        sidebar.select_discussion(ids[index % len(ids)])
+        app.page.update()
+
+    def legacy_create_delete(index):
+        discussion_id = app.store.create_discussion()
+        legacy_refresh(sidebar, app.page, discussion_id)
+        app.store.delete_discussion(discussion_id).result()
+        legacy_refresh(sidebar, app.page)
+
+    def targeted_create_delete(index):
+        discussion_id = app.store.create_discussion()
+        sidebar.add_discussion(discussion_id, discussion_title(discussion_id))
+        sidebar.select_discussion(discussion_id)
+        app.page.update()
+        app.store.delete_discussion(discussion_id).result()
+        sidebar.remove_discussion(discussion_id)
+        app.page.update()
+
+    statements = []
+    app.store.read_conn.set_trace_callback(statements.append)
+    for name, legacy, targeted in (("select", legacy_select, targeted_select),
+                                   ("create + delete", legacy_create_delete, targeted_create_delete)):
+        legacy_ms, legacy_selects = measure(legacy, args.clicks, statements)
+        targeted_ms, targeted_selects = measure(targeted, args.clicks, statements)
+        print(f"{name:>15} ({args.discussions} discussions): legacy {legacy_ms:8.2f} ms, {legacy_selects:.0f} SELECT(s); "
+              f"targeted {targeted_ms:6.3f} ms, {targeted_selects:.0f} SELECT(s)")
+    assert [discussion_id for discussion_id, _ in sidebar.discussions] == ids  # The model still matches the database.
+    app.store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the per-step cost of the StopOnTokens stopping criterion.
+
+Compares the previous implementation, which looked up the stop tokens with
+`convert_tokens_to_ids` and built a Python list on every decode step, with the
+current one, which checks the last column against a precomputed tensor.
+
+    python benchmarks/bench_stop_tokens.py --steps 5000
+"""
+import argparse  # Command line options.
+import time  # High resolution timer.
+
+import torch  # PyTorch, used to build fake decoder inputs.
+from transformers import StoppingCriteria  # Base class of the legacy criterion.
+
+from tiny_model import build_tokenizer  # Offline tokenizer, no download needed.
+from contact_model import StopOnTokens, get_stop_token_ids  # Current implementation.
+
+
+class LegacyStopOnTokens(StoppingCriteria):
+    """The previous criterion: stop ids are rebuilt from the tokenizer at every step."""
+    def __init__(self, tokenizer_ref):
+        self.tokenizer_ref = tokenizer_ref
+
+    def __call__(self, input_ids, scores, **kwargs):
+        eos_token_id = self.tokenizer_ref.eos_token_id if self.tokenizer_ref.eos_token_id is not None else -1
+        stop_tokens_ids = [
+            self.tokenizer_ref.convert_tokens_to_ids("."),
+            self.tokenizer_ref.convert_tokens_to_ids("?"),
+            self.tokenizer_ref.convert_tokens_to_ids("!"),
+            self.tokenizer_ref.convert_tokens_to_ids("\n"),
+            eos_token_id,
+        ]
+        return torch.tensor(
+            [token_id in stop_tokens_ids for token_id in input_ids[:, -1].tolist()],
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
+
+
+def time_per_step(criterion, input_ids, steps):
+    """Returns the mean time of one criterion call in microseconds."""
+    for _ in range(100):  # Warm-up.
+        criterion(input_ids, None)
+    start = time.perf_counter()
+    for _ in range(steps):
+        criterion(input_ids, None)
+    return (time.perf_counter() - start) / steps * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, default=5000, help="Number of criterion calls per measurement.")
+    parser.add_argument("--seq-len", type=int, default=256, help="Length of the fake sequences.")
+    args = parser.parse_args()
+
+    tokenizer = build_tokenizer()
+    legacy = LegacyStopOnTokens(tokenizer)
+    current = StopOnTokens(get_stop_token_ids(tokenizer))
+
+    print(f"{'batch':>5} {'legacy us/step':>15} {'current us/step':>16} {'speed-up':>9}")
+    for batch_size in (1, 8, 32):
+        input_ids = torch.randint(0, len(tokenizer), (batch_size, args.seq_len))
+        # Both implementations must agree before their speed is compared.
+        assert torch.equal(legacy(input_ids, None), current(input_ids, None))
+        legacy_us = time_per_step(legacy, input_ids, args.steps)
+        current_us = time_per_step(current, input_ids, args.steps)
+        print(f"{batch_size:>5} {legacy_us:>15.2f} {current_us:>16.2f} {legacy_us / current_us:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Cost of switching between the light and dark theme of the desktop app (src/main.py).
+
+Creates a discussion of --messages messages in a temporary app data directory, opens it in
+the app on a headless page (Flet controls are real; the page only counts updates), and times
+--toggles theme switches:
+
+  - legacy: colors updated, then the discussion reloaded from SQLite and every message
+    control rebuilt (the previous toggle_theme);
+  - in place: toggle_theme, which recolors the rendered controls without reading the database.
+
+Both are measured with the first page of the discussion rendered and again after scrolling up
+until MAX_RENDERED_MESSAGES controls are kept. SELECT statements are counted with an SQLite
+trace callback. Requires flet.
+
+    python benchmarks/bench_theme_switch.py --messages 5000
+"""
+import argparse  # Command line options.
+import os  # Environment of the app data directory.
+import sys  # Makes the desktop app modules importable.
+import tempfile  # The app data directory is temporary.
+import time  # High resolution timer.
+from pathlib import Path  # Path of the src folder.
+
+REPO_ROOT = Path(__file__).resolve().parent.parent  # Root of the repository.
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+
+class HeadlessPage:
+    """The parts of ft.Page the app uses, without a Flet session; update() calls are only counted."""
+    def __init__(self, theme_mode):
+        self.theme_mode = theme_mode
+        self.overlay = []
+        self.controls = []
+        self.updates = 0
+
+    def add(self, *controls):
+        self.controls.extend(controls)
+
+    def update(self):
+        self.updates += 1
+
+    def show_snack_bar(self, snack_bar):
+        pass
+
+
+def legacy_toggle_theme(app, ft):
+    """The previous toggle_theme: switch, update colors, reload and rebuild the whole chat."""
+    app.page.theme_mode = ft.ThemeMode.DARK if app.page.theme_mode == ft.ThemeMode.LIGHT else ft.ThemeMode.LIGHT
+    app.update_theme_colors()
+    if app.current_discussion:
+        app.load_previous_messages(app.current_discussion)
+    app.page.update()
+
+
+def measure(app, toggle, toggles, statements):
+    """Returns (mean ms per switch, SELECT statements per switch)."""
+    statements.clear()
+    start = time.perf_counter()
+    for _ in range(toggles):
+        toggle()
+    elapsed = (time.perf_counter() - start) / toggles
+    return elapsed * 1000, sum(statement.lstrip().upper().startswith("SELECT") for statement in statements) / toggles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000, help="Messages in the discussion.")
+    parser.add_argument("--toggles", type=int, default=20, help="Theme switches per measurement.")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="bench-theme-")
+    os.environ["HOME"] = os.environ["LOCALAPPDATA"] = data_dir  # get_database_path() then points inside it.
+    import flet as ft
+    import main as app_module  # The desktop app; imported after HOME is set.
+
+    app = app_module.LawyerChatBotApp(HeadlessPage(ft.ThemeMode.LIGHT))
+    discussion_id = app.store.create_discussion()
+    with app.store.batch():
+        for index in range(args.messages):
+            sender = ("user", "bot")[index % 2]
+            app.store.insert_message(discussion_id, sender, f"Message {index}: what does article {index % 400} of the penal code say?")
+    app.store.flush()
+    app.switch_discussion(discussion_id)
+
+    statements = []
+    app.store.read_conn.set_trace_callback(statements.append)
+    for state in ("first page", "scrolled up"):
+        if state == "scrolled up":
+            while app.has_older_messages and len(app.chat.controls) < app_module.MAX_RENDERED_MESSAGES:
+                app.load_older_messages()
+            app.chat.auto_scroll = False
+        rendered = len(app.chat.controls)
+        legacy_ms, legacy_selects = measure(app, lambda: legacy_toggle_theme(app, ft), args.toggles, statements)
+        if state == "scrolled up":  # The legacy reload jumped back to the latest page; scroll up again.
+            while app.has_older_messages and len(app.chat.controls) < app_module.MAX_RENDERED_MESSAGES:
+                app.load_older_messages()
+        oldest_before = app.oldest_loaded_id
+        in_place_ms, in_place_selects = measure(app, lambda: app.toggle_theme(None), args.toggles, statements)
+        assert in_place_selects == 0 and app.oldest_loaded_id == oldest_before  # No read, and the view did not move.
+        print(f"{state} ({rendered} rendered of {args.messages}): legacy {legacy_ms:7.2f} ms/switch, "
+              f"{legacy_selects:.0f} SELECT(s); in place {in_place_ms:6.2f} ms/switch, {in_place_selects:.0f} SELECT(s)")
+    app.store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Offline stand-ins for TinyLlama used by the benchmarks.
+
+The benchmarks must run without downloading anything, so this module trains a small
+byte-level BPE tokenizer on the law corpus (cached on disk after the first run) and
+builds a randomly initialised Llama model of the same architecture family.
+"""
+import os  # Used to build file paths and check for the cached tokenizer.
+import sys  # Used to make the API modules importable from the benchmarks.
+from pathlib import Path  # Object-oriented file paths.
+
+import torch  # PyTorch, used to seed the random model weights.
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers  # Low-level tokenizer training.
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast  # Llama model and tokenizer wrappers.
+
+REPO_ROOT = Path(__file__).resolve().parent.parent  # Root of the repository.
+API_DIR = REPO_ROOT / "api"  # Folder holding contact_model.py.
+CORPUS_PATH = REPO_ROOT / "DATA_USED" / "LawsTXT" / "CameroonLaw.txt"  # Law corpus used to train the tokenizer.
+CACHE_DIR = Path(os.environ.get("BENCH_CACHE_DIR", REPO_ROOT / "benchmarks" / ".cache"))  # Where the tokenizer is kept.
+
+# Make `import contact_model` work from the benchmark scripts.
+if str(API_DIR) not in sys.path:
+    sys.path.insert(0, str(API_DIR))
+
+
+def build_tokenizer(vocab_size: int = 4000) -> PreTrainedTokenizerFast:
+    """Returns a BPE tokenizer trained on the law corpus, training it only on the first call."""
+    tokenizer_dir = CACHE_DIR / f"tokenizer-{vocab_size}"
+    if not (tokenizer_dir / "tokenizer.json").exists():
+        bpe = Tokenizer(models.BPE(unk_token="<unk>"))
+        bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        bpe.decoder = decoders.ByteLevel()
+        trainer = trainers.BpeTrainer(
+            vocab_size=vocab_size,
+            special_tokens=["<unk>", "<s>", "</s>"],  # Same special tokens as the Llama tokenizer.
+            initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),  # Every byte is encodable.
+        )
+        bpe.train([str(CORPUS_PATH)], trainer)
+        PreTrainedTokenizerFast(
+            tokenizer_object=bpe, bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+        ).save_pretrained(tokenizer_dir)
+    tokenizer = PreTrainedTokenizerFast.from_pretrained(tokenizer_dir)
+    tokenizer.padding_side = "left"  # Same settings as load_model in contact_model.py.
+    tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+
+def build_model(tokenizer, hidden_size: int = 256, num_layers: int = 4, seed: int = 0) -> LlamaForCausalLM:
+    """Returns a small, randomly initialised Llama model matching the tokenizer's vocabulary."""
+    torch.manual_seed(seed)  # Same weights on every run so numbers are comparable.
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 4,
+        num_hidden_layers=num_layers,
+        num_attention_heads=max(1, hidden_size // 64),
+        num_key_value_heads=max(1, hidden_size // 64),
+        max_position_embeddings=2048,  # TinyLlama's context window.
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    return LlamaForCausalLM(config).eval()
@@ -0,0 +1,178 @@
+"""
+Builds the request of a question with its attached documents, within the model's context window.
+
+The documents are cut into chunks at line boundaries, the chunks are ranked by relevance to the
+question (BM25 over the chunks of the attached documents), and the best ones are packed into the
+tokens left once the reply, the server's system prompt and retrieved law articles are reserved.
+Tokens are counted with TinyLlama's own tokenizer: its tokenizer.json is downloaded once into the
+app data directory and used offline afterwards. Without it (no network on first use, or the
+`tokenizers` package missing), a conservative characters-per-token estimate is used.
+"""
+import logging  # Library for logging events.
+import math  # For the BM25 inverse document frequency.
+import os  # For the tokenizer file paths.
+import re  # Words of the question and of the chunks.
+import threading  # The tokenizer is loaded once, by whichever worker thread needs it first.
+from collections import Counter  # Term frequencies of the chunks.
+
+import requests  # Downloads the tokenizer file the first time.
+
+try:
+    from tokenizers import Tokenizer  # Fast tokenizer runtime; optional, see CHARS_PER_TOKEN.
+except ImportError:
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_WINDOW = 2048  # TinyLlama's context length, prompt and reply together.
+REPLY_TOKENS = 256  # Tokens reserved for the reply (sent as max_new_tokens).
+PROMPT_OVERHEAD_TOKENS = 64  # System prompt and chat template added by the server.
+RETRIEVAL_RESERVED_TOKENS = 600  # Law articles the server adds to the prompt (3 articles of up to 600 characters).
+MIN_REPLY_TOKENS = 32  # max_new_tokens never goes below this, even for an oversized question.
+CHUNK_CHARS = 800  # Target size of a document chunk; chunks end at a line break.
+CHARS_PER_TOKEN = 3.0  # Estimate used without the tokenizer; low on purpose, so the window is never exceeded.
+TOKENIZER_URL = "https://huggingface.co/TinyLlama/TinyLlama-1.1B-Chat-v1.0/resolve/main/tokenizer.json"
+TOKENIZER_FILE = "tokenizer.json"
+BUNDLED_TOKENIZER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", TOKENIZER_FILE)  # Optional copy shipped with the app.
+
+WORD = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+    the of and to in a is that for on by with as be or are this it an at from which shall any not
+    le la les de des du un une et en est que qui dans par pour sur au aux ce il ou son sa ses ne pas
+""".split())  # English and French words too common to tell chunks apart.
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def terms(text):
+    """Lower-cased words of a text, without stop words and single letters."""
+    return [term for term in WORD.findall(text.lower()) if len(term) > 1 and term not in STOPWORDS]
+
+
+def split_chunks(text, chunk_chars=CHUNK_CHARS):
+    """Cuts a document into chunks of about `chunk_chars` characters, at line breaks when possible."""
+    chunks, current, size = [], [], 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        while len(line) > chunk_chars:  # A very long line (e.g. a PDF page without breaks) is cut.
+            if current:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            chunks.append(line[:chunk_chars])
+            line = line[chunk_chars:]
+        if size + len(line) > chunk_chars and current:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def rank_chunks(question, chunks):
+    """Returns the indexes of `chunks` by decreasing BM25 score for `question`; ties (and a question without terms) keep document order."""
+    query = set(terms(question))
+    if not query or not chunks:
+        return list(range(len(chunks)))
+    frequencies = [Counter(terms(chunk)) for chunk in chunks]
+    lengths = [sum(frequency.values()) for frequency in frequencies]
+    average_length = sum(lengths) / len(lengths) or 1
+    document_frequency = Counter(term for frequency in frequencies for term in query if term in frequency)
+    scores = []
+    for index, (frequency, length) in enumerate(zip(frequencies, lengths)):
+        score = 0.0
+        for term in query:
+            tf = frequency.get(term, 0)
+            if tf:
+                idf = math.log(1 + (len(chunks) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+        scores.append((-score, index))
+    return [index for _, index in sorted(scores)]
+
+
+class TokenCounter:
+    """Counts TinyLlama tokens. The tokenizer file is looked up in the app data directory, then next to the app, then downloaded."""
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir  # App data directory; the downloaded tokenizer.json is kept there.
+        self.tokenizer = None
+        self.loaded = False  # Loading is attempted once per run.
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return self.tokenizer
+            self.loaded = True
+            if Tokenizer is None:
+                logger.warning("The tokenizers package is not installed; token counts are estimated.")
+                return None
+            cached_path = os.path.join(self.cache_dir, TOKENIZER_FILE)
+            if not os.path.exists(cached_path) and not os.path.exists(BUNDLED_TOKENIZER):
+                try:
+                    response = requests.get(TOKENIZER_URL, timeout=(5, 30))
+                    response.raise_for_status()
+                    tmp_path = cached_path + ".tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(response.content)
+                    os.replace(tmp_path, cached_path)  # Never leave a truncated file behind.
+                except (requests.exceptions.RequestException, OSError) as e:
+                    logger.warning(f"Could not download the tokenizer ({e}); token counts are estimated until the next start.")
+                    return None
+            try:
+                self.tokenizer = Tokenizer.from_file(cached_path if os.path.exists(cached_path) else BUNDLED_TOKENIZER)
+            except Exception as e:  # A corrupted file: estimate instead.
+                logger.warning(f"Could not load the tokenizer ({e}); token counts are estimated.")
+            return self.tokenizer
+
+    def count(self, texts):
+        """Returns the number of tokens of each text."""
+        tokenizer = self.load()
+        if tokenizer is None:
+            return [math.ceil(len(text) / CHARS_PER_TOKEN) for text in texts]
+        return [len(encoding.ids) for encoding in tokenizer.encode_batch(list(texts), add_special_tokens=False)]
+
+
+class ContextBuilder:
+    """Packs the most relevant chunks of the attached files into the prompt budget."""
+    def __init__(self, token_counter):
+        self.token_counter = token_counter
+
+    def build(self, question, files, history_tokens=0):
+        """
+        Returns (question, documents, max_new_tokens) for a question and its attached files
+        (dicts with "name" and "content"). An empty question asks for an analysis of the files.
+        The documents are the selected chunks, sent apart from the question: the server puts them
+        in their own section of the prompt. `history_tokens` are those of the conversation memory.
+        """
+        if not question:
+            question = "Please analyze these documents:"
+        budget = CONTEXT_WINDOW - PROMPT_OVERHEAD_TOKENS - RETRIEVAL_RESERVED_TOKENS - REPLY_TOKENS - history_tokens
+        header = "Attached documents:\n\n"  # Section heading added by the server.
+        file_headers = [f"File: {file['name']}\nContent:\n" for file in files]
+        question_tokens, header_tokens, *file_header_tokens = self.token_counter.count([question, header] + file_headers)
+        budget -= question_tokens
+        if files:
+            budget -= header_tokens + sum(file_header_tokens)
+
+        chunks = [(file_index, chunk) for file_index, file in enumerate(files) for chunk in split_chunks(file["content"])]
+        selected = set()
+        for index in rank_chunks(question, [chunk for _, chunk in chunks]):
+            if budget <= 0:
+                break
+            estimate = len(chunks[index][1]) / 6  # Lower bound of the token count: skip the tokenizer for chunks that cannot fit.
+            if estimate > budget:
+                continue
+            tokens = self.token_counter.count([chunks[index][1] + "\n"])[0]
+            if tokens <= budget:
+                selected.add(index)
+                budget -= tokens
+
+        documents = []
+        for file_index, file in enumerate(files):
+            kept = [chunk for index, (chunk_file, chunk) in enumerate(chunks) if chunk_file == file_index and index in selected]
+            documents.append(file_headers[file_index] + "\n".join(kept)) # Chunks keep their order in the document.
+        max_new_tokens = REPLY_TOKENS + min(0, budget)  # Shrinks only if the question alone overflows the window.
+        return question, "\n\n".join(documents), max(MIN_REPLY_TOKENS, max_new_tokens)
@@ -0,0 +1,123 @@
+"""
+Conversation memory of a discussion: what the model is told about the turns before a question.
+
+The last VERBATIM_MESSAGES messages are repeated as they were (trimmed to VERBATIM_MESSAGE_CHARS).
+Older messages are folded, once each, into a rolling summary of one compressed line per message
+(the speaker and the message's first sentence). The summary is persisted per discussion in the
+discussion_memory table, with its token count and the id of the last message folded into it.
+A turn therefore reads and tokenizes only the messages stored since the previous summary, and
+the summary is capped at SUMMARY_TOKENS by dropping its oldest lines, so the history part of
+the prompt stays within MEMORY_TOKENS however long the discussion grows.
+"""
+import re  # Sentence boundaries.
+import threading  # Replies of one discussion may be generated by two workers at once.
+from collections import OrderedDict  # Token counts of the recent messages, least recently used first.
+
+MEMORY_TOKENS = 400  # History budget of a prompt: summary and recent messages together.
+SUMMARY_TOKENS = 120  # The oldest summary lines are dropped beyond this.
+VERBATIM_MESSAGES = 4  # Latest messages repeated as they were (two questions and their answers).
+VERBATIM_MESSAGE_CHARS = 600  # A longer recent message is cut.
+SUMMARY_LINE_CHARS = 160  # Length of the compressed line of an older message.
+PAGE_SIZE = 200  # Messages read per query while catching up with a long discussion.
+TOKEN_CACHE_SIZE = 256  # Recent messages whose token count is remembered.
+
+SPEAKERS = {"user": "User", "bot": "Assistant", "file": "Document"}  # System messages (errors) are left out.
+SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+SECTION_HEADER = "Conversation so far:\n\n"  # Added by the server (build_prompt) in front of the history.
+SUMMARY_HEADER = "Summary of earlier messages:\n"
+RECENT_HEADER = "Recent messages:\n"
+
+
+def compress_message(sender, text):
+    """The summary line of a message: its speaker and first sentence, whitespace collapsed."""
+    text = " ".join(text.split())
+    sentence = SENTENCE_END.split(text, 1)[0]
+    if len(sentence) > SUMMARY_LINE_CHARS:
+        sentence = sentence[:SUMMARY_LINE_CHARS].rsplit(" ", 1)[0] + "…"
+    return f"- {SPEAKERS[sender]}: {sentence}"
+
+
+def verbatim_message(sender, text):
+    """The line of a recent message, as it was unless it is very long."""
+    text = text.strip()
+    if len(text) > VERBATIM_MESSAGE_CHARS:
+        text = text[:VERBATIM_MESSAGE_CHARS].rsplit(" ", 1)[0] + "…"
+    return f"{SPEAKERS[sender]}: {text}"
+
+
+class ConversationMemory:
+    """Builds the history part of the prompt of a question from the stored messages of its discussion."""
+    def __init__(self, store, token_counter):
+        self.store = store  # ChatStore holding the messages and the summaries.
+        self.token_counter = token_counter  # Same counter as the ContextBuilder, so the budgets agree.
+        self.lock = threading.Lock()  # Two replies must not fold the same messages into the summary twice.
+        self.token_counts = OrderedDict()  # Message id -> tokens of its verbatim line.
+        self.header_tokens = None  # Tokens of SECTION_HEADER, SUMMARY_HEADER and RECENT_HEADER, counted once.
+
+    def messages_between(self, discussion_id, after_id, before_id):
+        """Messages of a discussion with after_id < id < before_id, as (id, sender, message), oldest first."""
+        messages = []
+        while True:
+            page = self.store.load_messages_page(discussion_id, before_id=before_id, after_id=after_id, limit=PAGE_SIZE)
+            messages.extend(page)
+            if len(page) < PAGE_SIZE:
+                return messages
+            after_id = page[-1][0]
+
+    def count_verbatim(self, message_id, line):
+        """Tokens of the verbatim line of a message; each message is tokenized once while it is recent."""
+        tokens = self.token_counts.get(message_id)
+        if tokens is None:
+            tokens = self.token_counter.count([line + "\n"])[0]
+            self.token_counts[message_id] = tokens
+            if len(self.token_counts) > TOKEN_CACHE_SIZE:
+                self.token_counts.popitem(last=False)
+        else:
+            self.token_counts.move_to_end(message_id)
+        return tokens
+
+    def context(self, discussion_id, before_id):
+        """
+        Returns (history, tokens): the earlier turns of a question stored as message `before_id`
+        (empty for the first question of a discussion), sent to the server apart from the question,
+        and its token count, including the heading the server puts in front of it.
+        """
+        with self.lock:
+            if self.header_tokens is None:
+                self.header_tokens = dict(zip(("section", "summary", "recent"), self.token_counter.count(
+                    [SECTION_HEADER, SUMMARY_HEADER, RECENT_HEADER])))
+            summary, summary_tokens, summarized_through = self.store.load_memory(discussion_id) or ("", 0, 0)
+            messages = [message for message in self.messages_between(discussion_id, summarized_through, before_id)
+                        if message[1] in SPEAKERS]
+            older, recent = messages[:-VERBATIM_MESSAGES or None], messages[-VERBATIM_MESSAGES:]
+
+            if older:  # Fold the messages that left the verbatim window; only they are tokenized.
+                lines = summary.splitlines() if summary else []
+                new_lines = [compress_message(sender, text) for _, sender, text in older]
+                lines.extend(new_lines)
+                summary_tokens += sum(self.token_counter.count([line + "\n" for line in new_lines]))
+                dropped = 0
+                while summary_tokens > SUMMARY_TOKENS and dropped < len(lines):  # Rolling: forget the oldest lines.
+                    summary_tokens -= self.token_counter.count([lines[dropped] + "\n"])[0]
+                    dropped += 1
+                summary = "\n".join(lines[dropped:])
+                summarized_through = older[-1][0]
+                self.store.save_memory(discussion_id, summary, summary_tokens, summarized_through) # Queued; not waited for.
+
+            recent_lines = [(verbatim_message(sender, text), message_id) for message_id, sender, text in recent]
+            recent_tokens = [self.count_verbatim(message_id, line) for line, message_id in recent_lines]
+
+        if not summary and not recent_lines:
+            return "", 0
+        tokens = self.header_tokens["section"]
+        if summary:
+            tokens += self.header_tokens["summary"] + summary_tokens
+        while recent_lines and tokens + self.header_tokens["recent"] + sum(recent_tokens) > MEMORY_TOKENS:
+            recent_lines, recent_tokens = recent_lines[1:], recent_tokens[1:]  # Oldest recent messages go first.
+        history = ""
+        if summary:
+            history += SUMMARY_HEADER + summary + "\n"
+        if recent_lines:
+            history += RECENT_HEADER + "\n".join(line for line, _ in recent_lines) + "\n"
+            tokens += self.header_tokens["recent"] + sum(recent_tokens)
+        return history.rstrip("\n"), tokens
@@ -0,0 +1,383 @@
+import queue  # Thread-safe queue feeding the writer thread.
+import re  # Regular expressions, used to recognise the old per-discussion tables.
+import sqlite3  # SQLite library for database operations.
+import threading  # The writer runs in its own thread; a lock guards the shared connection.
+from concurrent.futures import Future, wait  # Lets a caller wait for (or ignore) the result of a queued write.
+from contextlib import contextmanager  # Used for ChatStore.batch.
+from datetime import datetime  # For timestamps of discussions and messages.
+
+SCHEMA_VERSION = 3  # Stored in PRAGMA user_version; bumped whenever the schema changes.
+MAX_ROW_ID = 2 ** 63 - 1  # Largest SQLite rowid; "before MAX_ROW_ID" means the latest messages.
+LEGACY_TABLE = re.compile(r"^discussion_(\d+)$")  # Tables of the old layout: one per discussion.
+SEARCH_TERM = re.compile(r"\w+")  # Words of a search box query.
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"  # Mark the matched words in search snippets.
+
+
+def initialize_schema(conn):
+    """
+    Creates the discussions/messages tables and their indexes if needed, then moves
+    any old per-discussion tables into them. Safe to call on every start.
+    """
+    conn.execute("PRAGMA foreign_keys = ON")  # Deleting a discussion deletes its messages.
+    with conn:  # Commits at the end, rolls back on error.
+        # Python's sqlite3 only opens a transaction by itself before INSERT/UPDATE/DELETE, so the
+        # CREATE and DROP statements would run in autocommit mode: begin explicitly, so that either
+        # the whole schema (and migration) is applied or nothing, and a failed start can be retried.
+        conn.execute("BEGIN")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS discussions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                created_at DATETIME NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                discussion_id INTEGER NOT NULL REFERENCES discussions(id) ON DELETE CASCADE,
+                sender TEXT NOT NULL,
+                message TEXT NOT NULL,
+                timestamp DATETIME NOT NULL
+            )
+        """)
+        # History of one discussion in insertion order is a range scan of this index.
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_discussion ON messages (discussion_id, id)")
+        # Rolling summary of the older messages of a discussion, kept up to date by ConversationMemory.
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS discussion_memory (
+                discussion_id INTEGER PRIMARY KEY REFERENCES discussions(id) ON DELETE CASCADE,
+                summary TEXT NOT NULL,
+                summary_tokens INTEGER NOT NULL,
+                summarized_through INTEGER NOT NULL
+            )
+        """)
+        search_available = create_search_index(conn)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            migrate_legacy_tables(conn)
+        if version < 2 and search_available:
+            conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")  # Index the existing messages.
+        if version < SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return search_available
+
+
+def create_search_index(conn):
+    """
+    Creates the FTS5 full-text index of the messages and the triggers that keep it in sync
+    with every insert, update and delete. Returns False if this SQLite build lacks FTS5.
+    """
+    try:
+        # External content table: the text lives only in `messages`, the index stores the terms.
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                message,
+                content='messages',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"Full-text search is not available: {e}")
+        return False
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+            INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message);
+        END
+    """)
+    return True
+
+
+def search_query(text):
+    """
+    Turns search box text into an FTS5 query: every word must match, as a prefix so that
+    results appear while typing. Quoting the words keeps FTS5 syntax out of user input.
+    Returns None if the text has no word to search for.
+    """
+    terms = SEARCH_TERM.findall(text)
+    return " ".join(f'"{term}"*' for term in terms) or None
+
+
+def migrate_legacy_tables(conn):
+    """
+    Copies every old "discussion_N" table into the discussions/messages tables (keeping N
+    as the discussion id and the table name as its title) and drops the old table.
+    Must run inside the caller's transaction.
+    """
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    legacy = sorted((int(match.group(1)), name) for name in tables if (match := LEGACY_TABLE.match(name)))
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for discussion_id, table_name in legacy:
+        first_timestamp = conn.execute(f'SELECT MIN(timestamp) FROM "{table_name}"').fetchone()[0]
+        conn.execute(
+            "INSERT OR IGNORE INTO discussions (id, title, created_at) VALUES (?, ?, ?)",
+            (discussion_id, table_name, first_timestamp or now),
+        )
+        # Old tables were created with nullable columns by the sidebar, hence the COALESCEs.
+        conn.execute(f'''
+            INSERT INTO messages (discussion_id, sender, message, timestamp)
+            SELECT ?, COALESCE(sender, 'system'), COALESCE(message, ''), COALESCE(timestamp, ?)
+            FROM "{table_name}" ORDER BY timestamp, id
+        ''', (discussion_id, now))
+        conn.execute(f'DROP TABLE "{table_name}"')
+    if legacy:
+        print(f"Migrated {len(legacy)} discussion table(s) to the messages table")
+
+
+def discussion_title(discussion_id):
+    """Title given to a new discussion; known without reading it back from the database."""
+    return f"discussion_{discussion_id}"
+
+
+class ChatStore:
+    """
+    Persistence layer of the chat: owns the single SQLite connection of the app.
+    The database runs in WAL mode with synchronous=NORMAL, so a commit appends to the
+    log instead of syncing the whole file. Writes are queued and executed by one writer
+    thread, which commits everything waiting in the queue as one transaction; the UI and
+    background generation threads can therefore persist messages without blocking.
+    Reads run on the caller's thread, on a second connection: in WAL mode they see the last
+    commit without waiting for the writer. A read of a discussion first waits for the writes
+    to that discussion queued before it, so the caller sees its own messages; other writes,
+    however slow their commit, do not hold it up.
+    """
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False) # Written by the writer thread only.
+        self.conn.execute("PRAGMA journal_mode = WAL") # Readers do not wait for writers; commits append to the log.
+        self.conn.execute("PRAGMA synchronous = NORMAL") # Safe in WAL mode; skips an fsync per commit.
+        self.search_available = initialize_schema(self.conn) # False if SQLite was built without FTS5.
+        self.read_conn = sqlite3.connect(db_path, check_same_thread=False) # Shared by the UI and generation threads.
+        self.lock = threading.Lock() # One statement sequence on the write connection at a time.
+        self.read_lock = threading.Lock() # The same for the read connection.
+        self.writes = queue.Queue() # Lists of (operation, future); None stops the writer.
+        self.pending = threading.local() # Operations collected by an open batch(), per thread.
+        self.unwritten = {} # Discussion id -> futures of its queued writes that are not committed yet.
+        self.unwritten_lock = threading.Lock()
+        self.writer = threading.Thread(target=self._write_loop, name="chat-store-writer", daemon=True)
+        self.writer.start()
+
+    # --- Writes ---
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups the writes made inside the block (one user action) into a single transaction.
+        They are queued when the block exits, so none of them is committed without the others.
+        """
+        if getattr(self.pending, "operations", None) is not None: # Nested: the outer batch commits.
+            yield
+            return
+        self.pending.operations = []
+        try:
+            yield
+            operations, self.pending.operations = self.pending.operations, None
+            if operations:
+                self._queue(operations)
+        finally:
+            self.pending.operations = None
+
+    def _submit(self, operation, discussion_id=None):
+        """
+        Queues `operation(conn)` (or adds it to the open batch) and returns a Future of its result.
+        Reads of `discussion_id` wait for it once it is queued.
+        """
+        future = Future()
+        future.discussion_id = discussion_id
+        operations = getattr(self.pending, "operations", None)
+        if operations is not None:
+            operations.append((operation, future))
+        else:
+            self._queue([(operation, future)])
+        return future
+
+    def _queue(self, operations):
+        """Hands a batch to the writer thread and records its futures as unwritten until they are resolved."""
+        with self.unwritten_lock:
+            for _, future in operations:
+                if future.discussion_id is not None:
+                    self.unwritten.setdefault(future.discussion_id, set()).add(future)
+        for _, future in operations:
+            if future.discussion_id is not None:
+                future.add_done_callback(self._written)
+        self.writes.put(operations)
+
+    def _written(self, future):
+        with self.unwritten_lock:
+            futures = self.unwritten.get(future.discussion_id)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self.unwritten[future.discussion_id]
+
+    def _write_loop(self):
+        """Writer thread: commits every batch waiting in the queue together, in one transaction."""
+        while True:
+            batches = [self.writes.get()]
+            while True: # Group commit: take whatever else is already waiting.
+                try:
+                    batches.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batches
+            batches = [batch for batch in batches if batch is not None]
+            grouped = [item for batch in batches for item in batch]
+            try:
+                if len(batches) <= 1: # A single batch: a failure is reported to its own futures.
+                    self._commit(grouped)
+                elif not self._commit(grouped, report_errors=False):
+                    for batch in batches: # Do not let one failing action lose the others: retry them one by one.
+                        self._commit(batch)
+            finally: # Even if something unexpected happens, flush() and reads must not wait forever.
+                for _ in range(len(batches) + stop):
+                    self.writes.task_done()
+            if stop:
+                return
+
+    def _commit(self, operations, report_errors=True):
+        """
+        Runs operations in one transaction and resolves their futures with the results.
+        Returns False if it was rolled back; the futures then get the error if `report_errors`.
+        """
+        results = []
+        try:
+            with self.lock, self.conn: # Commits on success, rolls back everything on error.
+                for operation, _ in operations:
+                    results.append(operation(self.conn))
+        except Exception as e:
+            if report_errors:
+                print(f"Error writing to the database: {e}")
+                for _, future in operations:
+                    if not future.done(): # A future is resolved once, never twice.
+                        future.set_exception(e)
+            return False
+        for (_, future), result in zip(operations, results):
+            if not future.done():
+                future.set_result(result)
+        return True
+
+    def flush(self):
+        """Waits until every queued write has been committed."""
+        self.writes.join()
+
+    def close(self):
+        """Commits the queued writes, stops the writer thread and closes the connections."""
+        if self.writer.is_alive():
+            self.writes.put(None)
+            self.writer.join()
+        self.read_conn.close()
+        self.conn.close()
+
+    def create_discussion(self):
+        """Creates an empty discussion titled "discussion_N" and returns its id (waits for the commit)."""
+        def operation(conn):
+            cursor = conn.execute(
+                "INSERT INTO discussions (title, created_at) VALUES ('', ?)",
+                (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),),
+            )
+            conn.execute("UPDATE discussions SET title = ? WHERE id = ?", (discussion_title(cursor.lastrowid), cursor.lastrowid))
+            return cursor.lastrowid
+        return self._submit(operation).result()
+
+    def delete_discussion(self, discussion_id):
+        """Queues the deletion of a discussion and all of its messages."""
+        def operation(conn):
+            conn.execute("DELETE FROM messages WHERE discussion_id = ?", (discussion_id,))
+            conn.execute("DELETE FROM discussion_memory WHERE discussion_id = ?", (discussion_id,))
+            conn.execute("DELETE FROM discussions WHERE id = ?", (discussion_id,))
+        return self._submit(operation, discussion_id)
+
+    def insert_message(self, discussion_id, sender, message, timestamp=None):
+        """Queues a message for a discussion; returns a Future of the new message id."""
+        timestamp = timestamp or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        def operation(conn):
+            return conn.execute(
+                "INSERT INTO messages (discussion_id, sender, message, timestamp) VALUES (?, ?, ?, ?)",
+                (discussion_id, sender, message, timestamp),
+            ).lastrowid
+        return self._submit(operation, discussion_id)
+
+    def save_memory(self, discussion_id, summary, summary_tokens, summarized_through):
+        """Queues the new conversation summary of a discussion (ignored if it was deleted meanwhile)."""
+        def operation(conn):
+            conn.execute(
+                "INSERT OR REPLACE INTO discussion_memory (discussion_id, summary, summary_tokens, summarized_through) "
+                "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM discussions WHERE id = ?)",
+                (discussion_id, summary, summary_tokens, summarized_through, discussion_id),
+            )
+        return self._submit(operation, discussion_id)
+
+    # --- Reads ---
+
+    def _read(self, sql, parameters=(), discussion_id=None):
+        """Runs a query on the read connection, after the queued writes to `discussion_id` if given."""
+        if discussion_id is not None:
+            with self.unwritten_lock:
+                futures = list(self.unwritten.get(discussion_id, ()))
+            wait(futures) # Usually none: the writer commits within milliseconds.
+        with self.read_lock:
+            return self.read_conn.execute(sql, parameters).fetchall()
+
+    def list_discussions(self):
+        """Returns (id, title) of every discussion, newest first."""
+        return self._read("SELECT id, title FROM discussions ORDER BY id DESC")
+
+    def load_messages_page(self, discussion_id, before_id=None, after_id=None, limit=50):
+        """
+        Returns up to `limit` messages of a discussion as (id, sender, message), oldest first.
+        Keyset pagination on the (discussion_id, id) index: with `before_id`, the newest
+        messages older than it; with `after_id`, the oldest messages newer than it (and older
+        than `before_id` if given too); with neither, the latest messages. Each page costs one
+        index range scan, whatever its offset.
+        """
+        if after_id is not None:
+            return self._read(
+                "SELECT id, sender, message FROM messages WHERE discussion_id = ? AND id > ? AND id < ? ORDER BY id LIMIT ?",
+                (discussion_id, after_id, before_id if before_id is not None else MAX_ROW_ID, limit),
+                discussion_id,
+            )
+        rows = self._read(
+            "SELECT id, sender, message FROM messages WHERE discussion_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (discussion_id, before_id if before_id is not None else MAX_ROW_ID, limit),
+            discussion_id,
+        )
+        return rows[::-1]
+
+    def load_memory(self, discussion_id):
+        """Returns (summary, summary_tokens, summarized_through) of a discussion, or None before its first summary."""
+        rows = self._read(
+            "SELECT summary, summary_tokens, summarized_through FROM discussion_memory WHERE discussion_id = ?",
+            (discussion_id,),
+            discussion_id,
+        )
+        return rows[0] if rows else None
+
+    def search_messages(self, text, limit=20):
+        """
+        Full-text search over all discussions. Returns up to `limit` matches, best first, as
+        (message id, discussion id, discussion title, sender, snippet); in the snippet the
+        matched words are wrapped in SNIPPET_START/SNIPPET_END.
+        """
+        query = search_query(text)
+        if query is None or not self.search_available:
+            return []
+        return self._read("""
+            SELECT m.id, m.discussion_id, d.title, m.sender,
+                   snippet(messages_fts, 0, ?, ?, '…', 12)
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            JOIN discussions d ON d.id = m.discussion_id
+            WHERE messages_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        """, (SNIPPET_START, SNIPPET_END, query, limit))
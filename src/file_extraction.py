@@ -0,0 +1,297 @@
+"""
+Text extraction of the documents attached to a question.
+
+Extraction runs in a pool of worker processes, away from the UI: the files of one upload are
+extracted in parallel, and a PDF is also cut into page ranges spread over the workers. Each
+file is followed by a FileExtraction, which reports its progress through a callback, has a
+preview as soon as its first pages are done, and can be cancelled.
+
+Extracted texts are kept in an ExtractionCache keyed by the SHA-256 of the file bytes, so a
+document uploaded again (even under another name, or after a restart) is not parsed again.
+"""
+import hashlib  # SHA-256 of the uploaded files, the key of the extraction cache.
+import os  # For file extensions, the number of cores and the cache files.
+import threading  # Cancellation flags and the threads that follow each file.
+from concurrent.futures import ProcessPoolExecutor, CancelledError, as_completed  # Worker processes.
+
+import pypdf  # Library for reading PDF files.
+from docx import Document  # Library for reading DOCX files (Microsoft Word).
+from pptx import Presentation  # Library for reading PPTX files (Microsoft PowerPoint).
+import openpyxl  # Library for reading XLSX and XLS files (Microsoft Excel).
+
+PAGES_PER_TASK = 16  # PDF pages extracted by one worker task.
+PREVIEW_PAGES = 2  # The first task of a PDF is kept short, so its preview shows up quickly.
+EXTRACTION_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # Leave one core to the UI.
+# Text kept from a spreadsheet: far more than a prompt can hold, while a ledger can have millions of cells.
+MAX_SPREADSHEET_CHARS = 100_000
+EXTRACTION_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Size cap of the extraction cache; least recently used texts go first.
+
+
+def extract_pdf_page_count(file_path: str) -> int:
+    """Returns the number of pages of a PDF file."""
+    with open(file_path, 'rb') as file: # Open in binary read mode.
+        return len(pypdf.PdfReader(file).pages)
+
+
+def extract_pdf_pages(file_path: str, first_page: int, last_page: int) -> list:
+    """Extracts the text of pages [first_page, last_page) of a PDF file. Runs in a worker process."""
+    with open(file_path, 'rb') as file: # Open in binary read mode.
+        reader = pypdf.PdfReader(file) # Create a PDF reader object.
+        return [reader.pages[index].extract_text() for index in range(first_page, last_page)]
+
+
+def extract_text_from_docx(file_path: str) -> str:
+    """Extracts all text from a DOCX file."""
+    doc = Document(file_path) # Open the DOCX document.
+    return "\n".join([para.text for para in doc.paragraphs]) # Join text from all paragraphs.
+
+
+def extract_text_from_pptx(file_path: str) -> str:
+    """Extracts text from all shapes in all slides of a PPTX file."""
+    prs = Presentation(file_path) # Open the PowerPoint presentation.
+    text = []
+    for slide in prs.slides: # Iterate through each slide.
+        for shape in slide.shapes: # Iterate through each shape on the slide.
+            if hasattr(shape, "text"): # If the shape contains text.
+                text.append(shape.text) # Append the text.
+    return "\n".join(text)
+
+
+def extract_text_from_excel(file_path: str, max_chars: int = MAX_SPREADSHEET_CHARS) -> str:
+    """Extract text from an Excel file, sheet by sheet, one line per row with its cells separated by tabs.
+    The workbook is streamed in read-only mode, and reading stops once `max_chars` characters are gathered.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True) # data_only=True to get cell values, not formulas
+    try:
+        all_text = []
+        total_chars = 0
+        for sheet in workbook.worksheets: # Iterate through each sheet.
+            sheet_text = []
+            for row in sheet.iter_rows(values_only=True): # Rows are parsed one at a time, cells as plain values.
+                cells = [str(value) for value in row if value is not None]
+                if not cells: # Skip empty rows.
+                    continue
+                line = "\t".join(cells)
+                sheet_text.append(line)
+                total_chars += len(line) + 1
+                if total_chars >= max_chars: # Enough for the prompt: the rest is never read.
+                    break
+            if sheet_text: # Add sheet name if it has content
+                all_text.append(f"--- Sheet: {sheet.title} ---\n" + "\n".join(sheet_text)) # Add sheet content with a header.
+            if total_chars >= max_chars:
+                all_text.append("[Rest of the workbook not read]")
+                break
+        return "\n\n".join(all_text)
+    finally:
+        workbook.close() # Read-only workbooks keep the file open until closed.
+
+
+# Extractors of the formats that are read in one piece.
+EXTRACTORS = {
+    ".docx": extract_text_from_docx,
+    ".pptx": extract_text_from_pptx,
+    ".xls": extract_text_from_excel,
+    ".xlsx": extract_text_from_excel,
+}
+
+
+def make_preview(text: str) -> str:
+    """Returns the 4-line preview of a document shown in the chat and stored with the discussion."""
+    original_lines = text.splitlines() # Split content into lines.
+    if len(original_lines) > 4: # If more than 4 lines.
+        # If more than 4 lines, show the first 3 and append "..." on a new line (total 4 lines for preview)
+        return "\n".join(original_lines[:3]) + "\n..."
+    # If 4 or fewer lines, show all of them.
+    return "\n".join(original_lines)
+
+
+def file_sha256(file_path: str) -> str:
+    """Returns the SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Extracted texts on disk, one `<sha256>.txt` file per document, capped at `max_bytes`.
+    The modification time of a file records its last use, so the least recently used texts
+    are evicted first, across restarts too.
+    """
+    def __init__(self, cache_dir, max_bytes=EXTRACTION_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()  # Uploads are cached from several threads.
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.name.endswith(".txt"))
+
+    def path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.txt")
+
+    def get(self, digest):
+        """Returns the cached text of the document with this SHA-256, or None."""
+        with self.lock:
+            try:
+                with open(self.path(digest), encoding="utf-8", newline="") as cached:  # Text exactly as extracted.
+                    text = cached.read()
+                os.utime(self.path(digest))  # Mark as recently used.
+                return text
+            except OSError:
+                return None
+
+    def put(self, digest, text):
+        """Stores the text of a document, then evicts the least recently used texts beyond the size cap."""
+        data = text.encode("utf-8")
+        if len(data) > self.max_bytes:
+            return  # Would evict everything else.
+        with self.lock:
+            if os.path.exists(self.path(digest)):
+                return
+            tmp_path = self.path(digest) + ".tmp"
+            with open(tmp_path, "wb") as cached:
+                cached.write(data)
+            os.replace(tmp_path, self.path(digest))  # Readers never see a partial file.
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Deletes the least recently used texts until the cache fits its cap. The caller holds the lock."""
+        entries = sorted((entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".txt")),
+                         key=lambda entry: entry.stat().st_mtime)
+        self.size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.size <= self.max_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue  # In use (Windows) or already gone; retried at the next eviction.
+            self.size -= size
+
+
+class FileExtraction:
+    """
+    One uploaded file being extracted. It remembers its discussion, so the result goes to the
+    discussion the file was uploaded in even if the user has switched to another one meanwhile.
+    """
+    def __init__(self, file_path, file_name, discussion_id):
+        self.path = file_path  # Path to the uploaded file.
+        self.name = file_name  # Name of the uploaded file.
+        self.discussion_id = discussion_id  # Discussion the file was uploaded in.
+        self.extension = os.path.splitext(file_name)[1].lower() # File extension.
+        self.total_pages = None  # Number of pages of a PDF, once counted.
+        self.done_pages = 0  # PDF pages extracted so far.
+        self.preview = None  # First lines of the document, as soon as they are known.
+        self.text = None  # Full text, once finished.
+        self.error = None  # Message of the error that stopped the extraction, if any.
+        self.finished = False  # True once the text, the error or the cancellation is final.
+        self.cached = False  # True if the text came from the extraction cache.
+        self.cancel_event = threading.Event()  # Set by cancel().
+        self.futures = []  # Worker tasks of this file.
+        self.view = None  # Control showing the progress in the chat, managed by the app.
+
+    @property
+    def progress(self):
+        """Fraction of the pages extracted, or None while unknown (page count pending, or not a PDF)."""
+        if not self.total_pages:
+            return None
+        return self.done_pages / self.total_pages
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """Stops the extraction; tasks not started yet are dropped, running ones are left to finish and ignored."""
+        self.cancel_event.set()
+        for future in self.futures:
+            future.cancel()
+
+
+class FileExtractor:
+    """
+    Runs FileExtractions in a shared process pool, started with the first upload. A thread
+    follows each file and calls `on_update(extraction)` on progress and once it is finished.
+    With a `cache`, files extracted before are served from it without starting any worker.
+    """
+    def __init__(self, workers=EXTRACTION_WORKERS, cache=None):
+        self.workers = workers
+        self.cache = cache  # ExtractionCache, or None.
+        self.pool = None  # Created on first use: starting the worker processes takes a moment.
+        self.lock = threading.Lock()
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self.pool
+
+    def start(self, extraction, on_update):
+        """Starts extracting a file in the background."""
+        threading.Thread(target=self.run, args=(extraction, on_update), name=f"extract-{extraction.name}", daemon=True).start()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, extraction, on_update):
+        """Extracts one file and reports it. Runs in the thread started by start()."""
+        try:
+            digest = text = None
+            if self.cache is not None and (extraction.extension == '.pdf' or extraction.extension in EXTRACTORS):
+                digest = file_sha256(extraction.path)
+                text = self.cache.get(digest)
+                extraction.cached = text is not None
+            # Extract text based on file extension.
+            if text is not None:
+                pass  # Uploaded before.
+            elif extraction.extension == '.pdf':
+                text = self.extract_pdf(extraction, on_update)
+            elif extraction.extension in EXTRACTORS:
+                future = self.get_pool().submit(EXTRACTORS[extraction.extension], extraction.path)
+                extraction.futures = [future]
+                if extraction.cancelled:
+                    future.cancel()
+                text = future.result()
+            else:
+                text = f"Unsupported file type: {extraction.extension}"
+            if not extraction.cancelled:
+                if digest is not None and not extraction.cached:
+                    self.cache.put(digest, text)
+                extraction.text = text
+                extraction.preview = make_preview(text)
+        except CancelledError:
+            pass
+        except Exception as ex: # Handle errors during file processing.
+            extraction.error = str(ex)
+        extraction.finished = True
+        on_update(extraction)
+
+    def extract_pdf(self, extraction, on_update):
+        """Extracts a PDF in page ranges on all workers, reporting progress as ranges complete."""
+        pool = self.get_pool()
+        pages = pool.submit(extract_pdf_page_count, extraction.path).result()
+        ranges = [(0, min(PREVIEW_PAGES, pages))] + [
+            (first, min(first + PAGES_PER_TASK, pages)) for first in range(PREVIEW_PAGES, pages, PAGES_PER_TASK)
+        ]
+        extraction.futures = [pool.submit(extract_pdf_pages, extraction.path, first, last) for first, last in ranges]
+        if extraction.cancelled: # Cancelled while the tasks were being submitted.
+            extraction.cancel()
+        extraction.total_pages = pages
+        on_update(extraction)
+
+        results = {}  # Index of the range -> text of its pages.
+        index_of = {future: index for index, future in enumerate(extraction.futures)}
+        for future in as_completed(extraction.futures):
+            if extraction.cancelled:
+                raise CancelledError()
+            results[index_of[future]] = future.result()
+            extraction.done_pages += len(results[index_of[future]])
+            if extraction.preview is None and 0 in results: # The first pages are done: show them.
+                extraction.preview = make_preview("\n".join(results[0]))
+            on_update(extraction)
+        return "\n".join(page_text for index in range(len(ranges)) for page_text in results[index])
@@ -1,17 +1,60 @@
 import flet as ft  # Flet library for creating the user interface.
 import sqlite3      # SQLite library for database operations.
 from datetime import datetime  # For handling timestamps.
-from model_handler import generate_reply  # Function to interact with the AI model.
+from model_handler import generate_reply_stream  # Function to stream replies from the AI model.
 from sidebar import render_sidebar  # Function to render the sidebar UI component.
+from database import ChatStore  # Persistence layer: one shared connection and a background write queue.
 import os           # For operating system interactions, like file paths.
 import platform     # For detecting the operating system to set appropriate paths.
 import requests     # For making HTTP requests, used here for web search.
-
-# Import file processing libraries
-import pypdf  # Library for reading PDF files.
-from docx import Document  # Library for reading DOCX files (Microsoft Word).
-from pptx import Presentation  # Library for reading PPTX files (Microsoft PowerPoint).
-import openpyxl  # Library for reading XLSX and XLS files (Microsoft Excel).
+import threading    # Locks and cancellation flags for background generations.
+from concurrent.futures import Future, ThreadPoolExecutor  # Worker threads that run the model calls; ids of stored messages.
+from file_extraction import ExtractionCache, FileExtraction, FileExtractor  # Extracts uploaded documents in worker processes.
+from context_builder import ContextBuilder, TokenCounter  # Fits the attached documents into the model's context window.
+from conversation_memory import ConversationMemory  # Earlier turns of a discussion: recent messages and a rolling summary.
+
+# History paging: a discussion opens on its latest messages, older (or newer) pages are
+# fetched when the chat is scrolled to its top (or bottom), and at most MAX_RENDERED_MESSAGES
+# controls are kept, live messages included, so long discussions open instantly and memory stays bounded.
+HISTORY_PAGE_SIZE = 50  # Messages fetched per page.
+MAX_RENDERED_MESSAGES = 200  # Messages kept in self.chat; the far end is dropped beyond this.
+SCROLL_EDGE_PIXELS = 50  # Distance from the top/bottom of the chat that triggers loading a page.
+GENERATION_WORKERS = 2  # Questions answered at the same time; further ones wait in the pool's queue.
+
+# Colors of the chat messages, as (light theme, dark theme) for each part of each kind of message.
+# A theme switch recolors the rendered messages in place (see apply_message_theme).
+MESSAGE_COLORS = {
+    "user": {"bubble": (ft.Colors.BLUE_100, ft.Colors.BLUE_800), "text": (ft.Colors.BLACK, ft.Colors.WHITE)},
+    "bot": {"bubble": (ft.Colors.GREEN_100, ft.Colors.GREEN_800), "label": (ft.Colors.BLUE_800, ft.Colors.BLUE_200),
+            "text": (ft.Colors.BLACK, ft.Colors.WHITE)},
+    "file": {"bubble": (ft.Colors.BLUE_100, ft.Colors.BLUE_800), "name": (ft.Colors.BLUE_800, ft.Colors.WHITE),
+             "text": (ft.Colors.BLACK, ft.Colors.WHITE)},
+}
+SEPARATOR_COLORS = (ft.Colors.GREY_300, ft.Colors.GREY_600)  # Divider lines, (light, dark).
+
+
+class MessageRow(ft.Row):
+    """The row of a chat message; `message_role` ("user", "bot" or "file") selects its MESSAGE_COLORS."""
+    def __init__(self, message_role, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.message_role = message_role
+
+
+class GenerationJob:
+    """
+    A question sent to the model in the background. It remembers its discussion, so the
+    reply is stored (and shown) there even if the user has switched to another one.
+    """
+    def __init__(self, discussion_id, question, files=(), message=None):
+        self.discussion_id = discussion_id  # Discussion the question was asked in.
+        self.question = question  # Question typed by the user ("" if only files were sent).
+        self.message = message  # Future of the id of the stored question; the earlier messages are its history.
+        self.files = list(files)  # Attached files; their most relevant parts are added to the prompt.
+        self.reply = ""  # Text received so far.
+        self.started = False  # False while waiting for a free worker.
+        self.finished = False  # Set once the reply has been stored (or the job was stopped).
+        self.cancel_event = threading.Event()  # Set by the stop button; the stream is closed at the next chunk.
+        self.view = None  # Control showing this job in the chat while its discussion is open.
 
 
 class LawyerChatBotApp:
@@ -22,8 +65,19 @@ class LawyerChatBotApp:
     def __init__(self, page: ft.Page):
         self.page = page  # The Flet page object, representing the main window/view.
         self.page.theme_mode = ft.ThemeMode.LIGHT  # Default to light theme
-        self.chat = ft.ListView(expand=True, spacing=10, auto_scroll=True)  # UI element to display chat messages.
-        self.current_discussion = None  # Stores the name of the currently active discussion table.
+        self.chat = ft.ListView(
+            expand=True,
+            spacing=10,
+            auto_scroll=True,  # Follow new messages; turned off while older pages are inserted at the top.
+            on_scroll=self.on_chat_scroll,  # Loads more history at the edges.
+            on_scroll_interval=100,  # Milliseconds between scroll events.
+        )  # UI element to display chat messages.
+        self.current_discussion = None  # Stores the id of the currently active discussion.
+        self.oldest_loaded_id = None  # Id of the oldest message rendered in the chat.
+        self.newest_loaded_id = None  # Id of the newest message loaded from the database.
+        self.has_older_messages = False  # True if the discussion has messages before oldest_loaded_id.
+        self.has_newer_messages = False  # True if newer messages were dropped from the chat (or not loaded yet).
+        self.loading_history = False  # Guards against overlapping page loads from scroll events.
         
         # Theme toggle button
         self.theme_toggle = ft.IconButton(
@@ -37,6 +91,7 @@ class LawyerChatBotApp:
             on_result=self.handle_file_upload,  # Function to call when files are picked.
         )
         self.page.overlay.append(self.file_picker)  # Add file picker to the page's overlay (required by Flet).
+        self.initialize_database()  # Sets up the chat store before the sidebar lists discussions.
         self.sidebar = render_sidebar(self) if 'render_sidebar' in globals() else ft.Container() # Renders the sidebar if available.
         
         # Input controls
@@ -62,10 +117,25 @@ class LawyerChatBotApp:
             on_click=self.web_search_click,  # Function to call on click.
             tooltip="Search the web",        # Tooltip text.
         )
-        self.current_files = []  # List to store information about currently uploaded files for a single query.
+        self.stop_button = ft.IconButton(
+            icon=ft.Icons.STOP_CIRCLE,  # Icon for the stop button.
+            on_click=self.stop_click,  # Function to call on click.
+            tooltip="Stop generating",  # Tooltip text.
+            visible=False,  # Only shown while the current discussion has questions in progress.
+        )
+        self.current_files = []  # Uploaded files not used by a question yet, of every discussion (see their "discussion_id").
+        # Picks the parts of the attached documents that fit in the prompt; the tokenizer is cached next to the database.
+        self.context_builder = ContextBuilder(TokenCounter(os.path.dirname(self.get_database_path())))
+        # Earlier turns of each discussion, summarized incrementally in the chat store; counted with the same tokenizer.
+        self.memory = ConversationMemory(self.store, self.context_builder.token_counter)
+        # Process pool for the text extraction of uploads; texts are cached next to the database.
+        self.file_extractor = FileExtractor(cache=ExtractionCache(os.path.join(os.path.dirname(self.get_database_path()), "extraction_cache")))
+        self.uploads = []  # FileExtractions still running, in the order they were uploaded.
+        self.generation_pool = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="generation")
+        self.jobs = []  # GenerationJobs queued or running, in the order they were asked.
+        self.ui_lock = threading.RLock()  # Serializes changes to the chat between the UI and generation threads.
         
-        # Initialize database and load previous messages
-        self.initialize_database()  # Sets up the database connection.
+        # Build the UI
         self.init_ui()              # Sets up the main user interface layout.
         self.update_theme_colors()  # Set initial theme colors
         self.switch_discussion(self.current_discussion) # Set initial state for inputs (disables them if no discussion).
@@ -86,12 +156,16 @@ class LawyerChatBotApp:
             alignment=ft.MainAxisAlignment.SPACE_BETWEEN,  # Align items with space between them.
         )
 
+        # Separators, kept to be recolored by update_theme_colors.
+        self.header_divider = ft.Divider(color=SEPARATOR_COLORS[self.page.theme_mode == ft.ThemeMode.DARK])
+        self.sidebar_separator = ft.Container(width=1, bgcolor=SEPARATOR_COLORS[self.page.theme_mode == ft.ThemeMode.DARK])
+
         # Main column for the chat interface (header, chat view, input row)
         main_column = ft.Column(
             expand=True,  # Allow the column to expand and fill available space.
             controls=[
                 header,  # Add the header row.
-                ft.Divider(color=ft.Colors.GREY_600 if self.page.theme_mode == ft.ThemeMode.DARK else ft.Colors.GREY_300), # A visual separator.
+                self.header_divider, # A visual separator.
                 self.chat,  # The chat message list view.
                 ft.Row(
                     [
@@ -99,6 +173,7 @@ class LawyerChatBotApp:
                         self.user_input,     # User text input field.
                         self.search_button,  # Web search button.
                         self.send_button,    # Send message button.
+                        self.stop_button,    # Stop generating button.
                     ],
                     spacing=5,  # Spacing between controls in the input row.
                     alignment=ft.MainAxisAlignment.START,  # Align controls to the start of the row.
@@ -110,7 +185,7 @@ class LawyerChatBotApp:
         content = ft.Row(
             controls=[
                 self.sidebar,  # The sidebar for discussions.
-                ft.Container(width=1, bgcolor=ft.Colors.GREY_600 if self.page.theme_mode == ft.ThemeMode.DARK else ft.Colors.GREY_300), # Vertical separator.
+                self.sidebar_separator, # Vertical separator.
                 main_column,  # The main chat area.
             ],
             expand=True,  # Allow this row to expand.
@@ -120,32 +195,8 @@ class LawyerChatBotApp:
         self.user_input.focus() # Set focus to the user input field on startup.
 
     def initialize_database(self):
-        """Connect to the database and set up the cursor."""
-        self.conn = sqlite3.connect(self.get_database_path())
-        self.cursor = self.conn.cursor()
-        
-
-    def _create_table_if_not_exists(self, table_name):
-        """Creates a specific table if it doesn't already exist.
-            This uses the standard schema for discussion tables.
-            This method MUST be called from the main thread (UI thread)
-            as it accesses the database connection.
-        """ # Note: This method is intended to be called from the UI thread.
-        if not table_name: # Avoid issues with empty table names
-            print("Error: Attempted to create a table with no name.")
-            return
-        try:
-            self.cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS "{table_name}" (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender TEXT NOT NULL,
-                message TEXT NOT NULL,
-                timestamp DATETIME NOT NULL
-            )
-        ''')
-            
-        except sqlite3.Error as e:
-            print(f"Error creating table {table_name}: {e}")
+        """Open the chat store, which creates (or migrates) the discussions/messages schema."""
+        self.store = ChatStore(self.get_database_path()) # Shared by the app and the sidebar.
 
     def get_database_path(self):
         """Get the appropriate database path based on the OS."""
@@ -165,55 +216,188 @@ class LawyerChatBotApp:
 
     # Removed the original load_previous_messages
 
-    def load_previous_messages(self, table_to_load: str):
-        """Load previous messages from the specified discussion table.
-        This method must be called from the main thread.
+    def load_previous_messages(self, discussion_id, around_id=None):
+        """Load the latest messages of the specified discussion (or those around message `around_id`);
+        further ones are loaded on scroll. This method must be called from the main thread.
         """
         self.clear_chat()  # Clear existing messages from the UI.
 
-        if table_to_load:  # Only proceed if a table name is provided.
-            try:
-                self.cursor.execute(
-                    f'SELECT sender, message FROM "{table_to_load}" ORDER BY timestamp' # Fetch messages ordered by time.
-                )
-                messages = self.cursor.fetchall()  # Get all fetched messages.
-
-                for sender, message_content in messages: # Renamed for clarity
-                    if sender == "user":  # If the sender is the user.
-                        self.chat.controls.append(self.create_user_message(message_content))  # Add user message UI.
-                    elif sender == "file":  # If the message represents a file.
-                        # Parse file_name and content_preview from message_content
-                        # Expected format from store_message: f"{file_name}: {content_preview}"
-                        parts = message_content.split(": ", 1)  # Split the stored message.
-                        if len(parts) == 2:  # If parsing is successful.
-                            file_name, content_preview = parts  # Extract file name and preview.
-                            self.chat.controls.append(self.create_file_message(file_name, content_preview)) # Add file message UI.
-                        else: # If parsing fails.
-                            # Fallback if parsing fails, render as a bot message
-                            self.chat.controls.append(self.create_bot_message(f"File (error displaying): {message_content}")) # Show error.
-                    elif sender == "bot" or sender == "system": # Explicitly handle bot and system messages
-                        self.chat.controls.append(self.create_bot_message(message_content)) # Add bot/system message UI.
-                    else: # Fallback for any other unexpected sender type
-                        self.chat.controls.append(self.create_bot_message(f"Unknown ({sender}): {message_content}")) # Show as unknown.
-                self.page.update()  # Update the UI to display loaded messages.
-            except sqlite3.OperationalError as e:  # Handle cases like table not found.
-                print(f"Error loading messages from table '{table_to_load}': {str(e)}")
-                self.chat.controls.append(
-                    self.create_bot_message(f"⚠️ Error loading discussion '{table_to_load}': {str(e)}") # Show error in chat.
-                )
-                self.page.update() # Update UI.
+        if discussion_id:  # Only proceed if a discussion is provided.
+            self.render_history(discussion_id, around_id)
+
+    def render_history(self, discussion_id, around_id=None):
+        """Replace the chat content with one page of a discussion: its last HISTORY_PAGE_SIZE messages,
+        or, with `around_id`, the messages before and after that one, scrolled to it.
+        """
+        with self.ui_lock:  # Generation threads must not touch the chat while it is rebuilt.
+            self._render_history(discussion_id, around_id)
+        self.page.update()  # Update the UI to display loaded messages.
+        if around_id is not None:
+            self.chat.scroll_to(key=f"message-{around_id}", duration=300)  # Bring the requested message into view.
+
+    def _render_history(self, discussion_id, around_id):
+        """Body of render_history; the caller holds ui_lock."""
+        self.chat.controls.clear()
+        self.chat.auto_scroll = around_id is None  # Open the discussion at its end, unless jumping to a message.
+        self.oldest_loaded_id = self.newest_loaded_id = None
+        self.has_older_messages = self.has_newer_messages = False
+        for job in self.uploads + self.jobs:
+            job.view = None  # Views of unfinished uploads and replies are reattached below if they belong here.
+        try:
+            if around_id is None:
+                rows = self.store.load_messages_page(discussion_id, limit=HISTORY_PAGE_SIZE)  # One index range scan.
+                self.has_older_messages = len(rows) == HISTORY_PAGE_SIZE  # A full page: there may be more.
+            else:
+                half = HISTORY_PAGE_SIZE // 2
+                before = self.store.load_messages_page(discussion_id, before_id=around_id + 1, limit=half)  # Ends with the message itself.
+                after = self.store.load_messages_page(discussion_id, after_id=around_id, limit=half)
+                rows = before + after
+                self.has_older_messages = len(before) == half
+                self.has_newer_messages = len(after) == half
+            self.chat.controls.extend(self.create_history_message(*row) for row in rows)
+            if rows:
+                self.oldest_loaded_id, self.newest_loaded_id = rows[0][0], rows[-1][0]
+        except sqlite3.Error as e:  # Handle database errors.
+            print(f"Error loading messages of discussion {discussion_id}: {str(e)}")
+            self.chat.controls.append(
+                self.create_bot_message(f"⚠️ Error loading discussion {discussion_id}: {str(e)}") # Show error in chat.
+            )
+        if not self.has_newer_messages:  # The end of the discussion is shown: add its uploads and replies in progress.
+            self.attach_pending_views()
+
+    def create_history_message(self, message_id, sender, message_content):
+        """Create the chat control of a stored message; its id is kept in `data` (and `key`, for scroll_to)."""
+        if sender == "user":  # If the sender is the user.
+            control = self.create_user_message(message_content)  # User message UI.
+        elif sender == "file":  # If the message represents a file.
+            # Parse file_name and content_preview from message_content
+            # Expected format from store_message: f"{file_name}: {content_preview}"
+            parts = message_content.split(": ", 1)  # Split the stored message.
+            if len(parts) == 2:  # If parsing is successful.
+                file_name, content_preview = parts  # Extract file name and preview.
+                control = self.create_file_message(file_name, content_preview) # File message UI.
+            else: # If parsing fails.
+                # Fallback if parsing fails, render as a bot message
+                control = self.create_bot_message(f"File (error displaying): {message_content}") # Show error.
+        elif sender == "bot" or sender == "system": # Explicitly handle bot and system messages
+            control = self.create_bot_message(message_content) # Bot/system message UI.
+        else: # Fallback for any other unexpected sender type
+            control = self.create_bot_message(f"Unknown ({sender}): {message_content}") # Show as unknown.
+        control.data = message_id
+        control.key = f"message-{message_id}"
+        return control
+
+    def on_chat_scroll(self, e: ft.OnScrollEvent):
+        """Load older history at the top of the chat, and newer history at the bottom if it was dropped."""
+        if e.pixels <= e.min_scroll_extent + SCROLL_EDGE_PIXELS:
+            self.load_older_messages()
+        elif self.has_newer_messages and e.pixels >= e.max_scroll_extent - SCROLL_EDGE_PIXELS:
+            self.load_newer_messages()
+
+    def load_older_messages(self):
+        """Insert the page of messages before the oldest rendered one at the top of the chat."""
+        if self.loading_history or not self.has_older_messages or not self.current_discussion:
+            return
+        self.loading_history = True
+        try:
+            with self.ui_lock:  # Generation threads must not touch the chat meanwhile.
+                rows = self.store.load_messages_page(self.current_discussion, before_id=self.oldest_loaded_id, limit=HISTORY_PAGE_SIZE)
+                self.has_older_messages = len(rows) == HISTORY_PAGE_SIZE
+                if rows:
+                    anchor = f"message-{self.oldest_loaded_id}"  # The message at the top before loading.
+                    self.chat.auto_scroll = False  # Do not jump to the end while inserting at the top.
+                    self.chat.controls[0:0] = [self.create_history_message(*row) for row in rows]
+                    self.oldest_loaded_id = rows[0][0]
+                    self.trim_rendered_messages(from_top=False)  # Drop the newest messages beyond the limit.
+                    self.page.update()
+                    self.chat.scroll_to(key=anchor, duration=0)  # Keep the message the user was reading in place.
+        except sqlite3.Error as e:
+            print(f"Error loading older messages: {str(e)}")
+        finally:
+            self.loading_history = False
+
+    def load_newer_messages(self):
+        """Append the page of messages after the newest rendered one (after older pages pushed it out)."""
+        if self.loading_history or not self.current_discussion:
+            return
+        self.loading_history = True
+        try:
+            with self.ui_lock:  # Generation threads must not touch the chat meanwhile.
+                rows = self.store.load_messages_page(self.current_discussion, after_id=self.newest_loaded_id, limit=HISTORY_PAGE_SIZE)
+                self.has_newer_messages = len(rows) == HISTORY_PAGE_SIZE
+                if rows:
+                    self.chat.controls.extend(self.create_history_message(*row) for row in rows)
+                    self.newest_loaded_id = rows[-1][0]
+                    self.trim_rendered_messages(from_top=True)  # Drop the oldest messages beyond the limit.
+                if not self.has_newer_messages:  # Back at the end: show the uploads and replies in progress again.
+                    self.attach_pending_views()
+                self.page.update()
+        except sqlite3.Error as e:
+            print(f"Error loading newer messages: {str(e)}")
+        finally:
+            self.loading_history = False
+
+    @staticmethod
+    def rendered_message_id(control):
+        """Database id of a chat control: from history pages, or from the store's future once a live message is written.
+        None for controls that are not stored messages (uploads and replies in progress) or not written yet."""
+        if isinstance(control.data, int):
+            return control.data
+        if isinstance(control.data, Future) and control.data.done() and control.data.exception() is None:
+            return control.data.result()
+        return None
+
+    def trim_rendered_messages(self, from_top):
+        """Drop controls beyond MAX_RENDERED_MESSAGES from the top or the bottom of the chat."""
+        excess = len(self.chat.controls) - MAX_RENDERED_MESSAGES
+        if excess <= 0:
+            return
+        if from_top:
+            # The first kept control must have an id: it is the cursor of the older pages. Controls
+            # without one above it are dropped too and come back from the database with those pages.
+            ids = [self.rendered_message_id(control) for control in self.chat.controls]
+            first = next((index for index in range(excess, len(ids)) if ids[index] is not None), None)
+            if first is None:  # Nothing with an id to page from (only unsaved messages): keep everything.
+                return
+            del self.chat.controls[:first]
+            self.oldest_loaded_id = ids[first]
+            self.has_older_messages = True
+        else:
+            kept = self.chat.controls[:MAX_RENDERED_MESSAGES]
+            # Controls without an id (uploads and replies in progress, messages not written yet) sit
+            # at the end; they are dropped too and come back with the newer pages.
+            while kept and self.rendered_message_id(kept[-1]) is None:
+                kept.pop()
+            self.chat.controls[:] = kept
+            self.newest_loaded_id = self.rendered_message_id(kept[-1]) if kept else self.oldest_loaded_id
+            self.has_newer_messages = True
+
+    def append_message(self, control, message=None):
+        """Adds a live control at the end of the chat and drops the oldest ones beyond MAX_RENDERED_MESSAGES.
+        `message` is the future of its stored message, which gives the control its id once written."""
+        if message is not None:
+            control.data = message
+        self.chat.controls.append(control)
+        self.trim_rendered_messages(from_top=True)
+
+    def show_latest_messages(self):
+        """Before adding a new message: make sure the chat shows the end of the discussion and follows it."""
+        if self.has_newer_messages:
+            self.render_history(self.current_discussion)
+        self.chat.auto_scroll = True
 
     def clear_chat(self):
         """Clear the current chat display"""
-        self.chat.controls.clear()
-        self.current_files = []
+        self.chat.controls.clear()  # Uploaded files are kept: each is used by the next question of its own discussion.
         self.page.update()
 
-    def switch_discussion(self, table_name):
-        """Switch to a different discussion table or handle no active discussion."""
-        self.current_discussion = table_name  # Update the currently active discussion. Can be None.
+    def switch_discussion(self, discussion_id, message_id=None):
+        """Switch to a different discussion or handle no active discussion.
+        With `message_id` (e.g. a search result), the chat opens on that message instead of the end.
+        """
+        self.current_discussion = discussion_id  # Update the currently active discussion. Can be None.
 
-        if table_name is None:  # If no discussion is selected (e.g., on startup or after deleting current).
+        if discussion_id is None:  # If no discussion is selected (e.g., on startup or after deleting current).
             self.clear_chat()  # Clear the chat UI.
             # Add a placeholder message to the chat
             self.chat.controls.append( # Display a message prompting user to select/create a discussion.
@@ -234,20 +418,21 @@ class LawyerChatBotApp:
             self.upload_button.disabled = True 
             self.search_button.disabled = True 
         else: # If a discussion is selected.
-            self.load_previous_messages(table_name)  # This calls clear_chat() internally
+            self.load_previous_messages(discussion_id, around_id=message_id)  # This calls clear_chat() internally
             # Enable input controls.
             self.user_input.disabled = False 
             self.send_button.disabled = False 
             self.upload_button.disabled = False 
             self.search_button.disabled = False 
+        self.update_stop_button()  # Only offered while this discussion has replies in progress.
         self.page.update() # Update the UI to reflect changes.
 
     def create_user_message(self, message):
         """Creates a Flet UI container for a user's message."""
-        is_dark = self.page.theme_mode == ft.ThemeMode.DARK  # Check current theme for styling.
         # Calculate width based on message length but cap at 600
         text_width = min(600, len(message) * 8 + 100) # Dynamically adjust width, with a max.
-        return ft.Row(
+        return MessageRow(
+            "user",
             controls=[
                 ft.Container(expand=True),  # This pushes the message container to the right
                 ft.Container(
@@ -255,10 +440,10 @@ class LawyerChatBotApp:
                         value=message,
                         selectable=True,
                         size=15,
-                        color=ft.Colors.WHITE if is_dark else ft.Colors.BLACK, # Text color based on theme.
+                        color=self.message_color("user", "text"), # Text color based on theme.
                     ),
                     alignment=ft.alignment.center_right, # Align text to the right within the container.
-                    bgcolor=ft.Colors.BLUE_800 if is_dark else ft.Colors.BLUE_100, # Background color based on theme.
+                    bgcolor=self.message_color("user", "bubble"), # Background color based on theme.
                     padding=ft.padding.symmetric(horizontal=14, vertical=10), # Padding inside the message bubble.
                     border_radius=ft.border_radius.only(
                         top_left=16,
@@ -282,10 +467,10 @@ class LawyerChatBotApp:
 
     def create_bot_message(self, message):
         """Creates a Flet UI container for a bot's message."""
-        is_dark = self.page.theme_mode == ft.ThemeMode.DARK # Check current theme for styling.
         # Calculate width based on message length but cap at 600
         text_width = min(600, len(message) * 8 + 100) # Dynamically adjust width, with a max.
-        return ft.Row(
+        return MessageRow(
+            "bot",
             controls=[
                 ft.Container(
                     content=ft.Column(
@@ -294,14 +479,14 @@ class LawyerChatBotApp:
                                 "BOB:",
                                 size=15,
                                 weight=ft.FontWeight.BOLD,
-                                color=ft.Colors.BLUE_200 if is_dark else ft.Colors.BLUE_800, # "BOB:" label color.
+                                color=self.message_color("bot", "label"), # "BOB:" label color.
                             ),
                             ft.Container(
                                 content=ft.Text(
                                     message,
                                     selectable=True,
                                     size=15,
-                                    color=ft.Colors.WHITE if is_dark else ft.Colors.BLACK, # Message text color.
+                                    color=self.message_color("bot", "text"), # Message text color.
                                 ),
                             )
                         ],
@@ -310,7 +495,7 @@ class LawyerChatBotApp:
                         scroll=ft.ScrollMode.AUTO, # Allow scrolling if content overflows.
                     ),
                     alignment=ft.alignment.center_left, # Align content to the left.
-                    bgcolor=ft.Colors.GREEN_800 if is_dark else ft.Colors.GREEN_100, # Background color.
+                    bgcolor=self.message_color("bot", "bubble"), # Background color.
                     padding=ft.padding.symmetric(horizontal=14, vertical=10), # Padding.
                     border_radius=ft.border_radius.only( # Rounded corners for bubble effect.
                         top_left=16,
@@ -333,12 +518,19 @@ class LawyerChatBotApp:
             expand=True, # Allow row to expand.
             scroll=ft.ScrollMode.AUTO, # Allow scrolling if content overflows.
         )
+
+    def update_bot_message(self, bot_message, message):
+        """Replaces the text of a bot message created by create_bot_message, e.g. while a reply is streaming."""
+        bubble = bot_message.controls[0] # The message bubble container.
+        bubble.width = min(600, len(message) * 8 + 100) # Grow the bubble with the text, same rule as create_bot_message.
+        bubble.content.controls[1].content.value = message # The Text control below the "BOB:" label.
+
     def create_file_message(self, file_name, content_preview):
         """Creates a Flet UI container to display information about an uploaded file."""
-        is_dark = self.page.theme_mode == ft.ThemeMode.DARK # Check current theme.
         # Calculate width based on message length but cap at 600
         text_width = min(600, (len(file_name) + len(content_preview)) * 6 + 100) # Dynamic width.
-        return ft.Row(
+        return MessageRow(
+            "file",
             [
                 ft.Container(
                     content=ft.Column(
@@ -347,20 +539,20 @@ class LawyerChatBotApp:
                                 f"📄 {file_name}",
                                 size=15,
                                 weight=ft.FontWeight.BOLD,
-                                color=ft.Colors.WHITE if is_dark else ft.Colors.BLUE_800, # File name color.
+                                color=self.message_color("file", "name"), # File name color.
                             ),
                             ft.Text(
                                 content_preview,
                                 selectable=True,
                                 size=12,
-                                color=ft.Colors.WHITE if is_dark else ft.Colors.BLACK, # Preview text color.
+                                color=self.message_color("file", "text"), # Preview text color.
                             )
                         ],
                         spacing=4, # Spacing.
                         tight=True, # Reduce extra spacing.
                     ),
                     alignment=ft.alignment.center_right, # Align to right (like user messages).
-                    bgcolor=ft.Colors.BLUE_800 if is_dark else ft.Colors.BLUE_100, # Background color.
+                    bgcolor=self.message_color("file", "bubble"), # Background color.
                     padding=ft.padding.symmetric(horizontal=14, vertical=10), # Padding.
                     border_radius=ft.border_radius.only( # Rounded corners.
                         top_left=16,
@@ -381,28 +573,14 @@ class LawyerChatBotApp:
             alignment=ft.MainAxisAlignment.END, # Align the row to the right.
         )
 
-    def store_message(self, sender, message):
-        """Store a message in the database"""
+    def store_message(self, sender, message, discussion_id=None):
+        """Store a message in the database, in the current discussion unless `discussion_id` is given.
+        The write is queued and committed by the store's writer thread, so this never blocks on disk;
+        messages stored inside `with self.store.batch():` are committed together.
+        """
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        try:
-            self.cursor.execute(f'''
-                INSERT INTO "{self.current_discussion}" (sender, message, timestamp)
-                VALUES (?, ?, ?)
-            ''', (sender, message, timestamp)) # Use placeholders to prevent SQL injection.
-            self.conn.commit() # Commit the transaction.
-        except sqlite3.OperationalError as e: # Typically "no such table"
-            print(f"Error storing message (table '{self.current_discussion}' might not exist): {str(e)}")
-            # Try to create the table if it doesn't exist
-            self._create_table_if_not_exists(self.current_discussion)
-            # Retry storing the message (within the same thread after table creation)
-            try:
-                self.cursor.execute(f'''
-                    INSERT INTO "{self.current_discussion}" (sender, message, timestamp)
-                    VALUES (?, ?, ?)
-                ''', (sender, message, timestamp))
-                self.conn.commit()
-            except sqlite3.Error as e_retry:
-                print(f"Retry failed for storing message: {e_retry}")
+        discussion_id = discussion_id or self.current_discussion
+        return self.store.insert_message(discussion_id, sender, message, timestamp) # Future of the new row id.
 
 
     def upload_files(self, e):
@@ -414,101 +592,104 @@ class LawyerChatBotApp:
         )
         
     def handle_file_upload(self, e: ft.FilePickerResultEvent):
-        """Processes files selected by the user through the file picker."""
+        """Processes files selected by the user through the file picker.
+        The text is extracted by worker processes; each file shows its progress (and a preview
+        once its first pages are done) and can be cancelled meanwhile.
+        """
         if not e.files: # If no files were selected.
             return
-            
-        for uploaded_file in e.files: # Iterate through each selected file.
-            file_path = uploaded_file.path  # Path to the uploaded file.
-            file_name = uploaded_file.name  # Name of the uploaded file.
-            file_ext = os.path.splitext(file_name)[1].lower() # File extension.
-            
-            try:
-                # Extract text based on file extension.
-                if file_ext == '.pdf': 
-                    text = self.extract_text_from_pdf(file_path)
-                elif file_ext == '.docx':
-                    text = self.extract_text_from_docx(file_path)
-                elif file_ext == '.pptx':
-                    text = self.extract_text_from_pptx(file_path)
-                elif file_ext in ('.xls', '.xlsx'):
-                    text = self.extract_text_from_excel(file_path)
-                else:
-                    text = f"Unsupported file type: {file_ext}"
-                
+        self.show_latest_messages() # New messages go at the end of the discussion.
+
+        extractions = [FileExtraction(uploaded_file.path, uploaded_file.name, self.current_discussion)
+                       for uploaded_file in e.files] # One per selected file.
+        with self.ui_lock:
+            for extraction in extractions:
+                self.uploads.append(extraction)
+                self.attach_upload_view(extraction) # Show the file with a progress bar.
+        self.page.update() # Update UI.
+        for extraction in extractions:
+            self.file_extractor.start(extraction, self.on_extraction_update)
+
+    def on_extraction_update(self, extraction):
+        """Shows the progress of an upload, or its result once finished. Called from the extraction threads."""
+        with self.ui_lock:
+            if extraction not in self.uploads: # Cancelled by the user.
+                return
+            if not extraction.finished:
+                if extraction.view is not None and extraction.view in self.chat.controls:
+                    index = self.chat.controls.index(extraction.view)
+                    extraction.view = self.create_upload_message(extraction)
+                    self.chat.controls[index] = extraction.view
+                    self.page.update()
+                return
+
+            self.uploads.remove(extraction)
+            if extraction.error is not None:
+                result = self.create_bot_message(f"Error processing {extraction.name}: {extraction.error}") # Show error in chat.
+            elif extraction.cancelled:
+                result = None
+            else:
                 # Store file content
                 self.current_files.append({
-                    "name": file_name,
-                    "path": file_path,
-                    "content": text
-                }) # Add file info and content to a temporary list for the current query.
-                
-                # Generate 4-line preview for display and storage
-                original_lines = text.splitlines() # Split content into lines.
-                num_original_lines = len(original_lines) # Count lines.
-
-                if num_original_lines > 4: # If more than 4 lines.
-                    # If more than 4 lines, show the first 3 and append "..." on a new line (total 4 lines for preview)
-                    preview_lines_to_show = original_lines[:3] # Take first 3 lines.
-                    preview = "\n".join(preview_lines_to_show) + "\n..."
-                else:
-                    # If 4 or fewer lines, show all of them.
-                    preview = "\n".join(original_lines)
-
-                # Show file preview in chat
-                self.chat.controls.append(
-                    self.create_file_message(file_name, preview)) # Display file info in chat.
-                
-                # Store upload action and file preview in database
-                self.store_message("user", f"Uploaded document: {file_name}") # Log user action.
-                self.store_message("file", f"{file_name}: {preview}") # Use the generated 4-line preview
-                
-            except Exception as ex: # Handle errors during file processing.
-                error_msg = f"Error processing {file_name}: {str(ex)}"
-                self.chat.controls.append(
-                    self.create_bot_message(error_msg)) # Show error in chat.
-                    
-        self.page.update() # Update UI.
-
-    def extract_text_from_pdf(self, file_path: str) -> str:
-        """Extracts all text from a PDF file."""
-        text = []
-        with open(file_path, 'rb') as file: # Open in binary read mode.
-            reader = pypdf.PdfReader(file) # Create a PDF reader object.
-            for page in reader.pages: # Iterate through each page.
-                text.append(page.extract_text()) # Extract text from the page.
-        return "\n".join(text)
-
-    def extract_text_from_docx(self, file_path: str) -> str:
-        """Extracts all text from a DOCX file."""
-        doc = Document(file_path) # Open the DOCX document.
-        return "\n".join([para.text for para in doc.paragraphs]) # Join text from all paragraphs.
-
-    def extract_text_from_pptx(self, file_path: str) -> str:
-        """Extracts text from all shapes in all slides of a PPTX file."""
-        prs = Presentation(file_path) # Open the PowerPoint presentation.
-        text = []
-        for slide in prs.slides: # Iterate through each slide.
-            for shape in slide.shapes: # Iterate through each shape on the slide.
-                if hasattr(shape, "text"): # If the shape contains text.
-                    text.append(shape.text) # Append the text.
-        return "\n".join(text)
-
-    def extract_text_from_excel(self, file_path: str) -> str:
-        """Extract text from all cells in all sheets of an Excel file."""
-        workbook = openpyxl.load_workbook(file_path, data_only=True) # data_only=True to get cell values, not formulas
-        all_text = []
-        for sheet_name in workbook.sheetnames: # Iterate through each sheet.
-            sheet = workbook[sheet_name] # Get the sheet object.
-            sheet_text = []
-            for row in sheet.iter_rows(): # Iterate through each row.
-                for cell in row: # Iterate through each cell in the row.
-                    if cell.value is not None: # If the cell has a value.
-                        sheet_text.append(str(cell.value)) # Append the cell value as string.
-            if sheet_text: # Add sheet name if it has content
-                all_text.append(f"--- Sheet: {sheet_name} ---\n" + "\n".join(sheet_text)) # Add sheet content with a header.
-        return "\n\n".join(all_text)
-
+                    "name": extraction.name,
+                    "path": extraction.path,
+                    "content": extraction.text,
+                    "discussion_id": extraction.discussion_id,
+                }) # Add file info and content to a temporary list for the next query of its discussion.
+                # Store upload action and file preview in database, in one transaction
+                with self.store.batch():
+                    self.store_message("user", f"Uploaded document: {extraction.name}", discussion_id=extraction.discussion_id) # Log user action.
+                    message = self.store_message("file", f"{extraction.name}: {extraction.preview}", discussion_id=extraction.discussion_id) # Use the generated 4-line preview
+                result = self.create_file_message(extraction.name, extraction.preview) # Display file info in chat.
+                result.data = message # Its id, once written (see rendered_message_id).
+            self.replace_upload_view(extraction, result)
+            self.page.update()
+
+    def cancel_upload(self, extraction):
+        """Stops extracting a file and removes it from the chat."""
+        extraction.cancel()
+        with self.ui_lock:
+            if extraction in self.uploads:
+                self.uploads.remove(extraction)
+                self.replace_upload_view(extraction, None)
+                self.page.update()
+
+    def replace_upload_view(self, extraction, control):
+        """Puts `control` in place of the progress view of an upload, or removes it if `control` is None."""
+        if extraction.view is not None and extraction.view in self.chat.controls:
+            index = self.chat.controls.index(extraction.view)
+            if control is None:
+                del self.chat.controls[index]
+            else:
+                self.chat.controls[index] = control
+        extraction.view = None
+
+    def attach_upload_view(self, extraction):
+        """Adds the progress view of an upload at the end of the chat. The caller holds ui_lock."""
+        extraction.view = self.create_upload_message(extraction)
+        self.append_message(extraction.view)
+
+    def create_upload_message(self, extraction):
+        """Creates the file message of an upload in progress: preview (when known), progress bar and cancel button."""
+        if extraction.total_pages:
+            status = f"Extracting page {extraction.done_pages} of {extraction.total_pages}..."
+        else:
+            status = "Extracting..."
+        view = self.create_file_message(extraction.name, extraction.preview or status)
+        view.controls[0].content.controls.append(
+            ft.Row([
+                ft.ProgressBar(value=extraction.progress, expand=True), # Indeterminate until the page count is known.
+                ft.Text(status, size=11) if extraction.preview else ft.Container(),
+                ft.IconButton(
+                    icon=ft.Icons.CLOSE,
+                    icon_size=16,
+                    tooltip="Cancel",
+                    on_click=lambda e: self.cancel_upload(extraction),
+                ),
+            ], spacing=6)
+        )
+        view.data = "upload" # Not a stored message; see trim_rendered_messages.
+        return view
 
     def web_search_click(self, e):
         """Handle web search button click"""
@@ -523,8 +704,9 @@ class LawyerChatBotApp:
             return
 
         # Store and display query
-        self.store_message("user", f"WEB SEARCH: {query}") # Log the search query.
-        self.chat.controls.append(self.create_user_message(f"🔍 Searching: {query}")) # Display search action in chat.
+        self.show_latest_messages() # New messages go at the end of the discussion.
+        message = self.store_message("user", f"WEB SEARCH: {query}") # Log the search query.
+        self.append_message(self.create_user_message(f"🔍 Searching: {query}"), message) # Display search action in chat.
         
         # Show loading indicator while searching.
         thinking = ft.Container(
@@ -534,7 +716,7 @@ class LawyerChatBotApp:
             ], spacing=10),
             alignment=ft.alignment.center_left,
         )
-        self.chat.controls.append(thinking)
+        self.append_message(thinking)
         # Disable input fields during search.
         self.user_input.disabled = True
         self.send_button.disabled = True
@@ -564,15 +746,15 @@ class LawyerChatBotApp:
             else:
                 result = "🔍 No results found"
             
-            self.store_message("bot", result) # Store the search results.
+            message = self.store_message("bot", result) # Store the search results.
             self.chat.controls.remove(thinking) # Remove loading indicator.
-            self.chat.controls.append(self.create_bot_message(result)) # Display results in chat.
+            self.append_message(self.create_bot_message(result), message) # Display results in chat.
             
         except Exception as err: # Handle any errors during the search process.
             error_msg = f"⚠️ Search failed: {str(err)}"
-            self.store_message("system", error_msg) # Log the error.
+            message = self.store_message("system", error_msg) # Log the error.
             self.chat.controls.remove(thinking) # Remove loading indicator.
-            self.chat.controls.append(self.create_bot_message(error_msg)) # Display error in chat.
+            self.append_message(self.create_bot_message(error_msg), message) # Display error in chat.
             
         # Reset input fields and buttons.
         self.user_input.value = ""
@@ -596,11 +778,34 @@ class LawyerChatBotApp:
             else ft.Icons.DARK_MODE # Set icon to dark mode if theme is light.
         )
         self.update_theme_colors() # Apply color changes to UI elements.
-        # Re-render the chat messages with the new theme
-        if self.current_discussion:  # Check if a discussion is active
-            self.load_previous_messages(self.current_discussion) # Reload messages to apply new theme styles.
+        # Recolor the rendered messages in place: no database read, and the scroll position is kept.
+        with self.ui_lock:
+            for control in self.chat.controls:
+                self.apply_message_theme(control)
         self.page.update() # Update the page.
 
+    def message_color(self, role, part):
+        """Color of one part ("bubble", "text", "label" or "name") of a message of the given role, for the current theme."""
+        return MESSAGE_COLORS[role][part][self.page.theme_mode == ft.ThemeMode.DARK]
+
+    def apply_message_theme(self, control):
+        """Recolors a message created by create_user_message, create_bot_message or create_file_message."""
+        role = getattr(control, "message_role", None)
+        if role is None: # Not a message (e.g. the "Thinking..." indicator).
+            return
+        bubble = control.controls[-1] if role == "user" else control.controls[0] # The message bubble container.
+        bubble.bgcolor = self.message_color(role, "bubble")
+        if role == "user":
+            bubble.content.color = self.message_color("user", "text")
+        elif role == "bot":
+            label, body = bubble.content.controls[:2] # "BOB:" label and the container of the text.
+            label.color = self.message_color("bot", "label")
+            body.content.color = self.message_color("bot", "text")
+        else:
+            name, preview = bubble.content.controls[:2] # File name and preview (an upload may add a progress row).
+            name.color = self.message_color("file", "name")
+            preview.color = self.message_color("file", "text")
+
 
     def update_theme_colors(self):
         """Update all color references based on current theme"""
@@ -608,6 +813,8 @@ class LawyerChatBotApp:
         
         # Update page colors
         self.page.bgcolor = ft.Colors.GREY_900 if is_dark else ft.Colors.GREY_50
+        self.header_divider.color = SEPARATOR_COLORS[is_dark]
+        self.sidebar_separator.bgcolor = SEPARATOR_COLORS[is_dark]
         
         # Update input field
         self.user_input.color = ft.Colors.WHITE if is_dark else ft.Colors.BLACK
@@ -623,7 +830,8 @@ class LawyerChatBotApp:
     def send_click(self, e):
         """Handles the click event of the send button."""
         question = self.user_input.value.strip() # Get user input.
-        if not question and not self.current_files: # If no text and no files, do nothing.
+        files = [file for file in self.current_files if file["discussion_id"] == self.current_discussion] # Files uploaded here.
+        if not question and not files: # If no text and no files, do nothing.
             return
         
         if not self.current_discussion: # If no discussion is active, show a snackbar.
@@ -632,71 +840,174 @@ class LawyerChatBotApp:
             )
             return
 
-        # If there are files, include them in the context
-        context = ""
-        if self.current_files: # If files have been uploaded for this query.
-            context = "\n\n[Attached Files Context]\n"
-            for file in self.current_files: # Append content of each file to the context.
-                context += f"\nFile: {file['name']}\nContent:\n{file['content'][:1000]}\n"
-            self.current_files = []  # Clear the list of current files after they are used.
+        if any(extraction.discussion_id == self.current_discussion for extraction in self.uploads):
+            self.page.show_snack_bar( # The question would be sent without the documents still being read.
+                ft.SnackBar(content=ft.Text("Please wait until the documents are read, or cancel them."), open=True)
+            )
+            return
+
+        # The files are included in the prompt by the worker (see run_generation).
+        self.current_files = [file for file in self.current_files if file not in files]  # Clear the files after they are used.
+        self.show_latest_messages() # New messages go at the end of the discussion.
 
         if question: # If there is a text question.
-            full_question = question + context
-            self.store_message("user", question) # Store the user's text question.
-            self.chat.controls.append(self.create_user_message(question)) # Display user's question.
+            message = self.store_message("user", question) # Store the user's text question.
+            self.append_message(self.create_user_message(question), message) # Display user's question.
         else: # If only files were uploaded without a specific question.
-            full_question = "Please analyze these documents:" + context
-            self.store_message("user", "Uploaded documents for analysis") # Store a generic message.
+            message = self.store_message("user", "Uploaded documents for analysis") # Store a generic message.
 
-        if context and not question: # If only files were uploaded, add a message indicating this.
-            self.chat.controls.append(self.create_bot_message("Received documents for analysis"))
+        if files and not question: # If only files were uploaded, add a message indicating this.
+            self.append_message(self.create_bot_message("Received documents for analysis")) # Not stored.
 
-        # Show "Thinking..." indicator.
-        thinking = ft.Container(
+        # The model is called by a worker thread; the UI stays usable meanwhile, so the user can
+        # browse other discussions, stop the generation or ask further questions (they queue up).
+        job = GenerationJob(self.current_discussion, question, files, message)
+        with self.ui_lock:
+            self.jobs.append(job)
+            self.attach_job_view(job) # Show "Thinking..." (or "Waiting...") below the question.
+        self.user_input.value = ""
+        self.update_stop_button()
+        self.page.update() # Update UI.
+        self.user_input.focus() # Set focus back to input field.
+        self.generation_pool.submit(self.run_generation, job)
+
+    def run_generation(self, job):
+        """Streams the reply of a job from the model. Runs in a worker thread."""
+        if job.cancel_event.is_set(): # Stopped while waiting for a worker.
+            return
+        job.started = True
+        self.refresh_job_view(job) # "Waiting..." becomes "Thinking...".
+        try:
+            # The earlier turns come first: the latest messages verbatim, the older ones summarized.
+            history, history_tokens = self.memory.context(job.discussion_id, job.message.result())
+            # The most relevant parts of the files are packed into the context window (tokenized here, off the UI thread).
+            question, documents, max_new_tokens = self.context_builder.build(job.question, job.files, history_tokens)
+            for chunk in generate_reply_stream(question, max_new_tokens=max_new_tokens, cancel_event=job.cancel_event,
+                                               history=history, documents=documents): # Stream the reply from the AI model.
+                job.reply += chunk
+                self.refresh_job_view(job) # Render the partial reply if its discussion is open.
+            self.finish_job(job)
+        except Exception as err: # Handle errors from the model.
+            job.reply = f"⚠️ Error: {str(err)}"
+            self.finish_job(job, error=str(err))
+
+    def finish_job(self, job, error=None):
+        """Stores the reply of a job in its own discussion and updates the chat if that discussion is open."""
+        with self.ui_lock:
+            if job.finished: # Already stopped by the user.
+                return
+            job.finished = True
+            job.reply = job.reply.strip()
+            if job.cancel_event.is_set() and job.reply:
+                job.reply += " …" # Mark a reply cut short by the stop button.
+            message = None
+            if error is not None:
+                message = self.store_message("system", f"Error: {error}", discussion_id=job.discussion_id) # Log system error.
+            elif job.reply:
+                message = self.store_message("bot", job.reply, discussion_id=job.discussion_id) # Store bot's full reply.
+            self.jobs.remove(job)
+            if job.view is not None and job.view in self.chat.controls:
+                index = self.chat.controls.index(job.view)
+                if job.reply:
+                    self.chat.controls[index] = self.create_bot_message(job.reply) # Display bot's reply.
+                    self.chat.controls[index].data = message # Its id, once written (see rendered_message_id).
+                else:
+                    del self.chat.controls[index] # Stopped before any text: remove the indicator.
+            job.view = None
+            self.update_stop_button()
+            self.page.update()
+
+    def cancel_discussion_work(self, discussion_id):
+        """Before a discussion is deleted: cancels its uploads and questions and drops its unused files,
+        so that nothing finishing later writes to it or attaches files to it."""
+        with self.ui_lock:
+            for extraction in [extraction for extraction in self.uploads if extraction.discussion_id == discussion_id]:
+                extraction.cancel()
+                self.uploads.remove(extraction) # on_extraction_update ignores it from now on.
+                self.replace_upload_view(extraction, None)
+            for job in [job for job in self.jobs if job.discussion_id == discussion_id]:
+                job.cancel_event.set() # The worker closes the stream at its next chunk.
+                job.finished = True # finish_job stores nothing for it.
+                self.jobs.remove(job)
+                if job.view is not None and job.view in self.chat.controls:
+                    self.chat.controls.remove(job.view)
+                job.view = None
+            self.current_files = [file for file in self.current_files if file["discussion_id"] != discussion_id]
+            self.update_stop_button()
+
+    def stop_click(self, e):
+        """Stops every question of the current discussion that is still waiting or being answered."""
+        for job in list(self.jobs):
+            if job.discussion_id == self.current_discussion:
+                job.cancel_event.set() # The worker closes the stream at its next chunk.
+                self.finish_job(job) # Keep what was received so far, right away.
+
+    def attach_pending_views(self):
+        """Adds the uploads and replies in progress of the current discussion that are not shown yet. The caller holds ui_lock."""
+        for extraction in self.uploads:
+            if extraction.discussion_id == self.current_discussion and extraction.view is None:
+                self.attach_upload_view(extraction)
+        for job in self.jobs:
+            if job.discussion_id == self.current_discussion and job.view is None:
+                self.attach_job_view(job)
+
+    def attach_job_view(self, job):
+        """Adds the control of an unfinished job at the end of the chat. The caller holds ui_lock."""
+        job.view = self.create_bot_message(job.reply) if job.reply else self.create_pending_message(job)
+        self.append_message(job.view)
+
+    def refresh_job_view(self, job):
+        """Shows the progress of a job in the chat, if its discussion is the one on screen."""
+        with self.ui_lock:
+            if job.finished or job.view is None or job.discussion_id != self.current_discussion:
+                return
+            if job.view not in self.chat.controls: # Dropped by history paging; reattached with the latest page.
+                job.view = None
+                return
+            if job.reply and job.view.data == "pending": # First chunk: replace the indicator with the bot bubble.
+                index = self.chat.controls.index(job.view)
+                job.view = self.create_bot_message(job.reply)
+                self.chat.controls[index] = job.view
+            elif job.reply: # Following chunks: grow the existing bubble in place.
+                self.update_bot_message(job.view, job.reply)
+            else: # Started: "Waiting..." becomes "Thinking...".
+                index = self.chat.controls.index(job.view)
+                job.view = self.create_pending_message(job)
+                self.chat.controls[index] = job.view
+            self.page.update()
+
+    def create_pending_message(self, job):
+        """Creates the progress indicator shown until the first chunk of a reply arrives."""
+        return ft.Container(
             ft.Row([
                 ft.ProgressRing(width=20, height=20, stroke_width=2),
-                ft.Text("Thinking...")
+                ft.Text("Thinking..." if job.started else "Waiting for the previous question...")
             ], spacing=10),
             alignment=ft.alignment.center_left,
+            data="pending", # Tells refresh_job_view that no text has been shown yet.
         )
-        self.chat.controls.append(thinking)
-        # Disable inputs while processing.
-        self.user_input.disabled = True
-        self.send_button.disabled = True
-        self.upload_button.disabled = True
-        self.search_button.disabled = True
-        self.theme_toggle.disabled = True # Disable before page update
-        self.page.update()
-
-        try:
-            reply = generate_reply(full_question) # Get reply from the AI model.
-            self.store_message("bot", reply) # Store bot's reply.
-        except Exception as err: # Handle errors from the model.
-            reply = f"⚠️ Error: {str(err)}"
-            self.store_message("system", f"Error: {str(err)}") # Log system error.
-
-        self.chat.controls.remove(thinking) # Remove "Thinking..." indicator.
-        self.chat.controls.append(self.create_bot_message(reply)) # Display bot's reply.
-
-        # Re-enable inputs.
-        self.user_input.value = ""
-        self.user_input.disabled = False
-        self.send_button.disabled = False
-        self.upload_button.disabled = False
-        self.theme_toggle.disabled = False
-        self.search_button.disabled = False
-        self.page.update() # Update UI.
-        self.user_input.focus() # Set focus back to input field.
 
+    def update_stop_button(self):
+        """Shows the stop button only while the current discussion has unfinished questions."""
+        self.stop_button.visible = any(job.discussion_id == self.current_discussion for job in self.jobs)
 
     def __del__(self):
         """Close database connection when the app is closed"""
-        if hasattr(self, 'conn'): # Check if connection object exists.
-            self.conn.close() # Close the database connection.
+        if hasattr(self, 'generation_pool'): # Stop the background generations.
+            for job in list(self.jobs):
+                job.cancel_event.set()
+            self.generation_pool.shutdown(wait=False, cancel_futures=True)
+        if hasattr(self, 'file_extractor'): # Stop the extraction workers.
+            for extraction in list(self.uploads):
+                extraction.cancel()
+            self.file_extractor.close()
+        if hasattr(self, 'store'): # Check if the store exists.
+            self.store.close() # Commit queued writes and close the database connection.
 
 
 def main(page: ft.Page):
     """Main function to start the Flet application."""
     LawyerChatBotApp(page) # Create an instance of the app.
 
-ft.app(target=main)
+if __name__ == "__main__": # Extraction worker processes import this module too; they must not start the app.
+    ft.app(target=main)
@@ -2,31 +2,210 @@ import requests  # Library for making HTTP requests.
 import json      # Library for working with JSON data.
 import os        # Library for interacting with the operating system, e.g., environment variables.
 import logging   # Library for logging events.
-import random    # Library for generating random numbers, used here to pick a random API URL.
+import random    # Library for generating random numbers, used here to spread clients across the API URLs.
+import threading # Library for the background health checks.
+import time      # Library for timestamps, used for the back-off of failing endpoints.
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait  # Sends hedged requests in parallel.
+from requests.adapters import HTTPAdapter  # Connection pool of the shared session.
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO)  # Sets the basic configuration for the logging system.
 logger = logging.getLogger(__name__)     # Creates a logger instance for this module.
 
-# Set the API URL from environment variable or use a random one from the list
 # List of available API URLs for the model
 api_urls = [
     "https://juanvic-Bob2.hf.space/",  # First potential API endpoint for the model.
     "https://juanvic-Bob.hf.space/"   # Second potential API endpoint for the model.
 ]
-MODEL_API_URL = os.environ.get("MODEL_API_URL", random.choice(api_urls))
+# MODEL_API_URLS (comma separated) or MODEL_API_URL replace the list above, e.g. for a local server.
+MODEL_API_URLS = [url.strip() for url in os.environ.get("MODEL_API_URLS", os.environ.get("MODEL_API_URL", "")).split(",") if url.strip()] or api_urls
+
+# --- Connection pool and failover ---
+POOL_SIZE = int(os.environ.get("MODEL_POOL_SIZE", 8))  # Kept-alive connections per endpoint, and parallel requests.
+HEALTH_CHECK_INTERVAL = float(os.environ.get("MODEL_HEALTH_CHECK_INTERVAL", 30))  # Seconds between two probes of /health.
+HEALTH_CHECK_TIMEOUT = 10  # Seconds; a Space waking up from sleep answers slowly.
+# A streamed request that has not started answering after HEDGE_LATENCY_FACTOR times the usual
+# latency of its endpoint (and at least HEDGE_MIN_DELAY seconds) is also sent to the next endpoint.
+HEDGE_MIN_DELAY = float(os.environ.get("MODEL_HEDGE_MIN_DELAY", 2.0))
+HEDGE_LATENCY_FACTOR = 3.0
+LATENCY_SMOOTHING = 0.3  # Weight of the newest measure in the moving average of an endpoint's latency.
+BACKOFF_BASE = 2.0  # Seconds a failed endpoint is avoided; doubled on each consecutive failure...
+BACKOFF_MAX = 300.0  # ...up to five minutes, or until a health check succeeds.
+# Ask the server for the time it spent in each stage (retrieval, queue, prefill, decode...) and log it.
+LOG_SERVER_TIMING = os.environ.get("MODEL_LOG_SERVER_TIMING", "1") == "1"
+
+
+class Endpoint:
+    """One model server and what the client has learnt about it."""
+    def __init__(self, url):
+        self.url = url.rstrip("/") + "/"
+        self.latency = None  # Moving average of the time to the response headers, in seconds.
+        self.failures = 0  # Consecutive failures.
+        self.down_until = 0.0  # time.monotonic() before which the endpoint is only used as a last resort.
+        self.tie_breaker = random.random()  # Spreads clients across endpoints that have not been measured yet.
+
+    def available(self, now):
+        return now >= self.down_until
+
+    def hedge_delay(self):
+        """Seconds to wait for this endpoint before sending the same request to the next one."""
+        return max(HEDGE_MIN_DELAY, HEDGE_LATENCY_FACTOR * (self.latency or 0.0))
+
+
+class EndpointPool:
+    """
+    Sends the requests of the app to the best of several model servers over one kept-alive session.
+    Endpoints are ranked by their measured latency; failing ones are skipped with an exponential
+    back-off and probed again by a background health check, and a request is retried on the next
+    endpoint when one fails. Streamed requests can be hedged (see post).
+    """
+    def __init__(self, urls, pool_size=POOL_SIZE, health_check_interval=HEALTH_CHECK_INTERVAL):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.health_check_interval = health_check_interval  # 0 disables the background checks.
+        self.session = requests.Session()  # Reuses TCP/TLS connections across messages.
+        adapter = HTTPAdapter(pool_connections=len(self.endpoints), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="model-request")
+        self.lock = threading.Lock()  # Guards the endpoint statistics.
+        self.closed = threading.Event()
+        self.health_thread = None  # Started with the first request, so importing the module stays free.
+
+    def start(self):
+        """Starts the background health checks (once)."""
+        with self.lock:
+            if self.health_thread is not None or self.health_check_interval <= 0:
+                return
+            self.health_thread = threading.Thread(target=self.health_loop, name="model-health-check", daemon=True)
+        self.health_thread.start()
+
+    def close(self):
+        self.closed.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def health_loop(self):
+        while not self.closed.is_set():
+            for endpoint in self.endpoints:
+                self.check_health(endpoint)
+            self.closed.wait(self.health_check_interval)
+
+    def check_health(self, endpoint):
+        """Probes GET /health; servers without that route (404) are considered up."""
+        try:
+            response = self.session.get(endpoint.url + "health", timeout=HEALTH_CHECK_TIMEOUT)
+            response.close()
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Health check of {endpoint.url} failed: {e}")
+            self.record_failure(endpoint)
+            return False
+        if response.status_code in (200, 404):
+            self.record_success(endpoint, response.elapsed.total_seconds())
+            return True
+        logger.warning(f"Health check of {endpoint.url} returned HTTP {response.status_code}")
+        self.record_failure(endpoint)
+        return False
+
+    def record_latency(self, endpoint, latency):
+        with self.lock:
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += LATENCY_SMOOTHING * (latency - endpoint.latency)
+
+    def record_success(self, endpoint, latency):
+        self.record_latency(endpoint, latency)
+        with self.lock:
+            endpoint.failures = 0
+            endpoint.down_until = 0.0
+
+    def record_failure(self, endpoint):
+        with self.lock:
+            endpoint.failures += 1
+            endpoint.down_until = time.monotonic() + min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (endpoint.failures - 1))
+
+    def ranked(self):
+        """Endpoints in the order they should be tried: available ones fastest first, then the others."""
+        now = time.monotonic()
+        with self.lock:
+            return sorted(self.endpoints, key=lambda endpoint: (
+                not endpoint.available(now),
+                endpoint.down_until if not endpoint.available(now) else 0.0,  # Soonest back first.
+                endpoint.latency if endpoint.latency is not None else 0.0,  # Unmeasured ones get a chance.
+                endpoint.tie_breaker,
+            ))
+
+    def post(self, path, payload, headers, timeout, stream=False, hedge=False):
+        """
+        POSTs `payload` as JSON to `path` on the best endpoint and returns (response, endpoint).
+        Connection errors, timeouts and 5xx/429 answers (e.g. a Space that is asleep) move on to
+        the next endpoint. With hedge=True, an endpoint that has not sent its response headers
+        within its hedge delay is raced by the next one; the first response wins and the other
+        connection is closed. Raises the last requests exception if every endpoint fails.
+        """
+        self.start()
+        candidates = self.ranked()
+        data = json.dumps(payload)
+        pending = {}  # Future of an in-flight request -> (its endpoint, time.monotonic() when it was sent).
+        last_error = None
+        while candidates or pending:
+            if candidates and (not pending or hedge):
+                endpoint = candidates.pop(0)
+                future = self.executor.submit(self.session.post, endpoint.url + path, headers=headers,
+                                              data=data, stream=stream, timeout=timeout)
+                pending[future] = (endpoint, time.monotonic())
+                wait_timeout = endpoint.hedge_delay() if hedge and candidates else None
+            else:
+                wait_timeout = None  # Nothing left to race with: wait for the requests in flight.
+            done, _ = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                logger.info(f"{pending[future][0].url} is slow, hedging the request on the next endpoint.")
+            for future in done:
+                endpoint, _ = pending.pop(future)
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f"Request to {endpoint.url} failed: {e}")
+                    self.record_failure(endpoint)
+                    last_error = e
+                    continue
+                if response.status_code >= 500 or response.status_code == 429:
+                    logger.warning(f"{endpoint.url} returned HTTP {response.status_code}, trying the next endpoint.")
+                    self.record_failure(endpoint)
+                    last_error = requests.exceptions.HTTPError(f"{response.status_code} from {endpoint.url}", response=response)
+                    response.close()
+                    continue
+                self.record_success(endpoint, response.elapsed.total_seconds())
+                for loser, (loser_endpoint, sent) in pending.items():  # Close the other hedged requests as soon as they answer.
+                    loser.add_done_callback(close_response)
+                    self.record_latency(loser_endpoint, time.monotonic() - sent)  # At least this slow.
+                return response, endpoint
+        raise last_error
+
+
+def close_response(future):
+    """Closes the response of a request that lost a hedge race; this also stops its generation on the server."""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+endpoint_pool = EndpointPool(MODEL_API_URLS)  # Shared by every message of the app.
 
 # Chat generation function
 def generate_reply(user_input: str,
                     max_new_tokens: int = 80,
                     temperature: float = 0.7,
-                    top_p: float = 0.9) -> str:
+                    top_p: float = 0.9,
+                    history: str = "",
+                    documents: str = "") -> str:
     """Sends a request to the external FastAPI model server for text generation.
         Args:
             user_input (str): The user's message.
             max_new_tokens (int): Max tokens to generate.
             temperature (float): Sampling temperature.
             top_p (float): Nucleus sampling probability.
+            history (str): Earlier turns of the discussion, sent apart from the question.
+            documents (str): Excerpts of the attached files, sent apart from the question.
         Returns:
             str: The assistant's reply.
     """
@@ -36,14 +215,24 @@ def generate_reply(user_input: str,
         "max_new_tokens": max_new_tokens,
         "temperature": temperature,
         "top_p": top_p,
+        "server_timing": LOG_SERVER_TIMING,  # Older servers ignore it.
     }
+    if history:  # Retrieval and the response cache of the server use the question alone.
+        payload["history"] = history
+    if documents:
+        payload["documents"] = documents
     
     try: # Uses a try-except block to handle potential network issues (timeouts, connection errors, etc.)
-        logger.info(f"Sending request to {MODEL_API_URL} with input: {user_input[:50]}...")
-        response = requests.post(MODEL_API_URL, headers=headers, data=json.dumps(payload), timeout=210) #Sends the request to the API endpoint with headers, data, and a timeout.  The timeout prevents the app from hanging indefinitely if the API is unresponsive.
-        response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
-        
-        result = response.json() # Parses the JSON response from the API.
+        logger.info(f"Sending request with input: {user_input[:50]}...")
+        # Sends the request to the best endpoint, failing over to the others. Not hedged: a duplicate
+        # non-streamed generation could not be stopped early. The timeout prevents the app from
+        # hanging indefinitely if the API is unresponsive.
+        response, endpoint = endpoint_pool.post("", payload, headers, timeout=210)
+        with response:
+            response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
+            result = response.json() # Parses the JSON response from the API.
+            if response.headers.get("Server-Timing"):
+                logger.info(f"Server timing ({endpoint.url}): {response.headers['Server-Timing']}")
         logger.info(f"Received response: {str(result)[:100]}...")
 
         if "reply" in result:  # Checks if the 'reply' key exists in the JSON response.
@@ -53,12 +242,88 @@ def generate_reply(user_input: str,
             return "⚠️ Error: Could not parse the model's response from API."
 
     except requests.exceptions.Timeout: # Handles a timeout error specifically.
-        logger.error(f"Request to {MODEL_API_URL} timed out.")
+        logger.error("Request to the model API timed out.")
         return "⚠️ Error: The request to the model API timed out."
     except requests.exceptions.RequestException as e: # Handles general request exceptions (connection errors, etc.)
-        logger.error(f"Error calling model API at {MODEL_API_URL}: {e}")
+        logger.error(f"Error calling model API: {e}")
         return f"⚠️ Error: Could not reach the model service ({e})."
     except json.JSONDecodeError: # Handles errors in decoding the JSON response.
-        logger.error(f"Failed to decode JSON response from {MODEL_API_URL}")
+        logger.error("Failed to decode JSON response from the model API")
         return "⚠️ Error: Invalid response format from the model API."
     # These different `except` blocks provide more specific error messages for better debugging and user experience.
+
+# Streaming chat generation function
+def generate_reply_stream(user_input: str,
+                          max_new_tokens: int = 80,
+                          temperature: float = 0.7,
+                          top_p: float = 0.9,
+                          cancel_event=None,
+                          history: str = "",
+                          documents: str = ""):
+    """Streams the reply from the model server's "/stream" endpoint chunk by chunk.
+        Args:
+            user_input (str): The user's message.
+            max_new_tokens (int): Max tokens to generate.
+            temperature (float): Sampling temperature.
+            top_p (float): Nucleus sampling probability.
+            history (str): Earlier turns of the discussion, sent apart from the question.
+            documents (str): Excerpts of the attached files, sent apart from the question.
+            cancel_event (threading.Event): Optional; once set, the stream is closed at the next
+                chunk, which also makes the server stop generating.
+        Yields:
+            str: Pieces of the assistant's reply as soon as the server produces them.
+    """
+    stream_url = "/stream"  # The streaming endpoint lives next to the root endpoint; full URL once an endpoint is chosen.
+    endpoint = None  # The endpoint that answered.
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+    payload = {
+        "user_input": user_input,
+        "max_new_tokens": max_new_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+        "server_timing": LOG_SERVER_TIMING,  # Older servers ignore it.
+    }
+    if history:  # Retrieval and the response cache of the server use the question alone.
+        payload["history"] = history
+    if documents:
+        payload["documents"] = documents
+
+    try:
+        logger.info(f"Streaming request with input: {user_input[:50]}...")
+        # timeout=(connect, read): the read timeout applies between two chunks, not to the whole reply.
+        # Hedged: if the best endpoint is slow to start answering, the next one is raced against it.
+        response, endpoint = endpoint_pool.post("stream", payload, headers, timeout=(10, 210), stream=True, hedge=True)
+        stream_url = endpoint.url + "stream"
+        with response:
+            if response.status_code == 404:  # Older servers have no streaming endpoint.
+                logger.warning(f"{stream_url} not found, falling back to the non-streaming endpoint.")
+                yield generate_reply(user_input, max_new_tokens, temperature, top_p, history, documents)
+                return
+            response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
+
+            for line in response.iter_lines(decode_unicode=True):  # Server-sent events are line based.
+                if cancel_event is not None and cancel_event.is_set():
+                    logger.info("Streaming request cancelled.")
+                    return  # Leaving the `with` block closes the connection.
+                if not line or not line.startswith("data:"):
+                    continue  # Skip blank separators and "event:" lines.
+                event = json.loads(line[len("data:"):].strip())
+                if "token" in event:
+                    yield event["token"]
+                elif "error" in event:
+                    logger.error(f"Model API reported an error: {event['error']}")
+                    yield f"⚠️ Error: {event['error']}"
+                elif "server_timing" in event:  # Sent with the final "done" event.
+                    logger.info(f"Server timing ({endpoint.url}): {event['server_timing']}")
+
+    except requests.exceptions.Timeout: # Handles a timeout error specifically.
+        logger.error(f"Streaming request to {stream_url} timed out.")
+        if endpoint is not None:  # Stalled mid-reply: prefer the other endpoints for a while.
+            endpoint_pool.record_failure(endpoint)
+        yield "⚠️ Error: The request to the model API timed out."
+    except requests.exceptions.RequestException as e: # Handles general request exceptions (connection errors, etc.)
+        logger.error(f"Error calling model API at {stream_url}: {e}")
+        yield f"⚠️ Error: Could not reach the model service ({e})."
+    except json.JSONDecodeError: # Handles errors in decoding an event.
+        logger.error(f"Failed to decode streamed event from {stream_url}")
+        yield "⚠️ Error: Invalid response format from the model API."
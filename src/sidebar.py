@@ -1,50 +1,63 @@
 import flet as ft  # Flet library for creating the user interface.
-import sqlite3      # SQLite library for database operations.
+from database import SNIPPET_START, SNIPPET_END  # Markers of the matched words in search snippets.
+from database import discussion_title  # Title of a new discussion, without reading it back.
+
+SEARCH_MIN_CHARS = 2  # Shorter queries would match most messages.
+SEARCH_RESULT_LIMIT = 20  # Best-ranked messages shown under the search box.
 
 class ModernNavBar(ft.Container):
     """
     A custom Flet Container that acts as a sidebar navigation bar.
     It displays a list of discussions, allows creating new ones, and deleting existing ones.
+    A search box at the top finds messages across all discussions.
     """
     def __init__(self, main_app):
         self.main_app = main_app  # Reference to the main app
-        self.current_selected = None  # Track currently selected discussion
-        self.highest_discussion_num = 0  # Track the highest number used in "discussion_X" table names.
+        self.current_selected = None  # Id of the currently selected discussion
+        self.search_field = ft.TextField(
+            hint_text="Search messages",
+            prefix_icon=ft.Icons.SEARCH,
+            dense=True,
+            text_size=13,
+            on_change=self.on_search_change, # Results are updated while typing.
+        )
+        self.search_results = ft.Column(spacing=0, visible=False) # Filled by on_search_change.
         
-        table_names = self.get_database_tables()  # Fetch existing discussion table names from the database.
-        self.update_highest_discussion_num(table_names)  # Initialize highest_discussion_num based on existing tables.
+        # In-memory model of the sidebar, read from the database once: create, delete and click
+        # update it and the affected controls only, instead of reloading and rebuilding the list.
+        self.discussions = list(self.get_discussions())  # (id, title), newest first, in display order.
+        self.items = {}  # Discussion id -> its list item Container.
+        # A ListView only lays out the rows on screen, so thousands of discussions stay responsive.
+        self.discussion_list = ft.ListView(
+            expand=True,
+            spacing=0,
+            controls=[
+                self.search_results,  # Ranked matches, hidden when the search box is empty.
+                self.create_discussion_button(),  # Button to create new discussions.
+            ],
+        )
+        self.first_item_index = len(self.discussion_list.controls)  # Discussion items come after the search results and the button.
+        self.discussion_list.controls.extend(self.create_discussion_list_items(self.discussions))  # List items for each existing discussion.
         
         super().__init__(
             width=250,  # Fixed width for the sidebar.
             padding=10, # Padding around the content of the sidebar.
             clip_behavior=ft.ClipBehavior.HARD_EDGE, # Defines how content is clipped if it overflows.
-            # The main content of the sidebar is a Column.
+            # The main content of the sidebar is a Column; the list below the search box scrolls.
             content=ft.Column(
                 expand=True,
-                scroll=ft.ScrollMode.AUTO,
                 controls=[
                     ft.Container(
                         padding=ft.padding.only(bottom=20),
                         content=ft.Text("Bob the lawyer", size=16, weight=ft.FontWeight.BOLD) # Title at the top of the sidebar.
                     ),
-                    self.create_discussion_button(),  # Button to create new discussions.
-                    *self.create_table_list_items(table_names),  # List items for each existing discussion.
+                    self.search_field,  # Full-text search over all messages.
+                    self.discussion_list,  # Search results, the create button and the discussions.
                 ],
             ),
         )
 
 
-    def update_highest_discussion_num(self, table_names):
-        """Find the highest discussion number from existing tables"""
-        for table in table_names: # Iterate through the list of table names.
-            if table.startswith("discussion_"): # Check if the table name follows the "discussion_X" pattern.
-                try:
-                    num = int(table.split("_")[1])  # Extract the number part.
-                    if num > self.highest_discussion_num: # If this number is higher than the current max.
-                        self.highest_discussion_num = num # Update the highest number.
-                except (IndexError, ValueError): # Handle cases where splitting or conversion fails.
-                    continue # Skip to the next table name.
-
     def create_discussion_button(self):
         """Create the 'Create Discussion' button"""
         return ft.Container(
@@ -61,32 +74,16 @@ class ModernNavBar(ft.Container):
         )
 
     def create_new_discussion(self, e):
-        """Create a new discussion table in the database"""
+        """Create a new discussion in the database"""
         try:
-            # Increment the discussion number
-            self.highest_discussion_num += 1
-            table_name = f"discussion_{self.highest_discussion_num}" # Generate a new unique table name.
-            
-            conn = sqlite3.connect(self.main_app.get_database_path()) # Connect to the database.
-            cursor = conn.cursor()
+            discussion_id = self.main_app.store.create_discussion() # Insert a new row; the id comes from AUTOINCREMENT.
             
-            # Create a new table with some basic structure
-            cursor.execute(f""" 
-                CREATE TABLE {table_name} (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    message TEXT,
-                    sender TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit() # Save changes to the database.
-            conn.close() # Close the database connection.
+            # Show the new discussion at the top of the list, selected; its title is known without a query.
+            self.add_discussion(discussion_id, discussion_title(discussion_id))
+            self.select_discussion(discussion_id)
             
-            # Switch to the new discussion
-            self.main_app.switch_discussion(table_name) # Make the new discussion active in the main app.
-            
-            # Refresh the sidebar to show the new table
-            self.refresh_sidebar(e.page, table_name) # Update the sidebar UI.
+            # Switch to the new discussion; its page update also sends the sidebar changes.
+            self.main_app.switch_discussion(discussion_id) # Make the new discussion active in the main app.
 
         except Exception as ex: # Catch any errors during the process.
             e.page.show_snack_bar(
@@ -96,99 +93,112 @@ class ModernNavBar(ft.Container):
                 )
             )
 
-    def get_database_tables(self):
-        """Fetch all table names from the SQLite database, sorted in descending order."""
+    def get_discussions(self):
+        """Fetch all discussions (id, title) from the SQLite database, newest first."""
         try:
-            conn = sqlite3.connect(self.main_app.get_database_path()) # Connect to the database.
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';") # SQL query to get all table names.
-            tables_data = cursor.fetchall() # Fetch all results.
-            conn.close() # Close the connection.
-            
-            # Filter for tables starting with "discussion_"
-            table_names = [
-                table[0] for table in tables_data if table[0].startswith("discussion_")
-            ]
-            # Sort the table names in descending (reverse alphabetical) order
-            table_names.sort(reverse=True) # This ensures newer discussions appear at the top.
-            return table_names
+            return self.main_app.store.list_discussions() # Ordered by id, so discussion_10 comes before discussion_9.
         except Exception as e: # Handle potential database access errors.
             print(f"Error accessing database: {e}")
             return [] # Return an empty list on error
 
-    def create_table_list_items(self, table_names):
-        """Create list items for each table name"""
-        items = []
-        for table in table_names:
-            # Determine if the delete button should be shown (only for "discussion_X" tables).
-            show_delete = table.startswith("discussion_") 
-            
-            items.append(
-                ft.Container(
-                    padding=ft.padding.symmetric(vertical=10, horizontal=15),
-                    content=ft.Row(
-                        controls=[
-                            ft.Icon(name=ft.Icons.TABLE_ROWS, size=18),
-                            ft.Text(
-                                table, 
-                                size=14,
-                                color=ft.Colors.WHITE if table == self.current_selected else None # Highlight if selected.
-                            ),
-                            # Delete button (only visible on hover and for discussions)
-                            ft.IconButton(
-                                icon=ft.Icons.DELETE,
-                                icon_size=18,
-                                icon_color=ft.Colors.RED_400,
-                                visible=False,  # Hidden by default
-                                data=table,  # Store table name in button data
-                                on_click=self.delete_discussion,
-                            ) if show_delete else ft.Container(width=0)  # Empty container if not deletable
-                        ],
-                        spacing=10,
-                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+    def create_discussion_list_items(self, discussions):
+        """Create list items for each discussion"""
+        return [self.create_discussion_item(discussion_id, title) for discussion_id, title in discussions]
+
+    def create_discussion_item(self, discussion_id, title):
+        """Create the list item of a discussion and register it in self.items."""
+        selected = discussion_id == self.current_selected
+        item = ft.Container(
+            padding=ft.padding.symmetric(vertical=10, horizontal=15),
+            content=ft.Row(
+                controls=[
+                    ft.Icon(name=ft.Icons.TABLE_ROWS, size=18),
+                    ft.Text(
+                        title, 
+                        size=14,
+                        color=ft.Colors.WHITE if selected else None # Highlight if selected.
                     ),
-                    border=ft.border.only(bottom=ft.BorderSide(1, ft.Colors.GREY_300)), # Bottom border.
-                    bgcolor=ft.Colors.BLUE_800 if table == self.current_selected else None, # Background highlight if selected.
-                    on_click=lambda e, table=table: self.on_table_click(e, table), # Click handler.
-                    on_hover=lambda e, table=table: self.on_discussion_hover(e, table, show_delete), # Hover handler.
-                )
-            )
-        return items
-
-    def on_discussion_hover(self, e, table_name, show_delete):
-        """Show/hide delete button on hover (only for discussions)"""
-        if show_delete:
-            # Find the delete button in the row's controls
-            row = e.control.content # The Row control within the hovered Container.
-            delete_button = row.controls[-1]  # Last control is the delete button
-            
-            # Toggle visibility based on hover state
-            delete_button.visible = e.data == "true" # Flet sets e.data to "true" on hover-in, "false" on hover-out.
-            e.control.update() # Update the UI to reflect visibility change.
+                    # Delete button (only visible on hover)
+                    ft.IconButton(
+                        icon=ft.Icons.DELETE,
+                        icon_size=18,
+                        icon_color=ft.Colors.RED_400,
+                        visible=False,  # Hidden by default
+                        data=(discussion_id, title),  # Store the discussion in button data
+                        on_click=self.delete_discussion,
+                    )
+                ],
+                spacing=10,
+                alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+            ),
+            border=ft.border.only(bottom=ft.BorderSide(1, ft.Colors.GREY_300)), # Bottom border.
+            bgcolor=ft.Colors.BLUE_800 if selected else None, # Background highlight if selected.
+            on_click=lambda e, discussion_id=discussion_id, title=title: self.on_discussion_click(e, discussion_id, title), # Click handler.
+            on_hover=lambda e, discussion_id=discussion_id: self.on_discussion_hover(e, discussion_id), # Hover handler.
+        )
+        self.items[discussion_id] = item
+        return item
+
+    def add_discussion(self, discussion_id, title):
+        """Insert a discussion at the top of the model and of the list; the page update is left to the caller."""
+        self.discussions.insert(0, (discussion_id, title)) # Newest first, like list_discussions().
+        self.discussion_list.controls.insert(self.first_item_index, self.create_discussion_item(discussion_id, title))
+
+    def remove_discussion(self, discussion_id):
+        """Remove a discussion from the model and its item from the list; the page update is left to the caller."""
+        item = self.items.pop(discussion_id, None)
+        if item is None:
+            return
+        self.discussions = [discussion for discussion in self.discussions if discussion[0] != discussion_id]
+        self.discussion_list.controls.remove(item)
+
+    def set_highlight(self, discussion_id, selected):
+        """Restyle the item of a discussion as selected or not. Returns the item, or None if it is not listed."""
+        item = self.items.get(discussion_id)
+        if item is not None:
+            item.bgcolor = ft.Colors.BLUE_800 if selected else None
+            item.content.controls[1].color = ft.Colors.WHITE if selected else None # The title Text.
+        return item
+
+    def select_discussion(self, discussion_id):
+        """Move the highlight to `discussion_id`: only the previous and the new item are restyled."""
+        if discussion_id == self.current_selected:
+            return
+        self.set_highlight(self.current_selected, False)
+        self.current_selected = discussion_id # Mark this discussion as selected.
+        self.set_highlight(discussion_id, True)
+
+    def on_discussion_hover(self, e, discussion_id):
+        """Show/hide delete button on hover"""
+        # Find the delete button in the row's controls
+        row = e.control.content # The Row control within the hovered Container.
+        delete_button = row.controls[-1]  # Last control is the delete button
+        
+        # Toggle visibility based on hover state
+        delete_button.visible = e.data == "true" # Flet sets e.data to "true" on hover-in, "false" on hover-out.
+        e.control.update() # Update the UI to reflect visibility change.
 
     def delete_discussion(self, e, confirm=False):
         """Handle discussion deletion without confirmation dialog"""
-        table_name = e.control.data # Get the table name stored in the button's data attribute.
+        discussion_id, title = e.control.data # Get the discussion stored in the button's data attribute.
         
         try:
-            conn = sqlite3.connect(self.main_app.get_database_path()) # Connect to DB.
-            cursor = conn.cursor()
-            cursor.execute(f"DROP TABLE {table_name}") # SQL to delete the table.
-            conn.commit() # Save changes.
-            conn.close() # Close connection.
+            self.main_app.cancel_discussion_work(discussion_id) # Its uploads and replies in progress must not write to it.
+            self.main_app.store.delete_discussion(discussion_id).result() # Delete the discussion and its messages.
+            
+            self.remove_discussion(discussion_id) # Drop its item; the other items are left untouched.
             
             # If we're currently viewing this discussion, switch to default
-            if self.current_selected == table_name:
+            if self.current_selected == discussion_id:
                 self.current_selected = None # Clear the current selection.
                 self.main_app.switch_discussion(None) # Tell main_app no discussion is selected.
-                self.main_app.clear_chat()  # Clear the chat history
-            
-            # Refresh sidebar
-            self.refresh_sidebar(e.page) # Update the sidebar UI.
+                self.main_app.clear_chat()  # Clear the chat history; also sends the sidebar changes.
+            else:
+                self.discussion_list.update() # Only the list lost a control.
             
             self.main_app.page.show_snack_bar(
                 ft.SnackBar(
-                    ft.Text(f"Deleted discussion: {table_name}"), 
+                    ft.Text(f"Deleted discussion: {title}"), 
                     open=True
                 )
             )
@@ -200,46 +210,72 @@ class ModernNavBar(ft.Container):
                 )
             )
 
-    def refresh_sidebar(self, page, new_table_name=None):
-        """Refresh the sidebar to include the newly created table"""
-        # Get the current table names including the new one
-        table_names = self.get_database_tables() # Fetch the updated list of tables.
-        
-        # Update current selection if new table was created
-        if new_table_name:
-            self.current_selected = new_table_name # Set the new table as the currently selected one.
-        
-        # Rebuild the controls
-        self.content.controls = [
-            ft.Container(
-                padding=ft.padding.only(bottom=20),
-                content=ft.Text("Bob the lawyer", size=16, weight=ft.FontWeight.BOLD)
-            ),
-            self.create_discussion_button(), # Add the "Create Discussion" button.
-            *self.create_table_list_items(table_names), # Add list items for all discussions.
-        ]
-        
-        # Update the page
-        page.update()
-
-    def on_table_click(self, e, table_name):
-        """Handle table click event - switch to this discussion"""
-        # Update the current selection
-        self.current_selected = table_name # Mark this table as selected.
-        
-        # Switch to the selected discussion
-        self.main_app.switch_discussion(table_name) # Tell the main app to load this discussion.
+    def on_discussion_click(self, e, discussion_id, title):
+        """Handle discussion click event - switch to this discussion"""
+        # Move the highlight; no database access, only the two affected items change.
+        self.select_discussion(discussion_id)
         
-        # Refresh the sidebar to update the highlight
-        self.refresh_sidebar(e.page) # Update the sidebar UI to reflect the selection.
+        # Switch to the selected discussion; its page update also sends the new highlight.
+        self.main_app.switch_discussion(discussion_id) # Tell the main app to load this discussion.
         
         e.page.show_snack_bar(
             ft.SnackBar(
-                ft.Text(f"Switched to discussion: {table_name}"), 
+                ft.Text(f"Switched to discussion: {title}"), 
                 open=True
             )
         )
 
+    def on_search_change(self, e):
+        """Run the full-text search for the text typed so far and list the ranked matches."""
+        text = self.search_field.value.strip()
+        self.search_results.controls.clear()
+        if len(text) >= SEARCH_MIN_CHARS:
+            try:
+                results = self.main_app.store.search_messages(text, limit=SEARCH_RESULT_LIMIT) # FTS5, best matches first.
+            except Exception as ex: # Handle search errors without breaking the sidebar.
+                print(f"Error searching messages: {ex}")
+                results = []
+            self.search_results.controls.extend(self.create_search_result_item(*result) for result in results)
+            if not results:
+                self.search_results.controls.append(
+                    ft.Container(padding=10, content=ft.Text("No matching messages", size=12, italic=True, opacity=0.6))
+                )
+        self.search_results.visible = bool(self.search_results.controls)
+        self.search_results.update() # Only the results changed; the discussion items are left alone.
+
+    def create_search_result_item(self, message_id, discussion_id, title, sender, snippet):
+        """Create a clickable search result: discussion title and the snippet with the matched words in bold."""
+        return ft.Container(
+            padding=ft.padding.symmetric(vertical=6, horizontal=10),
+            content=ft.Column(
+                controls=[
+                    ft.Text(f"{title} · {sender}", size=11, opacity=0.7),
+                    ft.Text(spans=self.snippet_spans(snippet), size=12, max_lines=3),
+                ],
+                spacing=2,
+                tight=True,
+            ),
+            border=ft.border.only(bottom=ft.BorderSide(1, ft.Colors.GREY_300)),
+            on_click=lambda e: self.open_search_result(e, discussion_id, message_id),
+        )
+
+    def snippet_spans(self, snippet):
+        """Split a search snippet into text spans; the words between the snippet markers are highlighted."""
+        spans = []
+        for i, part in enumerate(snippet.replace(SNIPPET_END, SNIPPET_START).split(SNIPPET_START)):
+            if not part:
+                continue
+            if i % 2: # Odd parts are the matched words.
+                spans.append(ft.TextSpan(part, ft.TextStyle(weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_400)))
+            else:
+                spans.append(ft.TextSpan(part))
+        return spans
+
+    def open_search_result(self, e, discussion_id, message_id):
+        """Open the discussion of a search result, scrolled to the matching message."""
+        self.select_discussion(discussion_id) # Move the highlight; the search results stay visible.
+        self.main_app.switch_discussion(discussion_id, message_id) # Load the messages around the match.
+
 def render_sidebar(main_app):
     """
     Factory function to create and return an instance of ModernNavBar.
@@ -0,0 +1,88 @@
+"""
+Tests of the chat store of the desktop app (src/database.py).
+
+    python -m pytest tests
+"""
+import sys  # Makes the desktop app modules importable.
+import sqlite3  # Builds a database in the old layout.
+from concurrent.futures import ThreadPoolExecutor  # Reads run while the writer is held up.
+from pathlib import Path  # Path of the src folder.
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from database import ChatStore, initialize_schema  # The store under test.
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ChatStore(str(tmp_path / "chat.db"))
+    yield store
+    store.close()
+
+
+def test_failed_write_does_not_stop_the_writer(store):
+    """A write to a deleted discussion fails on its own; the writer thread keeps serving reads and writes."""
+    discussion_id = store.create_discussion()
+    store.delete_discussion(discussion_id).result()
+
+    orphan = store.insert_message(discussion_id, "bot", "A reply finished after the deletion")
+    with pytest.raises(Exception, match="FOREIGN KEY"):
+        orphan.result(timeout=5)
+
+    assert store.list_discussions() == []
+    other_id = store.create_discussion()
+    store.insert_message(other_id, "user", "Still working").result(timeout=5)
+    assert [row[1:] for row in store.load_messages_page(other_id)] == [("user", "Still working")]
+    assert store.writer.is_alive()
+
+
+def test_failed_write_in_a_group_does_not_lose_the_others(store):
+    """When several batches are committed together, only the failing one gets the error."""
+    deleted_id = store.create_discussion()
+    store.delete_discussion(deleted_id).result()
+    other_id = store.create_discussion()
+    with store.lock:  # The writer blocks on the first write; the next two wait and are grouped together.
+        first = store.insert_message(other_id, "user", "First")
+        failing = store.insert_message(deleted_id, "bot", "Orphan")
+        succeeding = store.insert_message(other_id, "bot", "Second")
+    assert first.result(timeout=5) and succeeding.result(timeout=5)
+    assert failing.exception(timeout=5) is not None
+    assert [row[2] for row in store.load_messages_page(other_id)] == ["First", "Second"]
+
+
+def test_reads_do_not_wait_for_other_discussions_writes(store):
+    """A slow commit delays the reads of its own discussion only; they then see the write."""
+    busy_id = store.create_discussion()
+    other_id = store.create_discussion()
+    store.insert_message(other_id, "user", "Already written").result()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with store.lock:  # Holds the writer up, like a slow group commit.
+            store.insert_message(busy_id, "user", "Being written")
+            assert [row[2] for row in store.load_messages_page(other_id)] == ["Already written"]
+            assert {row[0] for row in store.list_discussions()} == {busy_id, other_id}
+            busy_read = pool.submit(store.load_messages_page, busy_id)
+            assert not busy_read.done()
+        assert [row[2] for row in busy_read.result(timeout=5)] == ["Being written"]
+
+
+def test_failed_migration_leaves_the_database_untouched(tmp_path):
+    """The old per-discussion tables are migrated in one transaction: a failure keeps them all, and a retry works."""
+    path = tmp_path / "chat.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE discussion_1 (id INTEGER PRIMARY KEY, sender TEXT, message TEXT, timestamp DATETIME)")
+    conn.execute("INSERT INTO discussion_1 (sender, message, timestamp) VALUES ('user', 'Hello', '2024-01-01 10:00:00')")
+    conn.execute("CREATE TABLE discussion_2 (id INTEGER PRIMARY KEY, sender TEXT, timestamp DATETIME)")  # No message column.
+    conn.commit()
+
+    with pytest.raises(sqlite3.OperationalError):
+        initialize_schema(conn)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"discussion_1", "discussion_2"} <= tables and "messages" not in tables
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+
+    conn.execute("ALTER TABLE discussion_2 ADD COLUMN message TEXT")  # Repaired: the next start migrates both.
+    conn.commit()
+    initialize_schema(conn)
+    assert conn.execute("SELECT discussion_id, message FROM messages").fetchall() == [(1, "Hello")]
+    conn.close()
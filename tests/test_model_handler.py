@@ -0,0 +1,148 @@
+"""
+Tests of the desktop app's model client (src/model_handler.py) against local stub model servers
+that are dead, asleep, slow, or older than the "/stream" endpoint.
+
+    python -m pytest tests
+"""
+import json  # Server-sent events and request bodies.
+import socket  # Reserves a port nobody listens on, for the dead endpoint.
+import sys  # Makes the desktop app modules importable.
+import threading  # Runs the stub servers.
+import time  # Delays of the slow stub, and elapsed times.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Stub model servers.
+from pathlib import Path  # Path of the src folder.
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+import model_handler  # The client under test.
+from model_handler import EndpointPool
+
+REPLY = ["The ", "law ", "says."]  # Streamed by every stub.
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """A model server: streams REPLY on POST /stream and returns it whole on POST /, after an optional delay."""
+    protocol_version = "HTTP/1.1"  # Keep-alive, like uvicorn behind the Space proxy.
+
+    def do_GET(self):
+        self.send_body(self.server.status, b'{"status": "ok"}', "application/json")
+
+    def do_POST(self):
+        self.server.requests.append((self.path, json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))))
+        time.sleep(self.server.delay)  # Queueing or retrieval before the headers are sent.
+        if self.path == "/stream" and not self.server.streams:  # A server older than the streaming endpoint.
+            self.send_body(404, b'{"detail": "Not Found"}', "application/json")
+        elif self.path == "/stream":
+            events = "".join(f"data: {json.dumps({'token': token})}\n\n" for token in REPLY)
+            self.send_body(self.server.status, (events + "event: done\ndata: {}\n\n").encode(), "text/event-stream")
+        else:
+            self.send_body(self.server.status, json.dumps({"reply": "".join(REPLY)}).encode(), "application/json")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    """Starts stub servers: stub(delay=0.0, status=200, streams=True) returns (base URL, server)."""
+    servers = []
+
+    def start(delay=0.0, status=200, streams=True):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        server.daemon_threads = True
+        server.handle_error = lambda request, client_address: None  # Clients closing mid-reply are expected.
+        server.delay, server.status, server.streams, server.requests = delay, status, streams, []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/", server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def use_pool(monkeypatch):
+    """use_pool(urls) makes the client send through a pool of `urls`, tried in the given order."""
+    pools = []
+
+    def use(urls):
+        pool = EndpointPool(urls, health_check_interval=0)
+        for rank, endpoint in enumerate(pool.endpoints):
+            endpoint.tie_breaker = float(rank)  # Unmeasured endpoints are tried in list order.
+        monkeypatch.setattr(model_handler, "endpoint_pool", pool)
+        pools.append(pool)
+        return pool
+
+    monkeypatch.setattr(model_handler, "HEDGE_MIN_DELAY", 0.1)  # Local stubs answer in about a millisecond.
+    yield use
+    for pool in pools:
+        pool.close()
+
+
+def dead_url():
+    """A URL whose port refuses connections."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/"
+
+
+@pytest.mark.parametrize("bad", ["dead", "asleep"])
+def test_failover_off_a_failing_endpoint(stub, use_pool, bad):
+    """A refused connection or an HTTP 503 (a Space asleep) moves on to the next endpoint, which is then preferred."""
+    bad_url = dead_url() if bad == "dead" else stub(status=503)[0]
+    good_url, _ = stub()
+    pool = use_pool([bad_url, good_url])
+
+    for _ in range(3):
+        assert "".join(model_handler.generate_reply_stream("What is theft?")) == "The law says."
+    assert pool.endpoints[0].failures == 1  # Backed off after the first failure, not retried each message.
+    assert pool.ranked()[0].url == good_url
+
+
+def test_hedging_past_a_slow_endpoint(stub, use_pool):
+    """A request the first endpoint is slow to answer is raced on the next one, and the fast answer wins."""
+    slow_url, _ = stub(delay=2.0)
+    fast_url, _ = stub()
+    pool = use_pool([slow_url, fast_url])
+
+    start = time.perf_counter()
+    assert "".join(model_handler.generate_reply_stream("What is theft?")) == "The law says."
+    assert time.perf_counter() - start < 1.5  # Did not wait for the slow endpoint.
+    assert pool.ranked()[0].url == fast_url
+
+
+def test_stream_404_falls_back_to_the_root_endpoint(stub, use_pool):
+    """A server without "/stream" gets the same request on its non-streaming endpoint."""
+    url, server = stub(streams=False)
+    use_pool([url])
+
+    chunks = list(model_handler.generate_reply_stream("What is theft?", max_new_tokens=32, history="User: hi",
+                                                      documents="File: lease.txt"))
+    assert chunks == ["The law says."]
+    (stream_path, stream_body), (path, body) = server.requests
+    assert (stream_path, path) == ("/stream", "/")
+    assert body == stream_body  # Nothing is lost in the fallback.
+    assert body["history"] == "User: hi" and body["documents"] == "File: lease.txt"
+
+
+def test_health_check_revives_an_endpoint(stub):
+    url, server = stub(status=503)
+    pool = EndpointPool([url], health_check_interval=0)
+    try:
+        assert not pool.check_health(pool.endpoints[0])
+        assert not pool.endpoints[0].available(time.monotonic())
+        server.status = 200
+        assert pool.check_health(pool.endpoints[0])
+        assert pool.endpoints[0].available(time.monotonic())
+    finally:
+        pool.close()
@@ -0,0 +1,50 @@
+"""
+Recall of the BM25 law retrieval of the API (api/retrieval.py) on known article lookups.
+
+    python -m pytest tests
+"""
+import sys  # Makes the API modules importable.
+from pathlib import Path  # Paths of the api folder and of the corpus.
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "api"))
+from retrieval import BM25Index  # The index served by the API.
+
+CORPUS_PATH = REPO_ROOT / "DATA_USED" / "LawsTXT" / "CameroonLaw.txt"
+TOP_K = 3  # Articles the server adds to a prompt (RETRIEVAL_TOP_K).
+
+# Known lookups: (question, expected source title, expected article number).
+KNOWN_ARTICLES = [
+    ("What is the penalty for theft?", "Penal Code of Cameroon", "318"),
+    ("What does article 318 of the penal code say?", "Penal Code of Cameroon", "318"),
+    ("What is the punishment for murder?", "Penal Code of Cameroon", "276"),
+    ("Does criminal law apply to everyone?", "Penal Code of Cameroon", "1"),
+    ("Can criminal law be applied retroactively?", "Penal Code of Cameroon", "3"),
+    ("What is infanticide?", "Penal Code of Cameroon", "340"),
+    ("How can the Constitution be amended?", "Constitution of Cameroon", "65"),
+    ("Quelle est la peine pour le vol ?", "Code pénal du Cameroun", "318"),
+    ("Que dit l'article 2 du code pénal ?", "Code pénal du Cameroun", "2"),
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return BM25Index.build(CORPUS_PATH.read_text(encoding="utf-8"))
+
+
+@pytest.mark.parametrize("question, title, article", KNOWN_ARTICLES)
+def test_known_article_is_retrieved(index, question, title, article):
+    results = index.search(question, TOP_K)
+    found = [(chunk["title"], chunk["article"]) for _, chunk in results]
+    assert (title, article) in found
+
+
+def test_saved_index_gives_the_same_results(index, tmp_path):
+    """The index loaded by the server (built at Docker build time) answers like the one built in memory."""
+    path = tmp_path / "law_index.json.gz"
+    index.save(str(path))
+    loaded = BM25Index.load(str(path))
+    for question, _, _ in KNOWN_ARTICLES:
+        assert loaded.search(question, TOP_K) == index.search(question, TOP_K)
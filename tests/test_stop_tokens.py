@@ -0,0 +1,42 @@
+"""
+Tests of the stop tokens of the API (api/contact_model.py), with a tokenizer built like
+TinyLlama's: SentencePiece-style BPE with byte fallback, where a newline is "<0x0A>".
+
+    python -m pytest tests
+"""
+import sys  # Makes the API modules importable.
+from pathlib import Path  # Path of the api folder.
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("peft")
+pytest.importorskip("fastapi")
+from tokenizers import Tokenizer, decoders, models, normalizers  # Builds the small Llama-like tokenizer.
+from transformers import PreTrainedTokenizerFast
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+from contact_model import get_stop_token_ids  # The function under test.
+
+VOCAB = {"<unk>": 0, "<s>": 1, "</s>": 2, "<0x0A>": 3, "▁": 4, ".": 5, "?": 6, "!": 7, "▁law": 8}
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    """A tokenizer with the Llama layout: "▁" word prefix, and bytes outside the vocabulary as <0xNN> tokens."""
+    bpe = Tokenizer(models.BPE(vocab=VOCAB, merges=[], unk_token="<unk>", byte_fallback=True))
+    bpe.normalizer = normalizers.Sequence([normalizers.Prepend("▁"), normalizers.Replace(" ", "▁")])
+    bpe.decoder = decoders.Sequence([decoders.Replace("▁", " "), decoders.ByteFallback()])
+    return PreTrainedTokenizerFast(tokenizer_object=bpe, bos_token="<s>", eos_token="</s>", unk_token="<unk>")
+
+
+def test_newline_is_a_stop_token(tokenizer):
+    assert tokenizer.convert_tokens_to_ids("\n") == tokenizer.unk_token_id  # Why it is looked up by encoding.
+    stop_ids = get_stop_token_ids(tokenizer).tolist()
+    assert VOCAB["<0x0A>"] in stop_ids
+
+
+def test_stop_tokens(tokenizer):
+    """Sentence terminators, newline and EOS; never <unk>."""
+    assert get_stop_token_ids(tokenizer).tolist() == sorted(VOCAB[token] for token in (".", "?", "!", "<0x0A>", "</s>"))